@@ -1,9 +1,94 @@
 """
-The mailer module contains the Mailer class, a simple way to send emails.
+The mailer module contains the Mailer class, a simple way to send emails,
+the MailerPool class, for sending over several sessions at once, and the
+MailQueue class, for delivering messages in the background.
+
+On python 3.7 and later, the classes are only imported when first used,
+so importing mailer is cheap for programs that might not send mail.
 """
 from __future__ import absolute_import
+import sys
+
 # let people use: from mailer import Mailer
 # (instead of: from mailer.mailer import Mailer)
-# pylint: disable-msg=W0403
-from .mailer import Mailer
-# pylint: enable-msg=W0403
+# each name, and the module it comes from
+_EXPORTS = {
+    'AsyncMailer': 'aio',
+    'AttachmentCache': 'cache',
+    'CachingResolver': 'resolver',
+    'DirectTransport': 'transport',
+    'DNSResolver': 'resolver',
+    'IdempotencyIndex': 'idempotency',
+    'InMemoryMetrics': 'metrics',
+    'MaildirTransport': 'transport',
+    'Mailer': 'mailer',
+    'MailerPool': 'pool',
+    'MailQueue': 'spool',
+    'MemoryTransport': 'transport',
+    'MessageTemplate': 'template',
+    'NullMetrics': 'metrics',
+    'OutgoingMessage': 'message',
+    'PickupDirectoryTransport': 'transport',
+    'RateLimiter': 'throttle',
+    'Relay': 'relay',
+    'RelaySet': 'relay',
+    'Resolver': 'resolver',
+    'SendResult': 'mailer',
+    'StaticResolver': 'resolver',
+    'Transport': 'transport',
+    'build_message_bytes': 'mailer',
+    'build_message_string': 'mailer',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    """
+    Import an exported name's module (or a submodule, as importing it
+    would bind it on the package) on first use (PEP 562)
+    """
+    from importlib import import_module
+
+    if name not in _EXPORTS:
+        from importlib.util import find_spec
+
+        if name.startswith('__') or find_spec('.' + name, __name__) is None:
+            raise AttributeError("module 'mailer' has no attribute %r"
+                                 % name)
+
+        return import_module('.' + name, __name__)
+
+    value = getattr(import_module('.' + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+if sys.version_info < (3, 7):
+    # module __getattr__ isn't supported, so import everything now
+    # (apart from AsyncMailer, which needs python 3.7)
+    # pylint: disable-msg=W0403
+    from .cache import AttachmentCache
+    from .idempotency import IdempotencyIndex
+    from .mailer import (build_message_bytes, build_message_string, Mailer,
+                         SendResult)
+    from .message import OutgoingMessage
+    from .metrics import InMemoryMetrics, NullMetrics
+    from .pool import MailerPool
+    from .relay import Relay, RelaySet
+    from .resolver import (CachingResolver, DNSResolver, Resolver,
+                           StaticResolver)
+    from .spool import MailQueue
+    from .template import MessageTemplate
+    from .throttle import RateLimiter
+    from .transport import (DirectTransport, MaildirTransport,
+                            MemoryTransport, PickupDirectoryTransport,
+                            Transport)
+    # pylint: enable-msg=W0403
+
+    __all__.remove('AsyncMailer')
@@ -0,0 +1,140 @@
+"""
+Send a JSONL or CSV file of messages: python -m mailer send FILE [options]
+"""
+from __future__ import absolute_import
+import argparse
+import io
+import os
+import sys
+
+from .bulk import Checkpoint, send_file
+from .pool import MailerPool
+from .throttle import RateLimiter
+
+
+def main(args=None, stderr=None):
+    """
+    Parse the command line and send the messages. Returns the exit
+    status: 0 if every message was sent, 1 if any failed, and 130 if
+    sending was interrupted.
+    """
+    if stderr is None:
+        stderr = sys.stderr
+
+    parser = argparse.ArgumentParser(
+        prog='python -m mailer',
+        description='Send email messages.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    send = commands.add_parser(
+        'send', help='send every message in a JSONL or CSV file',
+        description="Send every message in a JSONL file (a JSON object on "
+                    "each line) or CSV file (with a header line), with "
+                    "Mailer.send's arguments as fields: recipients, "
+                    "subject, body, mail_as, cc_recipients, bcc_recipients, "
+                    "attachments and idempotency_key. In a CSV file, "
+                    "several recipients or attachments are separated with "
+                    "';'.")
+    send.add_argument('file', help='the file of messages')
+    send.add_argument('--format', choices=['jsonl', 'csv'],
+                      help='the file format (by default, .csv files are '
+                           'CSV and others JSONL)')
+    send.add_argument('--host', default='smtp.gmail.com:587',
+                      help="the server's host:port (default: %(default)s)")
+    send.add_argument('--username', default=os.environ.get('MAILER_USERNAME'),
+                      help='the username to log in with (default: '
+                           '$MAILER_USERNAME)')
+    send.add_argument('--password', default=os.environ.get('MAILER_PASSWORD'),
+                      help='the password to log in with (default: '
+                           '$MAILER_PASSWORD)')
+    send.add_argument('--implicit-tls', action='store_true',
+                      help='start TLS on connecting (port 465) instead of '
+                           'with STARTTLS')
+    send.add_argument('--connections', type=int, default=4,
+                      help='the number of messages to send at once, each '
+                           'over its own session (default: %(default)s)')
+    send.add_argument('--rate', type=float,
+                      help='the most messages to send per second')
+    send.add_argument('--subject',
+                      help="the subject of messages that don't have one, "
+                           "with $placeholders for other fields")
+    send.add_argument('--body-file',
+                      help="a file with the body of messages that don't "
+                           "have one, with $placeholders for other fields")
+    send.add_argument('--sender', help='the address to send as, for '
+                                       "messages that don't have mail_as")
+    send.add_argument('--resume', metavar='FILE',
+                      help='save progress to FILE, and carry on from the '
+                           'progress saved in it')
+    send.add_argument('--failures', metavar='FILE',
+                      help='write a JSON line to FILE for each message '
+                           'that failed')
+    send.add_argument('--interval', type=float, default=1,
+                      help='the seconds between progress reports and saves '
+                           '(default: %(default)s)')
+    options = parser.parse_args(args)
+
+    if options.username is None or options.password is None:
+        parser.error('--username and --password (or $MAILER_USERNAME and '
+                     '$MAILER_PASSWORD) are needed')
+
+    if options.connections < 1:
+        parser.error('--connections must be at least 1')
+
+    defaults = {}
+
+    if options.subject is not None:
+        defaults['subject'] = options.subject
+
+    if options.body_file is not None:
+        with io.open(options.body_file, encoding='utf-8') as body:
+            defaults['body'] = body.read()
+
+    if options.sender is not None:
+        defaults['mail_as'] = options.sender
+
+    checkpoint = None
+
+    if options.resume is not None:
+        try:
+            checkpoint = Checkpoint(options.resume, options.file)
+        except ValueError as error:
+            parser.error(str(error))
+
+    rate_limiter = None
+
+    if options.rate is not None:
+        rate_limiter = RateLimiter(options.rate, burst=options.connections)
+
+    failures = None
+
+    if options.failures is not None:
+        failures = io.open(options.failures, 'a', encoding='utf-8')
+
+    pool = MailerPool(options.username, options.password, options.host,
+                      size=options.connections,
+                      implicit_tls=options.implicit_tls,
+                      rate_limiter=rate_limiter)
+
+    try:
+        stats = send_file(pool, options.file, options.format, defaults,
+                          options.connections, checkpoint, failures,
+                          report=stderr, interval=options.interval)
+    except KeyboardInterrupt:
+        return 130
+    except ValueError as error:
+        # a line of the file that isn't a message
+        stderr.write('%s\n' % error)
+        return 1
+    finally:
+        pool.close()
+
+        if failures is not None:
+            failures.close()
+
+    return 1 if stats.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""
+The AsyncMailer class sends emails from asyncio code without blocking the
+event loop. It needs python 3 (and python 3.11 for STARTTLS).
+"""
+import asyncio
+import base64
+from functools import partial
+from smtplib import (quoteaddr, SMTPAuthenticationError, SMTPConnectError,
+                     SMTPDataError, SMTPException, SMTPNotSupportedError,
+                     SMTPRecipientsRefused, SMTPResponseException,
+                     SMTPSenderRefused, SMTPServerDisconnected)
+import ssl
+
+from .mailer import build_message_bytes, _prepare_message, _split_host
+
+
+class AsyncMailer(object):
+    """
+    The AsyncMailer class sends emails over asyncio streams. Up to
+    concurrency messages are sent at once, each over its own connection;
+    connections are kept open and reused between sends.
+    """
+    # pylint: disable-msg=R0913
+    def __init__(self, username, password, host='smtp.gmail.com:587',
+                 concurrency=10, ssl_context=None, starttls=True,
+                 timeout=60):
+        """
+        username, password, host: as for Mailer.
+        concurrency: the maximum number of messages in flight (and open
+                     connections). Default: 10
+        ssl_context: the ssl.SSLContext used for STARTTLS. If None, a
+                     default context is created. Default: None
+        starttls: whether to upgrade connections with STARTTLS before
+                  logging in. Default: True
+        timeout: seconds to wait for any reply from the server.
+                 Default: 60
+        """
+        self._username = username
+        self._password = password
+        self._hostname, self._port = _split_host(host)
+        self._concurrency = concurrency
+        self._ssl_context = ssl_context
+        self._starttls = starttls
+        self._timeout = timeout
+
+        self._semaphore = None
+        self._idle = []
+    # pylint: enable-msg=R0913
+
+    async def open(self):
+        """
+        Connect to the mail server. One connection is made (and logged
+        into) straight away, so bad settings are reported here; the rest
+        are made as sends need them.
+        """
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._idle.append(await self._connect())
+
+    async def close(self):
+        """
+        Close all connections to the mail server. Sends in progress finish
+        and then drop their connections; sends still waiting to start
+        raise SMTPServerDisconnected.
+        """
+        idle, self._idle = self._idle, []
+        self._semaphore = None
+
+        for connection in idle:
+            await connection.quit()
+
+    def is_open(self):
+        """
+        Checks whether the mailer has been opened
+        """
+        return self._semaphore is not None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.is_open():
+            await self.close()
+
+    # pylint: disable-msg=R0913
+    async def send(self, recipients, subject, body, mail_as=None,
+                   cc_recipients=None, bcc_recipients=None,
+                   attachments=None):
+        """
+        Send an email message. Takes the same arguments as Mailer.send,
+        and likewise returns a dict of the recipients the server refused.
+        Raises SMTPServerDisconnected if the mailer hasn't been opened.
+        """
+        if not self.is_open():
+            raise SMTPServerDisconnected('please run open() first')
+
+        semaphore = self._semaphore
+        prepare = partial(_prepare_message, self._username, recipients,
+                          subject, body, mail_as, cc_recipients,
+                          bcc_recipients, attachments,
+                          builder=build_message_bytes)
+
+        # (the message is built once its turn comes, so messages waiting
+        # for one aren't all held in memory)
+        async with semaphore:
+            if self._semaphore is not semaphore:
+                raise SMTPServerDisconnected('the mailer was closed')
+
+            if attachments:
+                # reading and encoding files would stall the loop
+                prepared = await asyncio.get_running_loop().run_in_executor(
+                    None, prepare)
+            else:
+                prepared = prepare()
+
+            sender, all_recipients, data = prepared
+
+            if self._idle:
+                connection = self._idle.pop()
+            else:
+                connection = await self._connect()
+
+            try:
+                refused = await connection.sendmail(sender, all_recipients,
+                                                    data)
+            except SMTPServerDisconnected:
+                connection.abort()
+                raise
+            except SMTPException:
+                # (the message was refused, but the session can be reused;
+                # SMTPException is an OSError, so this comes first)
+                self._checkin(connection, semaphore)
+                raise
+            except (OSError, asyncio.TimeoutError):
+                connection.abort()
+                raise
+
+            self._checkin(connection, semaphore)
+
+        return refused
+    # pylint: enable-msg=R0913
+
+    async def send_many(self, messages):
+        """
+        Send several email messages concurrently (up to concurrency at a
+        time).
+
+        messages: an iterable of messages, each either a dict of keyword
+                  arguments or a tuple of positional arguments for send.
+
+        Returns a list with, for each message in order, either the dict
+        of refused recipients or the exception that stopped it being sent.
+        """
+        sends = [self.send(**message) if isinstance(message, dict)
+                 else self.send(*message) for message in messages]
+
+        return await asyncio.gather(*sends, return_exceptions=True)
+
+    def _checkin(self, connection, semaphore):
+        """
+        Keep a connection for later sends, or drop it if the mailer has
+        been closed since the send using it started
+        """
+        if self._semaphore is semaphore:
+            self._idle.append(connection)
+        else:
+            connection.abort()
+
+    async def _connect(self):
+        """
+        Open a new connection and log in
+        """
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self._hostname, self._port),
+            self._timeout)
+
+        connection = _Connection(reader, writer, self._timeout)
+
+        try:
+            code, response = await connection.reply()
+
+            if code != 220:
+                raise SMTPConnectError(code, response)
+
+            await connection.ehlo()
+
+            if self._starttls:
+                await connection.starttls(self._get_ssl_context(),
+                                          self._hostname)
+
+            await connection.login(self._username, self._password)
+        except:
+            connection.abort()
+            raise
+
+        return connection
+
+    def _get_ssl_context(self):
+        """
+        The ssl context for STARTTLS, created once
+        """
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+
+        return self._ssl_context
+
+
+class _Connection(object):
+    """
+    One SMTP session over an asyncio stream
+    """
+    def __init__(self, reader, writer, timeout):
+        self._reader = reader
+        self._writer = writer
+        self._timeout = timeout
+        self._features = {}
+
+    async def reply(self):
+        """
+        Read a (possibly multi-line) reply. Returns its code and text.
+        """
+        lines = []
+
+        while True:
+            line = await asyncio.wait_for(self._reader.readline(),
+                                          self._timeout)
+
+            if not line:
+                raise SMTPServerDisconnected('connection unexpectedly '
+                                             'closed')
+
+            lines.append(line[4:].strip())
+
+            if line[3:4] != b'-':
+                break
+
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+
+        return code, b'\n'.join(lines)
+
+    async def command(self, *commands):
+        """
+        Send one or more commands at once and read a reply to each
+        """
+        self._writer.write(''.join(command + '\r\n'
+                                   for command in commands).encode('ascii'))
+        await self._writer.drain()
+
+        return [await self.reply() for _ in commands]
+
+    async def ehlo(self):
+        """
+        Identify ourselves and learn which extensions the server has
+        """
+        [(code, response)] = await self.command('EHLO localhost')
+
+        if code != 250:
+            raise SMTPResponseException(code, response)
+
+        self._features = {}
+
+        for line in response.decode('latin-1').split('\n')[1:]:
+            feature, _, parameters = line.partition(' ')
+            self._features[feature.lower()] = parameters
+
+    def has_extn(self, name):
+        """
+        Whether the server advertised an extension
+        """
+        return name.lower() in self._features
+
+    async def starttls(self, context, hostname):
+        """
+        Upgrade the connection to TLS
+        """
+        if not self.has_extn('starttls'):
+            raise SMTPNotSupportedError('STARTTLS extension not supported '
+                                        'by server.')
+
+        if not hasattr(self._writer, 'start_tls'):
+            raise SMTPNotSupportedError('STARTTLS needs python 3.11')
+
+        [(code, response)] = await self.command('STARTTLS')
+
+        if code != 220:
+            raise SMTPResponseException(code, response)
+
+        await self._writer.start_tls(context, server_hostname=hostname)
+        await self.ehlo()
+
+    async def login(self, username, password):
+        """
+        Log in with AUTH PLAIN or AUTH LOGIN
+        """
+        mechanisms = self._features.get('auth', '').upper().split()
+
+        if 'PLAIN' in mechanisms:
+            token = '\0%s\0%s' % (username, password)
+            replies = await self.command('AUTH PLAIN ' + _b64(token))
+        elif 'LOGIN' in mechanisms:
+            replies = await self.command('AUTH LOGIN ' + _b64(username))
+
+            if replies[-1][0] == 334:
+                replies = await self.command(_b64(password))
+        else:
+            raise SMTPNotSupportedError('No suitable authentication method '
+                                        'found.')
+
+        code, response = replies[-1]
+
+        if code != 235:
+            raise SMTPAuthenticationError(code, response)
+
+    async def sendmail(self, sender, recipients, data):
+        """
+        Send a message as built by mailer.build_message_bytes. Returns a
+        dict of refused recipients, raising like smtplib's sendmail if the
+        message was refused entirely.
+        """
+        commands = ['MAIL FROM:%s' % quoteaddr(sender)]
+        commands.extend('RCPT TO:%s' % quoteaddr(recipient)
+                        for recipient in recipients)
+
+        if self.has_extn('pipelining'):
+            replies = await self.command(*(commands + ['DATA']))
+            mail_reply, data_reply = replies[0], replies[-1]
+            rcpt_replies = replies[1:-1]
+        else:
+            [mail_reply] = await self.command(commands[0])
+            rcpt_replies = []
+            data_reply = None
+
+            if mail_reply[0] == 250:
+                for command in commands[1:]:
+                    rcpt_replies.extend(await self.command(command))
+
+        refused = dict((recipient, reply)
+                       for recipient, reply in zip(recipients, rcpt_replies)
+                       if reply[0] not in (250, 251))
+
+        failed = mail_reply[0] != 250 or len(refused) == len(recipients)
+
+        if data_reply is None and not failed:
+            [data_reply] = await self.command('DATA')
+
+        if data_reply is not None and data_reply[0] == 354:
+            # an empty message ends a transaction that already failed
+            self._writer.write(b'.\r\n' if failed else data)
+            await self._writer.drain()
+            data_reply = await self.reply()
+
+        if failed or data_reply[0] != 250:
+            await self.command('RSET')
+
+        if mail_reply[0] != 250:
+            raise SMTPSenderRefused(mail_reply[0], mail_reply[1], sender)
+
+        if len(refused) == len(recipients):
+            raise SMTPRecipientsRefused(refused)
+
+        if data_reply[0] != 250:
+            raise SMTPDataError(*data_reply)
+
+        return refused
+
+    async def quit(self):
+        """
+        End the session politely
+        """
+        try:
+            await self.command('QUIT')
+        except (SMTPException, OSError, asyncio.TimeoutError):
+            pass
+
+        self.abort()
+
+    def abort(self):
+        """
+        Drop the connection
+        """
+        self._writer.close()
+
+
+def _b64(text):
+    """
+    base64 encode text for an AUTH exchange
+    """
+    return base64.b64encode(text.encode('utf-8')).decode('ascii')
@@ -0,0 +1,167 @@
+"""
+The send_parallel function sends a large batch of messages from several
+processes, so building messages isn't limited to one CPU core.
+"""
+from __future__ import absolute_import
+from itertools import islice
+import multiprocessing
+from multiprocessing.util import Finalize
+import threading
+import time
+
+from .mailer import SendResult
+from .pool import MailerPool
+
+# each worker process's sessions, made by _start_worker
+_POOL = None
+
+
+class BatchResult(object):
+    """
+    The outcome of send_parallel.
+
+    results: a SendResult for each message, in the order they were given
+    elapsed: how long sending took, in seconds
+    """
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def sent(self):
+        """
+        The number of messages accepted for at least one recipient
+        """
+        return sum(1 for result in self.results if result.ok)
+
+    @property
+    def failed(self):
+        """
+        The number of messages that weren't accepted for anyone
+        """
+        return len(self.results) - self.sent
+
+    @property
+    def rate(self):
+        """
+        Messages sent per second
+        """
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return 'BatchResult(sent=%d, failed=%d, elapsed=%.3f, rate=%.1f)' % (
+            self.sent, self.failed, self.elapsed, self.rate)
+
+
+# pylint: disable-msg=R0913
+def send_parallel(messages, username, password, host='smtp.gmail.com:587',
+                  processes=None, connections_per_process=1, shard_size=100,
+                  **mailer_kwargs):
+    """
+    Send many messages from a pool of processes. Each process builds its
+    share of the messages and sends them over its own Mailer sessions.
+
+    messages: an iterable of messages, each either an OutgoingMessage,
+              a dict of keyword arguments or a tuple of positional
+              arguments for Mailer.send. They must be picklable.
+    username, password, host: as for Mailer.
+    processes: the number of processes to send from. If None, one per
+               CPU. Default: None
+    connections_per_process: the number of sessions (and sending
+                             threads) each process has. Default: 1
+    shard_size: the number of messages handed to a process at a time.
+                Default: 100
+    mailer_kwargs: any additional keyword arguments for Mailer.
+
+    Returns a BatchResult.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    start = time.time()
+
+    workers = multiprocessing.Pool(
+        processes, _start_worker,
+        (username, password, host, connections_per_process, mailer_kwargs))
+
+    try:
+        results = []
+
+        for shard in workers.imap(_send_shard, _shards(messages, shard_size)):
+            results.extend(shard)
+
+        workers.close()
+    except:
+        workers.terminate()
+        raise
+    finally:
+        workers.join()
+
+    return BatchResult(results, time.time() - start)
+# pylint: enable-msg=R0913
+
+
+def _shards(messages, size):
+    """
+    Cut a stream of messages into lists of at most size
+    """
+    messages = iter(messages)
+
+    while True:
+        shard = list(islice(messages, size))
+
+        if not shard:
+            return
+
+        yield shard
+
+
+def _start_worker(username, password, host, connections, mailer_kwargs):
+    """
+    Set up a worker process's sessions, closing them when it exits
+    """
+    global _POOL  # pylint: disable-msg=W0603
+
+    _POOL = MailerPool(username, password, host, size=connections,
+                       **mailer_kwargs)
+    Finalize(_POOL, _POOL.close, exitpriority=10)
+
+
+def _send_shard(shard):
+    """
+    Send a shard of messages, split between the process's sessions.
+    Returns a SendResult for each message, in order.
+    """
+    count = min(_POOL.size, len(shard))
+    slices = [shard[index::count] for index in range(count)]
+    results = [None] * len(slices)
+
+    def send(index):
+        """
+        send one slice over one session
+        """
+        try:
+            with _POOL.connection() as mailer:
+                results[index] = mailer.send_many(slices[index])
+        except Exception as error:  # pylint: disable-msg=W0703
+            results[index] = [SendResult([], {}, error)
+                              for _ in slices[index]]
+
+    threads = [threading.Thread(target=send, args=(index,))
+               for index in range(1, len(slices))]
+
+    for thread in threads:
+        thread.start()
+
+    send(0)
+
+    for thread in threads:
+        thread.join()
+
+    # put the results back in the shard's order
+    ordered = [None] * len(shard)
+
+    for index, sliced in enumerate(results):
+        ordered[index::count] = sliced
+
+    return ordered
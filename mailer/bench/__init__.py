@@ -0,0 +1,8 @@
+"""
+The mailer.bench package measures how quickly messages are built and
+sent. Run it with: python -m mailer.bench
+"""
+from __future__ import absolute_import
+# pylint: disable-msg=W0403
+from .benchmarks import Stats, bench_build, bench_send, run
+# pylint: enable-msg=W0403
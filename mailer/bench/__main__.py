@@ -0,0 +1,27 @@
+"""
+Run the mailer benchmarks: python -m mailer.bench [--quick]
+"""
+from __future__ import absolute_import
+import argparse
+
+from .benchmarks import run
+
+
+def main(args=None):
+    """
+    Parse the command line and run the benchmarks
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m mailer.bench',
+        description='Measure building and sending messages.')
+    parser.add_argument('--quick', action='store_true',
+                        help='send a tenth as many messages')
+    parser.add_argument('--no-isolate', dest='isolate', action='store_false',
+                        help="don't run each benchmark in its own process")
+    options = parser.parse_args(args)
+
+    run(quick=options.quick, isolate=options.isolate)
+
+
+if __name__ == '__main__':
+    main()
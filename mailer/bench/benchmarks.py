@@ -0,0 +1,306 @@
+"""
+Benchmarks of building and sending messages. Sending benchmarks talk to
+an in-process SMTPSink (with STARTTLS and, optionally, PIPELINING and
+artificial latency), so no mail server is needed.
+"""
+from __future__ import absolute_import, division
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from ..mailer import build_message_chunks, build_message_string
+from ..pool import MailerPool
+from .smtp_sink import CERTFILE, SMTPSink
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+_TIMER = getattr(time, 'perf_counter', time.time)
+
+
+class Stats(object):
+    """
+    The measurements from one benchmark.
+
+    name: what was measured
+    latencies: the seconds each message took
+    elapsed: the seconds the whole benchmark took
+    peak_rss: the process's peak resident memory in bytes, or None where
+              it can't be measured
+    """
+    def __init__(self, name, latencies, elapsed, peak_rss):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.elapsed = elapsed
+        self.peak_rss = peak_rss
+
+    @property
+    def count(self):
+        """
+        The number of messages
+        """
+        return len(self.latencies)
+
+    @property
+    def rate(self):
+        """
+        Messages per second
+        """
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, percent):
+        """
+        The latency that percent of messages took at most, in seconds
+        """
+        if not self.latencies:
+            return 0.0
+
+        index = int(round(percent / 100 * (self.count - 1)))
+
+        return self.latencies[index]
+
+    @property
+    def p50(self):
+        """
+        The median latency, in seconds
+        """
+        return self.percentile(50)
+
+    @property
+    def p99(self):
+        """
+        The 99th percentile latency, in seconds
+        """
+        return self.percentile(99)
+
+    def row(self):
+        """
+        A line for the report printed by run
+        """
+        rss = '-' if self.peak_rss is None else '%.1f' % (
+            self.peak_rss / 1024 / 1024)
+
+        return '%-56s %7d %10.1f %9.3f %9.3f %9s' % (
+            self.name, self.count, self.rate, self.p50 * 1000,
+            self.p99 * 1000, rss)
+
+
+HEADER = '%-56s %7s %10s %9s %9s %9s' % ('benchmark', 'msgs', 'msgs/sec',
+                                         'p50 ms', 'p99 ms', 'RSS MB')
+
+# what run measures; counts are divided by 10 for a quick run
+BUILD_CASES = [
+    {'count': 2000},
+    {'count': 500, 'body_size': 100 * 1024},
+    {'count': 2000, 'recipients': 100},
+    {'count': 50, 'attachment_size': 4 * 1024 * 1024},
+    {'count': 50, 'attachment_size': 4 * 1024 * 1024, 'streaming': True},
+]
+
+SEND_CASES = [
+    {'count': 1000},
+    {'count': 1000, 'concurrency': 4},
+    {'count': 500, 'latency': 0.001},
+    {'count': 500, 'latency': 0.001, 'concurrency': 4},
+    {'count': 500, 'latency': 0.001, 'batch': True},
+    {'count': 500, 'latency': 0.001, 'batch': True, 'pipelining': False},
+]
+
+
+# pylint: disable-msg=R0913, R0914
+def bench_build(count=1000, body_size=1024, recipients=1, attachment_size=0,
+                streaming=False):
+    """
+    Measure building messages.
+
+    count: the number of messages to build. Default: 1000
+    body_size: the length of each message's body. Default: 1024
+    recipients: the number of recipients of each message. Default: 1
+    attachment_size: if not 0, the size of a file attached to each
+                     message. Default: 0
+    streaming: whether to build with build_message_chunks instead of
+               build_message_string. Default: False
+
+    Returns the Stats.
+    """
+    body = ('All work and no play makes Jack a dull boy.\n' *
+            (body_size // 44 + 1))[:body_size]
+    addresses = ['user%d@example.com' % index for index in range(recipients)]
+    attachments = None
+
+    if attachment_size:
+        handle, path = tempfile.mkstemp()
+        os.write(handle, os.urandom(attachment_size))
+        os.close(handle)
+        attachments = [path]
+
+    try:
+        latencies = []
+        start = _TIMER()
+
+        for _ in range(count):
+            before = _TIMER()
+
+            if streaming:
+                for _ in build_message_chunks(addresses, 'subject', body,
+                                              'bench@example.com',
+                                              attachments=attachments):
+                    pass
+            else:
+                build_message_string(addresses, 'subject', body,
+                                     'bench@example.com',
+                                     attachments=attachments)
+
+            latencies.append(_TIMER() - before)
+
+        elapsed = _TIMER() - start
+    finally:
+        if attachments:
+            os.remove(attachments[0])
+
+    name = 'build body=%d recipients=%d attachment=%d%s' % (
+        body_size, recipients, attachment_size,
+        ' streaming' if streaming else '')
+
+    return Stats(name, latencies, elapsed, peak_rss())
+
+
+def bench_send(count=1000, concurrency=1, latency=0, pipelining=True,
+               batch=False, body_size=1024):
+    """
+    Measure sending messages to an SMTPSink over STARTTLS.
+
+    count: the number of messages to send. Default: 1000
+    concurrency: the number of sessions (and sending threads).
+                 Default: 1
+    latency: seconds the sink waits before each reply. Default: 0
+    pipelining: whether the sink offers PIPELINING. Default: True
+    batch: whether to send with send_many instead of send. Default: False
+    body_size: the length of each message's body. Default: 1024
+
+    Returns the Stats.
+    """
+    body = ('x' * 75 + '\n') * (body_size // 76 + 1)
+    shares = [count // concurrency + (1 if index < count % concurrency else 0)
+              for index in range(concurrency)]
+    latencies = []
+    lock = threading.Lock()
+
+    with SMTPSink(pipelining=pipelining, latency=latency,
+                  certfile=CERTFILE) as sink:
+        with MailerPool('bench', 'bench', sink.host,
+                        size=concurrency) as pool:
+            # log in before the clock starts
+            mailers = [pool.checkout() for _ in range(concurrency)]
+
+            for mailer in mailers:
+                pool.checkin(mailer)
+
+            def send(share):
+                """
+                send one thread's share of the messages
+                """
+                times = []
+
+                with pool.connection() as mailer:
+                    if batch:
+                        mailer.send_many(_timed(times, share, body))
+                    else:
+                        for message in _timed(times, share, body):
+                            mailer.send(*message)
+
+                with lock:
+                    latencies.extend(times)
+
+            threads = [threading.Thread(target=send, args=(share,))
+                       for share in shares]
+            start = _TIMER()
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            elapsed = _TIMER() - start
+
+    name = 'send concurrency=%d latency=%gms%s%s' % (
+        concurrency, latency * 1000, ' send_many' if batch else '',
+        '' if pipelining else ' no-pipelining')
+
+    return Stats(name, latencies, elapsed, peak_rss())
+# pylint: enable-msg=R0913, R0914
+
+
+def _timed(times, count, body):
+    """
+    Yield count messages, recording the time between each being taken
+    (that is, how long the one before took to send)
+    """
+    for index in range(count):
+        before = _TIMER()
+        yield ('to%d@example.com' % index, 'subject', body)
+        times.append(_TIMER() - before)
+
+
+def peak_rss():
+    """
+    The process's peak resident memory in bytes, or None where it can't be
+    measured
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run(quick=False, isolate=True, out=None):
+    """
+    Run every benchmark in BUILD_CASES and SEND_CASES, printing a report.
+
+    quick: divide every message count by 10. Default: False
+    isolate: run each benchmark in a fresh process, so peak memory is
+             measured per benchmark. Default: True
+    out: the file to print to. Default: sys.stdout
+
+    Returns the list of Stats.
+    """
+    if out is None:
+        out = sys.stdout
+
+    out.write(HEADER + '\n')
+
+    results = []
+    cases = ([(bench_build, case) for case in BUILD_CASES] +
+             [(bench_send, case) for case in SEND_CASES])
+
+    for function, case in cases:
+        case = dict(case)
+
+        if quick:
+            case['count'] = max(case['count'] // 10, 1)
+
+        if isolate:
+            workers = multiprocessing.Pool(1)
+
+            try:
+                stats = workers.apply(function, (), case)
+            finally:
+                workers.close()
+                workers.join()
+        else:
+            stats = function(**case)
+
+        out.write(stats.row() + '\n')
+        out.flush()
+        results.append(stats)
+
+    return results
@@ -0,0 +1,392 @@
+"""
+A small in-process SMTP server that accepts and records messages, so
+sending can be benchmarked (and tested) without a real mail server.
+"""
+from __future__ import absolute_import
+import os
+from smtplib import SMTP
+import socket
+import ssl
+import sys
+import threading
+import time
+
+from six.moves import socketserver
+
+
+# a self-signed certificate (and key) for localhost, for STARTTLS
+CERTFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'sink_cert.pem')
+
+
+class PlainSMTP(SMTP):
+    """
+    An SMTP client that skips STARTTLS, for talking to an SMTPSink (which
+    has no certificate).
+    """
+    def starttls(self, *args, **kwargs):
+        """
+        pretend tls was started
+        """
+        return (220, b'ready to start TLS')
+
+
+def refusing_host(test):
+    """
+    A 'host:port' address that refuses connections. The port stays bound
+    (but not listening) until test ends, so a connection can't land on it
+    from itself.
+    """
+    bound = socket.socket()
+    bound.bind(('127.0.0.1', 0))
+    test.addCleanup(bound.close)
+
+    return '%s:%d' % bound.getsockname()
+
+
+# the sink is a bag of settings and recordings
+# pylint: disable-msg=R0902
+class SMTPSink(object):
+    """
+    An SMTP server running in a background thread that records every
+    message it receives.
+
+    pipelining: whether to advertise PIPELINING. Default: True
+    refuse: recipients to refuse with a permanent (550) error
+    tempfail: recipients to refuse with a transient (451) error
+    latency: seconds to wait before every reply. Default: 0
+    certfile: a PEM file with the certificate and key to offer STARTTLS
+              with (such as CERTFILE). If None, STARTTLS isn't offered.
+              Default: None
+    implicit_tls: whether to speak TLS from the start of each connection
+                  (as on port 465) instead of offering STARTTLS. Needs
+                  certfile. Default: False
+    max_recipients: if not None, refuse recipients beyond this many per
+                    message with a 452 error, as many servers do.
+                    Default: None
+    broken_tls: whether to break off STARTTLS handshakes, as a server
+                with a broken TLS setup does. Needs certfile.
+                Default: False
+    """
+    # pylint: disable-msg=R0913
+    def __init__(self, pipelining=True, refuse=(), tempfail=(), latency=0,
+                 certfile=None, implicit_tls=False, max_recipients=None,
+                 broken_tls=False):
+        self.pipelining = pipelining
+        self.refuse = set(refuse)
+        self.tempfail = set(tempfail)
+        self.latency = latency
+        self.implicit_tls = implicit_tls
+        self.max_recipients = max_recipients
+        self.broken_tls = broken_tls
+
+        self.ssl_context = None
+
+        if certfile is not None:
+            self.ssl_context = ssl.SSLContext(
+                getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+            self.ssl_context.load_cert_chain(certfile)
+
+        self.messages = []
+        self.connections = 0
+        self.noops = 0
+
+        self._handlers = set()
+
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.sink = self
+        self._thread = None
+    # pylint: enable-msg=R0913
+
+    @property
+    def host(self):
+        """
+        The 'host:port' address the sink listens on
+        """
+        return '%s:%d' % self._server.server_address
+
+    def start(self):
+        """
+        Start accepting connections
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop accepting connections
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def drop(self):
+        """
+        Close every open session, as a server timing out idle ones does
+        """
+        with self._lock:
+            handlers = list(self._handlers)
+
+        for handler in handlers:
+            try:
+                handler.connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def record(self, sender, recipients, data):
+        """
+        Store a received message
+        """
+        with self._lock:
+            self.messages.append((sender, recipients, data))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+# pylint: enable-msg=R0902
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    A threaded TCP server that doesn't block shutdown on open sessions
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def get_request(self):
+        connection, address = socketserver.TCPServer.get_request(self)
+        # pipelined replies are written one at a time; without this, Nagle
+        # holds each back until the client's delayed ack
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        return connection, address
+
+    def handle_error(self, request, client_address):
+        # clients that reject the sink's certificate are expected
+        if not isinstance(sys.exc_info()[1], ssl.SSLError):
+            socketserver.TCPServer.handle_error(self, request,
+                                                client_address)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP to accept messages
+    """
+    # the handler and the sink share its private state
+    # pylint: disable-msg=W0212
+    def setup(self):
+        if self.server.sink.implicit_tls:
+            self.request = self.server.sink.ssl_context.wrap_socket(
+                self.request, server_side=True)
+
+        socketserver.StreamRequestHandler.setup(self)
+
+        with self.server.sink._lock:
+            self.server.sink._handlers.add(self)
+
+    def finish(self):
+        with self.server.sink._lock:
+            self.server.sink._handlers.discard(self)
+
+        try:
+            socketserver.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+    # pylint: enable-msg=W0212
+
+    def reply(self, *lines):
+        """
+        Send a (possibly multi-line) reply
+        """
+        sink = self.server.sink
+
+        if sink.latency:
+            time.sleep(sink.latency)
+
+        lines = [line.encode('ascii') for line in lines]
+        last = len(lines) - 1
+        self.wfile.write(b''.join(
+            line[:3] + (b' ' if index == last else b'-') + line[4:] + b'\r\n'
+            for index, line in enumerate(lines)))
+
+    def readline(self):
+        """
+        Read a command line, or None if the client went away
+        """
+        try:
+            line = self.rfile.readline()
+        except socket.error:
+            return None
+
+        if not line:
+            return None
+
+        return line.rstrip(b'\r\n').decode('latin-1')
+
+    def start_tls(self, context):
+        """
+        Switch the connection to TLS
+        """
+        self.connection = context.wrap_socket(self.connection,
+                                              server_side=True)
+        self.rfile = self.connection.makefile('rb', -1)
+        self.wfile = self.connection.makefile('wb', 0)
+        self.tls = True
+
+    def break_tls(self):
+        """
+        Answer a TLS handshake with something that isn't TLS, and wait for
+        the client to give up
+        """
+        # (the client's hello is read first, so closing with it unread
+        # doesn't reset the connection before the client sees the answer)
+        self.connection.recv(65536)
+        self.connection.sendall(b'this is not TLS\r\n')
+
+        try:
+            while self.connection.recv(65536):
+                pass
+        except socket.error:
+            pass
+
+    # a state machine is long by nature
+    # pylint: disable-msg=R0912, R0915
+    def handle(self):
+        sink = self.server.sink
+        self.tls = sink.implicit_tls
+
+        with sink._lock:  # pylint: disable-msg=W0212
+            sink.connections += 1
+
+        self.reply('220 sink ready')
+
+        sender, recipients = None, []
+
+        while True:
+            line = self.readline()
+
+            if line is None:
+                return
+
+            verb = line.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                lines = ['250 sink', '250 AUTH PLAIN LOGIN']
+
+                if sink.pipelining:
+                    lines.append('250 PIPELINING')
+
+                if sink.ssl_context is not None and not self.tls:
+                    lines.append('250 STARTTLS')
+
+                self.reply(*lines)
+            elif verb == 'HELO':
+                self.reply('250 sink')
+            elif verb == 'AUTH':
+                self.authenticate(line.split()[1:])
+            elif verb == 'MAIL':
+                sender, recipients = _address(line), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = _address(line)
+
+                if sender is None:
+                    self.reply('503 need MAIL first')
+                elif recipient in sink.refuse:
+                    self.reply('550 no such user')
+                elif recipient in sink.tempfail:
+                    self.reply('451 try again later')
+                elif (sink.max_recipients is not None and
+                      len(recipients) >= sink.max_recipients):
+                    self.reply('452 too many recipients')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply('554 no valid recipients')
+                    continue
+
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                data = self.read_data()
+
+                if data is None:
+                    return
+
+                sink.record(sender, recipients, data)
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'STARTTLS' and sink.broken_tls:
+                self.reply('220 ready to start TLS')
+                self.break_tls()
+                return
+            elif verb == 'STARTTLS' and sink.ssl_context is not None:
+                self.reply('220 ready to start TLS')
+                self.start_tls(sink.ssl_context)
+                sender, recipients = None, []
+            elif verb == 'NOOP':
+                with sink._lock:  # pylint: disable-msg=W0212
+                    sink.noops += 1
+
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 command not implemented')
+    # pylint: enable-msg=R0912, R0915
+
+    def authenticate(self, arguments):
+        """
+        Accept any credentials
+        """
+        mechanism = arguments[0].upper() if arguments else ''
+
+        if mechanism == 'PLAIN' and len(arguments) == 1:
+            self.reply('334 ')
+            self.readline()
+        elif mechanism == 'LOGIN':
+            if len(arguments) == 1:
+                self.reply('334 VXNlcm5hbWU6')
+                self.readline()
+
+            self.reply('334 UGFzc3dvcmQ6')
+            self.readline()
+
+        self.reply('235 authenticated')
+
+    def read_data(self):
+        """
+        Read a message up to the terminating '.', undoing dot-stuffing
+        """
+        lines = []
+
+        while True:
+            line = self.rfile.readline()
+
+            if not line:
+                return None
+
+            if line in (b'.\r\n', b'.\n'):
+                return b''.join(lines)
+
+            if line.startswith(b'.'):
+                line = line[1:]
+
+            lines.append(line)
+
+
+def _address(line):
+    """
+    Pull the address out of a MAIL FROM:<...> or RCPT TO:<...> command
+    """
+    return line[line.index('<') + 1:line.index('>')]
@@ -0,0 +1,471 @@
+"""
+The send_file function sends every message in a JSONL or CSV file, over
+several sessions at once, as `python -m mailer send` does. The file is
+read as it is sent, so it can be any size, and progress is checkpointed
+so an interrupted run can carry on where it stopped.
+"""
+from __future__ import absolute_import, division
+import csv
+import io
+import json
+import os
+from string import Template
+import threading
+
+import six
+from six.moves import queue
+
+from .metrics import _TIMER
+
+# the fields of a message that are passed to Mailer.send
+_FIELDS = ('recipients', 'subject', 'body', 'mail_as', 'cc_recipients',
+           'bcc_recipients', 'attachments', 'idempotency_key')
+
+# the fields that hold lists, separated by ';' in a CSV file
+_LIST_FIELDS = ('recipients', 'cc_recipients', 'bcc_recipients',
+                'attachments')
+
+# the upper bounds of the latency histogram's buckets, in seconds
+_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5,
+            10, 30, 60, float('inf'))
+
+# the widest bar in the latency histogram
+_BAR_WIDTH = 40
+
+# os.rename can't replace a file on windows (and python 2 has no replace)
+_replace = getattr(os, 'replace', os.rename)  # pylint: disable-msg=C0103
+
+
+class BulkStats(object):
+    """
+    The BulkStats class counts what happened to the messages sent by
+    send_file. Only counts are kept (latencies go into a histogram), so it
+    stays the same size however many messages are sent. It is safe to
+    share between threads.
+
+    sent: messages accepted for at least one recipient
+    failed: messages that couldn't be sent
+    refused: recipients refused by the server (of messages that were sent)
+    skipped: messages left out as an earlier run had sent them
+    """
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.refused = 0
+        self.skipped = 0
+
+        self._buckets = [0] * len(_BUCKETS)
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._start = _TIMER()
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self):
+        """
+        The seconds since sending started
+        """
+        return _TIMER() - self._start
+
+    @property
+    def rate(self):
+        """
+        Messages sent (or failed) per second
+        """
+        elapsed = self.elapsed
+
+        return (self.sent + self.failed) / elapsed if elapsed else 0.0
+
+    def record(self, latency, refused=None, failed=False):
+        """
+        Count a message that took latency seconds to send (or fail), with
+        a dict of its refused recipients
+        """
+        index = 0
+
+        while latency > _BUCKETS[index]:
+            index += 1
+
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.sent += 1
+                self.refused += len(refused or ())
+
+            self._buckets[index] += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+
+    def summary(self):
+        """
+        A line saying how many messages were sent, how fast, and how many
+        failed
+        """
+        return ('%d sent, %d failed, %d recipients refused, %d skipped in '
+                '%.1fs (%.1f msgs/s)' % (self.sent, self.failed,
+                                         self.refused, self.skipped,
+                                         self.elapsed, self.rate))
+
+    def histogram(self):
+        """
+        The latency histogram, as lines of text: each bucket's upper bound,
+        count and a bar, from the first bucket with any messages to the
+        last
+        """
+        with self._lock:
+            buckets = list(self._buckets)
+            count = sum(buckets)
+            total, longest = self._total_latency, self._max_latency
+
+        if not count:
+            return ['no messages sent']
+
+        used = [index for index, bucket in enumerate(buckets) if bucket]
+        widest = max(buckets)
+        lines = ['latency      messages']
+
+        for index in range(used[0], used[-1] + 1):
+            lines.append(('%8s %11d %s' % (
+                _bound(_BUCKETS[index]), buckets[index],
+                '#' * int(round(buckets[index] * _BAR_WIDTH / widest)))
+                          ).rstrip())
+
+        lines.append('mean %.1fms, max %.1fms' % (total / count * 1000,
+                                                  longest * 1000))
+
+        return lines
+
+
+class Checkpoint(object):
+    """
+    The Checkpoint class records how far through an input file sending
+    has got: the number of its first messages that have all been sent
+    (or failed). Messages finish out of order, so those finished beyond
+    that are remembered until the ones before them are. It is saved to a
+    small JSON file, replaced atomically, along with the input's path (so
+    it isn't used to resume a different file).
+    """
+    def __init__(self, path, source):
+        """
+        path: the file to save the checkpoint in. If it exists, sending
+              carries on from the checkpoint saved in it.
+        source: the path of the input file
+
+        Raises ValueError if the saved checkpoint is for another file.
+        """
+        self.path = path
+        self.done = 0
+
+        self._source = os.path.abspath(source)
+        self._finished = set()
+        self._saved = None
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with io.open(path, encoding='utf-8') as saved:
+                state = json.load(saved)
+
+            if state['source'] != self._source:
+                raise ValueError('%s is a checkpoint for %s, not %s' % (
+                    path, state['source'], self._source))
+
+            self.done = self._saved = state['done']
+
+    def finish(self, number):
+        """
+        Record that the message numbered number (counting from 1) has been
+        sent or has failed
+        """
+        with self._lock:
+            self._finished.add(number)
+
+            while self.done + 1 in self._finished:
+                self.done += 1
+                self._finished.remove(self.done)
+
+    def save(self):
+        """
+        Write the checkpoint to its file, if it has moved on
+        """
+        with self._lock:
+            done = self.done
+
+        if done == self._saved:
+            return
+
+        temporary = self.path + '.tmp'
+
+        with io.open(temporary, 'w', encoding='utf-8') as output:
+            output.write(six.text_type(json.dumps(
+                {'source': self._source, 'done': done})))
+
+        _replace(temporary, self.path)
+        self._saved = done
+
+
+def read_messages(path, file_format=None, defaults=None):
+    """
+    Read the messages in a file, one at a time.
+
+    path: a JSONL file, with a JSON object on each line, or a CSV file,
+          with a header line naming its columns. Each message's fields are
+          the arguments of Mailer.send (recipients, subject, body and so
+          on; in a CSV file, several recipients or attachments are
+          separated with ';'). Other fields are ignored, apart from
+          filling in defaults.
+    file_format: 'jsonl' or 'csv'. If None, it is worked out from the
+                 file's extension (.csv, or anything else for JSONL).
+                 Default: None
+    defaults: a dict of fields for messages that don't have them. Their
+              $placeholders (as used by string.Template) are filled in
+              with each message's fields, so a subject of 'Hi $name'
+              greets each recipient by the name column. Default: None
+
+    Yields the messages, each as a dict of keyword arguments for
+    Mailer.send. Raises ValueError for a line that isn't a message.
+    """
+    if file_format is None:
+        file_format = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+    if file_format == 'csv':
+        rows = _read_csv(path)
+    elif file_format == 'jsonl':
+        rows = _read_jsonl(path)
+    else:
+        raise ValueError('unknown format %r' % (file_format,))
+
+    templates = dict((name, Template(value))
+                     for name, value in (defaults or {}).items()
+                     if isinstance(value, six.string_types))
+
+    for row in rows:
+        message = dict((name, row[name]) for name in _FIELDS
+                       if row.get(name) not in (None, ''))
+
+        for name, value in (defaults or {}).items():
+            if name not in message:
+                message[name] = templates[name].safe_substitute(row) \
+                    if name in templates else value
+
+        yield message
+
+
+# pylint: disable-msg=R0913, R0914
+def send_file(pool, path, file_format=None, defaults=None, connections=4,
+              checkpoint=None, failures=None, report=None, interval=1):
+    """
+    Send every message in a file (see read_messages) through a MailerPool,
+    connections at a time. The file is read as messages are sent, only a
+    few ahead of them, so it is never held in memory.
+
+    pool: the MailerPool to send through, with at least connections
+          sessions
+    path, file_format, defaults: as for read_messages
+    connections: the number of messages to send at once. Default: 4
+    checkpoint: a Checkpoint to record progress in, and to skip the
+                messages it says were already sent. Default: None
+    failures: a file (opened for writing text) to write a JSON line to
+              for each message that failed: its number, the error and
+              the message. Default: None
+    report: a file (such as sys.stderr) to write how sending is going to
+            every interval seconds. Default: None
+    interval: the seconds between reports and checkpoint saves.
+              Default: 1
+
+    Returns the BulkStats. If sending is interrupted (by Ctrl-C), the
+    messages already being sent are finished and the checkpoint saved
+    before KeyboardInterrupt is raised again. The same happens if a line
+    of the file isn't a message, and its ValueError is raised.
+    """
+    stats = BulkStats()
+    pending = queue.Queue(connections * 4)
+    failures_lock = threading.Lock()
+    stop = threading.Event()
+
+    def work():
+        """
+        send messages from the queue until it hands out None
+        """
+        while True:
+            item = pending.get()
+
+            if item is None:
+                return
+
+            number, message = item
+            start = _TIMER()
+
+            try:
+                refused = pool.send(**message)
+            except Exception as error:  # pylint: disable-msg=W0703
+                stats.record(_TIMER() - start, failed=True)
+
+                if failures is not None:
+                    line = json.dumps({'number': number, 'error': repr(error),
+                                       'message': message})
+
+                    with failures_lock:
+                        failures.write(six.text_type(line + '\n'))
+            else:
+                stats.record(_TIMER() - start, refused)
+
+            if checkpoint is not None:
+                checkpoint.finish(number)
+
+    def watch():
+        """
+        report progress and save the checkpoint until sending stops
+        """
+        while not stop.wait(interval):
+            if checkpoint is not None:
+                checkpoint.save()
+
+            if report is not None:
+                _report(report, stats)
+
+    workers = [threading.Thread(target=work) for _ in range(connections)]
+    watcher = threading.Thread(target=watch)
+    watcher.daemon = True
+
+    for thread in workers + [watcher]:
+        thread.start()
+
+    done = 0 if checkpoint is None else checkpoint.done
+
+    try:
+        for number, message in enumerate(
+                read_messages(path, file_format, defaults), 1):
+            if number <= done:
+                stats.skipped += 1
+                continue
+
+            pending.put((number, message))
+    except KeyboardInterrupt:
+        # messages that haven't started are left for the next run
+        _drain(pending)
+        raise
+    finally:
+        for _ in workers:
+            pending.put(None)
+
+        for thread in workers:
+            _join(thread)
+
+        stop.set()
+        watcher.join()
+
+        if checkpoint is not None:
+            checkpoint.save()
+
+        if report is not None:
+            _report(report, stats, final=True)
+
+    return stats
+# pylint: enable-msg=R0913, R0914
+
+
+def _read_jsonl(path):
+    """
+    The JSON objects on each (non-blank) line of a file
+    """
+    with io.open(path, encoding='utf-8') as lines:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                raise ValueError('line %d of %s: %s' % (number, path, error))
+
+            if not isinstance(row, dict):
+                raise ValueError('line %d of %s is not a JSON object'
+                                 % (number, path))
+
+            yield row
+
+
+def _read_csv(path):
+    """
+    The rows of a CSV file, as dicts of its header's columns, with lists
+    split on ';'
+    """
+    # python 2's csv module only reads bytes
+    if six.PY2:
+        lines = open(path, 'rb')
+    else:
+        lines = io.open(path, encoding='utf-8', newline='')
+
+    with lines:
+        for row in csv.DictReader(lines):
+            row = dict((_text(name), _text(value or ''))
+                       for name, value in row.items() if name is not None)
+
+            for name in _LIST_FIELDS:
+                if row.get(name):
+                    row[name] = [value.strip()
+                                 for value in row[name].split(';')
+                                 if value.strip()]
+
+            yield row
+
+
+def _text(value):
+    """
+    A CSV cell as text (python 2 reads bytes)
+    """
+    if isinstance(value, six.binary_type):
+        return value.decode('utf-8')
+
+    return value
+
+
+def _report(stream, stats, final=False):
+    """
+    Write a line of progress (or, when sending is over, the summary and
+    latency histogram)
+    """
+    if final:
+        # (ending the progress line on a terminal)
+        stream.write(('\n' if stream.isatty() else '') +
+                     '\n'.join([stats.summary()] + stats.histogram()) + '\n')
+    elif stream.isatty():
+        # one line, rewritten in place
+        stream.write('\r' + stats.summary() + '\033[K')
+    else:
+        stream.write(stats.summary() + '\n')
+
+    stream.flush()
+
+
+def _bound(seconds):
+    """
+    A histogram bucket's upper bound, for display
+    """
+    if seconds == float('inf'):
+        return 'more'
+
+    if seconds < 1:
+        return '<%gms' % (seconds * 1000)
+
+    return '<%gs' % seconds
+
+
+def _drain(pending):
+    """
+    Throw away everything in a queue
+    """
+    while True:
+        try:
+            pending.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _join(thread):
+    """
+    Wait for a thread, in a way Ctrl-C can interrupt on python 2
+    """
+    while thread.is_alive():
+        thread.join(0.1)
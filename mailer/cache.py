@@ -0,0 +1,114 @@
+"""
+The AttachmentCache class keeps encoded attachments in memory, so a file
+sent many times is only read and encoded once.
+"""
+from __future__ import absolute_import
+from collections import OrderedDict
+import os
+import threading
+
+from .mailer import _encode_file, _encoded_size
+
+
+class AttachmentCache(object):
+    """
+    The AttachmentCache class is a least-recently-used cache of base64
+    encoded attachments, keyed by each file's path, size and modification
+    time (and how it was compressed), so a file that changes is encoded
+    again. It is safe to share between threads (and so between the
+    Mailers of a MailerPool).
+
+    hits, misses and evictions count how the cache has been used.
+    """
+    def __init__(self, max_size=64 * 1024 * 1024):
+        """
+        max_size: the most encoded bytes to keep. Files that would be
+                  bigger than this once encoded are streamed from disk
+                  instead of being cached. Default: 64 MiB
+        """
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._keys = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def size(self):
+        """
+        The number of encoded bytes currently cached
+        """
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def chunks(self, path, compress=None):
+        """
+        The encoded content of a file, as a list of strings (or, for a
+        file too big to cache, a generator of them)
+
+        compress: how to compress the file, as for build_message_string.
+                  Default: None
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        # (a file compressed different ways is a different attachment)
+        key = ((path, compress), stat.st_size, stat.st_mtime)
+
+        with self._lock:
+            encoded = self._entries.pop(key, None)
+
+            if encoded is not None:
+                self._entries[key] = encoded
+                self.hits += 1
+                return [encoded]
+
+            self.misses += 1
+
+        if _encoded_size(stat.st_size) > self._max_size:
+            return _encode_file(path, compress=compress)
+
+        encoded = ''.join(_encode_file(path, compress=compress))
+
+        with self._lock:
+            self._store(key, encoded)
+
+        return [encoded]
+
+    def clear(self):
+        """
+        Empty the cache (the counters are kept)
+        """
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._size = 0
+
+    def _store(self, key, encoded):
+        """
+        Add an entry, replacing any older version of the same file and
+        evicting the least recently used entries to make room
+        """
+        stale = self._keys.get(key[0])
+
+        if stale is not None and stale in self._entries:
+            self._size -= len(self._entries.pop(stale))
+
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+
+        self._entries[key] = encoded
+        self._keys[key[0]] = key
+        self._size += len(encoded)
+
+        while self._size > self._max_size:
+            old_key, old = self._entries.popitem(last=False)
+            self._size -= len(old)
+            self.evictions += 1
+
+            if self._keys.get(old_key[0]) == old_key:
+                del self._keys[old_key[0]]
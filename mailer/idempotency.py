@@ -0,0 +1,171 @@
+"""
+The IdempotencyIndex class remembers which messages a Mailer has sent, by
+idempotency key, so sending one again (such as when a job is retried after
+a crash) is skipped.
+"""
+from __future__ import absolute_import
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sent (
+    key TEXT PRIMARY KEY,
+    sent REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sent_by_time ON sent (sent);
+"""
+
+# the database is pruned of forgotten keys after this many are added
+_PRUNE_EVERY = 1000
+
+
+class IdempotencyIndex(object):
+    """
+    The IdempotencyIndex class is a bounded set of the idempotency keys of
+    sent messages. Keys are forgotten ttl seconds after they were sent, or
+    once there are more than max_entries, oldest first. Looking a key up
+    takes constant time.
+
+    With a path, keys are also stored in an SQLite database, so they are
+    remembered across restarts. It is safe to share between threads (and
+    so between the Mailers of a MailerPool).
+    """
+    def __init__(self, ttl=24 * 60 * 60, max_entries=100000, path=None):
+        """
+        ttl: how many seconds to remember a key for. Default: 86400
+        max_entries: the most keys to remember. Default: 100000
+        path: the SQLite database file to store keys in. If None, they are
+              only kept in memory. Default: None
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+
+        # key: when it was sent, oldest first
+        self._entries = OrderedDict()
+        # keys being sent now
+        self._pending = set()
+        self._lock = threading.Lock()
+
+        self._database = None
+        self._added = 0
+
+        if path is not None:
+            self._database = sqlite3.connect(path, isolation_level=None,
+                                             check_same_thread=False)
+
+            with self._lock:
+                self._database.execute('PRAGMA journal_mode=WAL')
+                self._database.executescript(_SCHEMA)
+                self._prune()
+
+                rows = self._database.execute(
+                    'SELECT key, sent FROM sent ORDER BY sent DESC LIMIT ?',
+                    (max_entries,)).fetchall()
+
+            for key, sent in reversed(rows):
+                self._entries[key] = sent
+
+    def __len__(self):
+        with self._lock:
+            self._evict()
+
+            return len(self._entries)
+
+    def __contains__(self, key):
+        """
+        Whether a message with key was sent (within ttl)
+        """
+        with self._lock:
+            self._evict()
+
+            return key in self._entries
+
+    def claim(self, key):
+        """
+        Start sending the message with key. Returns False, if it has
+        already been sent or is being sent now, or True, in which case
+        complete or abandon must be called once sending is over.
+        """
+        with self._lock:
+            self._evict()
+
+            if key in self._entries or key in self._pending:
+                return False
+
+            self._pending.add(key)
+
+            return True
+
+    def complete(self, key):
+        """
+        Record that the claimed message with key was sent
+        """
+        now = time.time()
+
+        with self._lock:
+            self._pending.discard(key)
+            self._entries.pop(key, None)
+            self._entries[key] = now
+            self._evict()
+
+            if self._database is not None:
+                self._database.execute(
+                    'INSERT OR REPLACE INTO sent (key, sent) VALUES (?, ?)',
+                    (key, now))
+                self._added += 1
+
+                if self._added % _PRUNE_EVERY == 0:
+                    self._prune()
+
+    def abandon(self, key):
+        """
+        Record that the claimed message with key wasn't sent, so it can be
+        tried again
+        """
+        with self._lock:
+            self._pending.discard(key)
+
+    def add(self, key):
+        """
+        Record that a message with key was sent
+        """
+        self.complete(key)
+
+    def close(self):
+        """
+        Close the database, if there is one
+        """
+        if self._database is not None:
+            with self._lock:
+                self._database.close()
+                self._database = None
+
+    def _evict(self):
+        """
+        Forget keys past their ttl, and the oldest beyond max_entries
+        """
+        cutoff = time.time() - self._ttl
+        entries = self._entries
+
+        while entries and (len(entries) > self._max_entries or
+                           entries[next(iter(entries))] <= cutoff):
+            entries.popitem(last=False)
+
+    def _prune(self):
+        """
+        Delete the keys the index has forgotten from the database
+        """
+        self._database.execute('DELETE FROM sent WHERE sent <= ?',
+                               (time.time() - self._ttl,))
+        self._database.execute(
+            'DELETE FROM sent WHERE key NOT IN '
+            '(SELECT key FROM sent ORDER BY sent DESC LIMIT ?)',
+            (self._max_entries,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
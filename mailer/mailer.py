@@ -2,47 +2,365 @@
 The Mailer class provides a simple way to send emails.
 """
 from __future__ import absolute_import
-from email.mime.application import MIMEApplication
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+try:
+    from base64 import encodebytes as _encodebytes
+except ImportError:  # python 2
+    from base64 import encodestring as _encodebytes
+from collections import OrderedDict
+from email.header import Header
+from email.utils import parseaddr
 import os
-from smtplib import SMTP
+from functools import partial
+import hashlib
+from itertools import chain
+import re
+from smtplib import (quoteaddr, SMTP, SMTPDataError, SMTPException,
+                     SMTPRecipientsRefused, SMTPResponseException,
+                     SMTPSenderRefused, SMTPServerDisconnected)
+import socket
+import ssl
 import six
+import struct
+import threading
+import time
+import uuid
+import weakref
+import zlib
+
+from .message import OutgoingMessage
+from .metrics import _TIMER, NullMetrics
+from .relay import RelaySet
 
 _ENCODING = 'utf-8'
 
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+# attachments are encoded this many bytes at a time. base64 turns each 57
+# bytes into one 76 character line, so chunks hold whole lines.
+_CHUNK_SIZE = 57 * 1024
+
+# the ways attachments can be compressed
+GZIP = 'gzip'
+ZIP = 'zip'
+
+# attachments with these extensions are already compressed, so are sent as
+# they are
+_COMPRESSED_EXTENSIONS = frozenset([
+    '.7z', '.bz2', '.docx', '.gif', '.gz', '.jpeg', '.jpg', '.mp3', '.mp4',
+    '.png', '.pptx', '.rar', '.tgz', '.webp', '.xlsx', '.xz', '.zip'])
+
+# the SSL context used when a Mailer isn't given one, made by
+# _default_ssl_context
+_DEFAULT_SSL_CONTEXT = None
+
+# the last TLS session with each host, by SSL context, so new connections
+# can resume it instead of doing a full handshake
+_TLS_SESSIONS = weakref.WeakKeyDictionary()
+_TLS_SESSIONS_LOCK = threading.Lock()
+
+
+class SendResult(object):
+    """
+    The outcome of sending one message with Mailer.send_many.
+
+    accepted: a list of the recipients the server accepted
+    refused: a dict of each refused recipient to the server's
+             (code, response)
+    error: the exception that stopped the message from being sent, or
+           None. A transient failure is an SMTPResponseException with a
+           4xx code, or a dropped connection.
+    duplicate: whether the message was skipped, as its idempotency key
+               had already been sent
+    """
+    def __init__(self, accepted, refused=None, error=None, duplicate=False):
+        self.accepted = accepted
+        self.refused = refused or {}
+        self.error = error
+        self.duplicate = duplicate
+
+    @property
+    def ok(self):
+        """
+        Whether the message was accepted for at least one recipient (or
+        had been before, for a duplicate)
+        """
+        return self.duplicate or (self.error is None and bool(self.accepted))
+
+    def __repr__(self):
+        if self.duplicate:
+            return 'SendResult(duplicate=True)'
+
+        return 'SendResult(%r, %r, %r)' % (self.accepted, self.refused,
+                                            self.error)
+
 
 class Mailer(object):
     """
     The Mailer class provides a simple way to send emails.
     """
-    def __init__(self, username, password, host='smtp.gmail.com:587'):
+    # pylint: disable-msg=R0902, R0913
+    def __init__(self, username, password, host='smtp.gmail.com:587',
+                 attachment_cache=None, metrics=None, retries=1,
+                 keepalive=None, max_messages=None, max_age=None,
+                 ssl_context=None, implicit_tls=False, max_recipients=None,
+                 rate_limiter=None, transport=None, idempotency_index=None,
+                 compress=None, max_message_size=None):
+        """
+        username, password: the credentials to log into the server with
+        host: the 'host:port' address of the server, or several relays to
+              send through: a list of them (each a 'host:port' address, a
+              dict of Relay's arguments, or a Relay) or a RelaySet. Each
+              session goes to the relay the RelaySet chooses (and stays
+              with it until the session ends), and if it can't be
+              connected or logged in to, the next one is tried.
+              Default: 'smtp.gmail.com:587'
+        attachment_cache: an AttachmentCache, so attachments sent more
+                          than once are only encoded once. Default: None
+        metrics: a collector (such as an InMemoryMetrics) to report
+                 timings and counts to. If None, nothing is collected.
+                 Default: None
+        retries: the number of times to reconnect and try a message
+                 again when the session turns out to have been dropped.
+                 Default: 1
+        keepalive: if not None, send a NOOP after the session has been
+                   idle this many seconds, so the server doesn't time it
+                   out. Default: None
+        max_messages: if not None, start a new session after this many
+                      messages. Default: None
+        max_age: if not None, start a new session once one is this many
+                 seconds old. Default: None
+        ssl_context: the ssl.SSLContext to secure connections with. Pass
+                     one from ssl.create_default_context() to verify the
+                     server's certificate. If None, a context made once per
+                     process that (like smtplib's) doesn't verify it is
+                     used. Default: None
+        implicit_tls: whether to start TLS as soon as the connection is
+                      made (SMTPS, usually on port 465) instead of with
+                      STARTTLS. Default: False
+        max_recipients: if not None, send each message in envelopes of at
+                        most this many recipients (servers often refuse
+                        more than 100), with recipients at the same domain
+                        kept together. The message is built once (in
+                        memory, even with attachments) and sent in each
+                        envelope. Default: None
+        rate_limiter: a RateLimiter to pace sending with. It is told about
+                      4xx replies and dropped connections, so it slows
+                      down when the server pushes back. Share one between
+                      Mailers sending through the same host (as a
+                      MailerPool does). Default: None
+        transport: a Transport (such as a MaildirTransport) to hand
+                   messages to instead of sending them over SMTP. host and
+                   the settings for SMTP sessions are then unused.
+                   Default: None
+        idempotency_index: an IdempotencyIndex recording the idempotency
+                           keys of sent messages, so sending one again is
+                           skipped. Share one between Mailers sending the
+                           same messages. Default: None
+        compress: GZIP ('gzip') or ZIP ('zip') to compress attachments as
+                  they are encoded (see build_message_string).
+                  Default: None
+        max_message_size: if not None, send splits a message whose
+                          attachments would make it bigger than this many
+                          bytes into several, each with some of the
+                          attachments (see send). Default: None
+        """
+        if compress not in (None, GZIP, ZIP):
+            raise ValueError('unknown compression %r' % (compress,))
+
         self._username = username
         self._password = password
-        self._host = host
+        self._relays = host if isinstance(host, RelaySet) else RelaySet(
+            [host] if isinstance(host, six.string_types) else host)
+        self._relay = None
+        self._attachment_cache = attachment_cache
+        self._metrics = NullMetrics() if metrics is None else metrics
+
+        self._retries = retries
+        self._keepalive = keepalive
+        self._max_messages = max_messages
+        self._max_age = max_age
+        self._ssl_context = ssl_context
+        self._implicit_tls = implicit_tls
+        self._max_recipients = max_recipients
+        self._rate_limiter = rate_limiter
+        self._transport = transport
+        self._idempotency_index = idempotency_index
+        self._compress = compress
+        self._max_message_size = max_message_size
 
         self._server = None
+        self._opened = False
+        self._opened_at = 0
+        self._last_used = 0
+        self._session_messages = 0
+        self._keepalive_stop = None
+        # sends, and the keepalive thread, take turns with the session
+        self._lock = threading.RLock()
+    # pylint: enable-msg=R0913
+
+    @property
+    def metrics(self):
+        """
+        The collector timings and counts are reported to
+        """
+        return self._metrics
+
+    @property
+    def relay(self):
+        """
+        The Relay the open session is with, or None
+        """
+        return self._relay
 
     def open(self):
         """
-        Open the mail server for sending messages
+        Open the mail server for sending messages. The last TLS session
+        with the server (from this or any Mailer with the same ssl_context)
+        is resumed if the server allows, which saves most of the handshake.
+
+        With several relays, each is tried in turn (as the RelaySet
+        chooses) until one can be connected and logged in to. Those that
+        fail are left out by the RelaySet for a while, and the last error
+        is raised if they all fail.
+        """
+        if self._transport is not None:
+            self._transport.open()
+            return
+
+        if self._opened:
+            self._metrics.incr('reconnects')
+
+        self._opened = True
+
+        context = self._ssl_context
+
+        if context is None:
+            context = _default_ssl_context()
+
+        tried = set()
+
+        while True:
+            relay = self._relays.choose(exclude=tried)
+
+            try:
+                self._connect(relay, context)
+                break
+            except (SMTPException, socket.error):
+                self._metrics.incr('relay_failures')
+                self._relays.failed(relay)
+                tried.add(relay)
+
+                if len(tried) == len(self._relays):
+                    raise
+
+        self._relays.opened(relay)
+        self._relay = relay
+
+        self._opened_at = self._last_used = time.time()
+        self._session_messages = 0
+
+        if self._keepalive is not None and self._keepalive_stop is None:
+            self._keepalive_stop = threading.Event()
+            thread = threading.Thread(
+                target=_keep_alive,
+                args=(weakref.ref(self), self._keepalive_stop,
+                      self._keepalive))
+            thread.daemon = True
+            thread.start()
+
+    def _connect(self, relay, context):
+        """
+        Connect and log in to a relay, closing the connection if that
+        fails
         """
-        self._server = SMTP(self._host)
-        self._server.starttls()
-        self._server.login(self._username, self._password)
+        metrics = self._metrics
+
+        with _TLS_SESSIONS_LOCK:
+            session = _TLS_SESSIONS.get(context, {}).get(relay.host)
+
+        # smtplib would check the certificate against 'host:port'
+        if self._implicit_tls:
+            hostname, port = _split_host(relay.host, 465)
+
+            with metrics.timer('connect'):
+                server = _SMTPOverTLS(hostname, port, context, session)
+        else:
+            hostname, port = _split_host(relay.host)
+
+            with metrics.timer('connect'):
+                server = SMTP(hostname, port)
+
+        try:
+            if not self._implicit_tls:
+                with metrics.timer('starttls'):
+                    _starttls(server, context, hostname, session)
+
+            with metrics.timer('login'):
+                server.login(
+                    self._username if relay.username is None
+                    else relay.username,
+                    self._password if relay.password is None
+                    else relay.password)
+        except:
+            try:
+                server.close()
+            except socket.error:
+                pass
+
+            raise
+
+        # (with TLS 1.3, the session arrives after the handshake, so it is
+        # only looked for once the server has replied to something)
+        _save_tls_session(server, context, relay.host, metrics)
+
+        self._server = server
 
     def close(self):
         """
         Close the mail server
         """
-        self._server.close()
-        self._server = None
+        if self._transport is not None:
+            self._transport.close()
+            return
+
+        with self._lock:
+            if self._keepalive_stop is not None:
+                self._keepalive_stop.set()
+                self._keepalive_stop = None
+
+            # the session may already have been dropped
+            if self._server is not None:
+                self._server.close()
+                self._server = None
+                self._release_relay()
+
+    def _release_relay(self):
+        """
+        Tell the RelaySet the session with its relay is over
+        """
+        if self._relay is not None:
+            self._relays.closed(self._relay)
+            self._relay = None
 
     def is_open(self):
         """
-        Checks whether the connection to the mail server is open
+        Checks whether the connection to the mail server is open (which a
+        Mailer with a transport always is)
         """
-        return self._server is not None
+        return self._transport is not None or self._server is not None
+
+    def is_alive(self):
+        """
+        Checks whether the mail server still answers on the open
+        connection (using a NOOP command)
+        """
+        if self._server is None:
+            return False
+
+        try:
+            return self._server.noop()[0] == 250
+        except (SMTPException, socket.error):
+            return False
 
     def __enter__(self):
         self.open()
@@ -54,13 +372,16 @@ class Mailer(object):
 
     # I'm fine with the number of arguments
     # pylint: disable-msg=R0913
-    def send(self, recipients, subject, body, mail_as=None, cc_recipients=None,
-             bcc_recipients=None, attachments=None):
+    def send(self, recipients, subject=None, body=None, mail_as=None,
+             cc_recipients=None, bcc_recipients=None, attachments=None,
+             idempotency_key=None):
         """
         Send an email message.
 
         recipients: either an email address, or a list of email
                     addresses of the direct recipients of the message.
+                    Or an OutgoingMessage, which gives all the other
+                    arguments.
         subject: the header of the message
         body: the message body
         mail_as: an alias to use for sending the message. If None,
@@ -75,41 +396,539 @@ class Mailer(object):
         attachments: either a filepath, or list of filepaths of all
                      files that should be added to the message as
                      attachments. Default: None
+        idempotency_key: a string identifying the message. With an
+                         idempotency_index, a message whose key was
+                         already sent is skipped. The message's
+                         Message-ID is made from it, so it is the same
+                         each time. Default: None
+
+        Returns a dict of the recipients the server refused, as
+        smtplib's sendmail does (and an empty one for a skipped
+        duplicate). With max_recipients, an envelope that fails with an
+        error reply has its recipients refused with that reply, and
+        SMTPRecipientsRefused is only raised if every recipient was
+        refused.
+
+        Messages with attachments are built while they are sent, so
+        attachments are never held in memory whole (unless max_recipients
+        is set).
+
+        With max_message_size, a message whose attachments would make it
+        too big is sent as several, each with as many of the attachments
+        (in order) as fit, and its subject numbered, as in 'Report (1/3)'.
+        The refused recipients of all of them are returned. Sizes are
+        worked out before anything is built, and ValueError is raised
+        (before sending anything) if an attachment is too big by itself.
         """
-        if isinstance(recipients, six.string_types):
-            recipients = [recipients]
+        _check_message(recipients, subject, body)
 
-        if mail_as is None:
-            mail_as = self._username
+        if isinstance(recipients, OutgoingMessage):
+            idempotency_key = recipients.idempotency_key
 
-        if cc_recipients is None:
-            cc_recipients = []
-        elif isinstance(cc_recipients, six.string_types):
-            cc_recipients = [cc_recipients]
+        return self._once(idempotency_key, lambda: self._send_split(
+            recipients, subject, body, mail_as, cc_recipients,
+            bcc_recipients, attachments, idempotency_key), {})
 
-        if bcc_recipients is None:
-            bcc_recipients = []
-        elif isinstance(bcc_recipients, six.string_types):
-            bcc_recipients = [bcc_recipients]
+    def _send_split(self, recipients, subject, body, mail_as,
+                    cc_recipients, bcc_recipients, attachments,
+                    idempotency_key):
+        """
+        Send a message, as several if its attachments would make it bigger
+        than max_message_size
+        """
+        arguments = (recipients, subject, body, mail_as, cc_recipients,
+                     bcc_recipients, attachments)
+
+        if isinstance(recipients, OutgoingMessage):
+            arguments = recipients.arguments()
+
+        if self._max_message_size is None or not arguments[6]:
+            return self._send(*(arguments + (idempotency_key,)))
+
+        (recipients, subject, body, mail_as, cc_recipients, bcc_recipients,
+         attachments) = arguments
 
-        if attachments is None:
-            attachments = []
-        elif isinstance(attachments, six.string_types):
+        if isinstance(attachments, six.string_types):
             attachments = [attachments]
 
-        message = build_message_string(recipients, subject, body, mail_as,
-                                       cc_recipients, bcc_recipients,
-                                       attachments)
+        # sized with the longest numbered subject there could be
+        longest = '%s (%d/%d)' % (subject or '', len(attachments),
+                                  len(attachments))
+        _, _, groups = _prepare_message(
+            self._username, recipients, longest, body, mail_as,
+            cc_recipients, bcc_recipients, attachments, idempotency_key,
+            builder=partial(_split_attachments, self._max_message_size),
+            compress=self._compress)
+
+        if len(groups) == 1:
+            return self._send(*(arguments + (idempotency_key,)))
+
+        refused = {}
+
+        for number, group in enumerate(groups, 1):
+            refused.update(self._send(
+                recipients,
+                ('%s (%d/%d)' % (subject or '', number, len(groups))).lstrip(),
+                body, mail_as, cc_recipients, bcc_recipients, group,
+                None if idempotency_key is None
+                else '%s/%d' % (idempotency_key, number)))
+
+        return refused
+
+    def _send(self, recipients, subject, body, mail_as, cc_recipients,
+              bcc_recipients, attachments, idempotency_key):
+        """
+        Build and send a message, as send does
+        """
+        metrics = self._metrics
+
+        if self._transport is not None:
+            start = _TIMER()
+            sender, all_recipients, chunks = _prepare_message(
+                self._username, recipients, subject, body, mail_as,
+                cc_recipients, bcc_recipients, attachments,
+                builder=build_message_chunks,
+                attachment_cache=self._attachment_cache,
+                idempotency_key=idempotency_key,
+                compress=self._compress)
+
+            # as when streaming to a server, the message is built as it is
+            # written
+            built = [_TIMER() - start, 0]
+            start = _TIMER()
+            refused = self._transport.send(sender, all_recipients,
+                                           _metered(chunks, built))
+            metrics.observe('build', built[0])
+            metrics.observe('sendmail', _TIMER() - start - built[0])
+            self._count_sent(built[1], refused)
+
+            return refused
+
+        if attachments and self._max_recipients is None:
+            def attempt():
+                """
+                stream the message, building it again for each attempt
+                """
+                start = _TIMER()
+                sender, all_recipients, chunks = _prepare_message(
+                    self._username, recipients, subject, body, mail_as,
+                    cc_recipients, bcc_recipients, attachments,
+                    builder=_build_wire_chunks,
+                    attachment_cache=self._attachment_cache,
+                    idempotency_key=idempotency_key,
+                    compress=self._compress)
+
+                # building happens as the chunks are sent, so it is timed
+                # chunk by chunk and taken out of the sending time
+                built = [_TIMER() - start, 0]
+                start = _TIMER()
+                refused = self._counting_refusals(
+                    _streaming_sendmail, self._server, sender,
+                    all_recipients, _metered(chunks, built))
+                metrics.observe('build', built[0])
+                metrics.observe('sendmail', _TIMER() - start - built[0])
+
+                return refused, built[1]
+        else:
+            with metrics.timer('build'):
+                sender, all_recipients, message = _prepare_message(
+                    self._username, recipients, subject, body, mail_as,
+                    cc_recipients, bcc_recipients, attachments,
+                    builder=build_message_bytes,
+                    attachment_cache=self._attachment_cache,
+                    idempotency_key=idempotency_key,
+                    compress=self._compress)
+
+            def sendmail(envelope):
+                """
+                send the built message to one envelope of recipients
+                """
+                with metrics.timer('sendmail'):
+                    return self._counting_refusals(
+                        _streaming_sendmail, self._server, sender, envelope,
+                        [message])
+
+            return self._deliver(sendmail, all_recipients, len(message))
+
+        refused, size = self._with_session(attempt)
+        self._count_sent(size, refused)
+
+        return refused
+
+    def send_many(self, messages):
+        """
+        Send several email messages over the open connection. If the
+        server supports PIPELINING, the MAIL, RCPT and DATA commands of
+        each message are sent together instead of waiting for a reply
+        to each one.
+
+        messages: an iterable of messages, each either an OutgoingMessage,
+                  a dict of keyword arguments or a tuple of positional
+                  arguments for send. It is consumed as messages are sent,
+                  so it can be a generator.
+
+        Returns a list with a SendResult for each message, in order. A
+        message that couldn't be sent doesn't stop the ones after it
+        from being tried. A message whose idempotency_key was already
+        sent is skipped, with a duplicate SendResult.
+        """
+        builder = build_message_bytes if self._transport is None \
+            else build_message_string
+
+        def prepare(message):
+            """
+            build one message
+            """
+            with self._metrics.timer('build'):
+                if isinstance(message, dict):
+                    return _prepare_message(
+                        self._username, builder=builder,
+                        attachment_cache=self._attachment_cache,
+                        compress=self._compress, **message)
+
+                return _prepare_message(
+                    self._username, *message, builder=builder,
+                    attachment_cache=self._attachment_cache,
+                    compress=self._compress)
+
+        def send(message):
+            """
+            send one message, unless its idempotency key was already sent
+            """
+            key = None
+
+            if isinstance(message, dict):
+                key = message.get('idempotency_key')
+            elif isinstance(message, OutgoingMessage):
+                key = message.idempotency_key
+                message = (message,)
+
+            return self._once(
+                key, lambda: self._send_built(prepare, message),
+                SendResult([], duplicate=True), lambda result: result.ok)
+
+        return [send(message) for message in messages]
+
+    def send_merge(self, template, rows):
+        """
+        Send a MessageTemplate to many recipients, filling in its
+        placeholders differently for each. Like send_many, this uses
+        PIPELINING when the server supports it.
+
+        template: the MessageTemplate to send.
+        rows: an iterable of (recipients, fields) pairs, where recipients
+              is an email address or list of addresses, and fields is a
+              dict of values for the template's placeholders.
+
+        Returns a list with a SendResult for each row, in order.
+        """
+        def prepare(recipients, fields):
+            """
+            render the template for one row
+            """
+            if isinstance(recipients, six.string_types):
+                recipients = [recipients]
+
+            all_recipients = (list(recipients) + template.cc_recipients +
+                              template.bcc_recipients)
+
+            with self._metrics.timer('build'):
+                if self._transport is None:
+                    message = template.render_bytes(recipients, **fields)
+                else:
+                    message = template.render(recipients, **fields)
+
+            return template.sender, all_recipients, message
+
+        return [self._send_built(prepare, recipients, fields)
+                for recipients, fields in rows]
+
+    def _once(self, key, send, skipped, succeeded=None):
+        """
+        Call send, unless the message with idempotency key has already
+        been sent (or is being sent), in which case return skipped. Once
+        send returns (with something succeeded is true of, if given) the
+        key is recorded as sent.
+        """
+        index = self._idempotency_index
+
+        if key is None or index is None:
+            return send()
+
+        if not index.claim(key):
+            self._metrics.incr('duplicates_skipped')
+            return skipped
+
+        try:
+            result = send()
+        except:
+            index.abandon(key)
+            raise
+
+        if succeeded is None or succeeded(result):
+            index.complete(key)
+        else:
+            index.abandon(key)
+
+        return result
+
+    def _send_built(self, build, *args):
+        """
+        Build a message with build(*args), which returns a (sender,
+        recipients, message) tuple with the message as sent after DATA
+        (see build_message_bytes), or with a transport, as
+        build_message_string makes it, and send it. Returns a SendResult.
+        A message that can't be built (such as one with a missing
+        attachment) fails on its own, with the error in its SendResult.
+        """
+        try:
+            prepared = build(*args)
+        except Exception as error:  # pylint: disable-msg=W0703
+            return SendResult([], {}, error)
 
-        all_recipients = recipients + cc_recipients + bcc_recipients
+        return self._send_prepared(*prepared)
 
-        self._server.sendmail(mail_as, all_recipients, message)
+    def _send_prepared(self, sender, recipients, message):
+        """
+        Send a built message, catching failures into a SendResult
+        """
+        def sendmail(envelope):
+            """
+            send the message to one envelope of recipients, pipelining its
+            commands if the server allows
+            """
+            server = self._server
+            server.ehlo_or_helo_if_needed()
+
+            with self._metrics.timer('sendmail'):
+                if server.has_extn('pipelining'):
+                    return self._counting_refusals(
+                        _pipelined_sendmail, server, sender, envelope,
+                        message)
+
+                return self._counting_refusals(
+                    _streaming_sendmail, server, sender, envelope, [message])
+
+        try:
+            if self._transport is None:
+                refused = self._deliver(sendmail, recipients, len(message))
+            else:
+                with self._metrics.timer('sendmail'):
+                    refused = self._transport.send(sender, recipients,
+                                                   message)
+
+                # (message is text, which a transport writes as UTF-8)
+                self._count_sent(len(_to_bytes(message)), refused)
+        except SMTPRecipientsRefused as error:
+            return SendResult([], error.recipients)
+        except (SMTPException, EnvironmentError) as error:
+            return SendResult([], {}, error)
+
+        return SendResult([recipient for recipient in recipients
+                           if recipient not in refused], refused)
     # pylint: enable-msg=R0913
 
+    def _deliver(self, sendmail, recipients, size):
+        """
+        Call sendmail with a list of recipients (of a message of size
+        characters), splitting them into envelopes of max_recipients.
+        Returns the refused recipients, merged across the envelopes.
+        """
+        if (self._max_recipients is None or
+                len(recipients) <= self._max_recipients):
+            refused = self._with_session(partial(sendmail, recipients))
+            self._count_sent(size, refused)
+
+            return refused
+
+        envelopes = _envelopes(recipients, self._max_recipients)
+        refused = {}
+
+        for envelope in envelopes:
+            try:
+                envelope_refused = self._with_session(partial(sendmail,
+                                                              envelope))
+            except SMTPRecipientsRefused as error:
+                refused.update(error.recipients)
+                continue
+            except SMTPResponseException as error:
+                reply = (error.smtp_code, error.smtp_error)
+                refused.update((recipient, reply) for recipient in envelope)
+                continue
+
+            refused.update(envelope_refused)
+            self._count_sent(size, envelope_refused)
+
+        if len(refused) == sum(len(envelope) for envelope in envelopes):
+            raise SMTPRecipientsRefused(refused)
+
+        return refused
+
+    def _with_session(self, send):
+        """
+        Call send with a usable session: one is opened if there isn't one,
+        or if the current one has sent max_messages or reached max_age.
+        If the session turns out to have been dropped, reconnect and call
+        send again, up to retries times.
+        """
+        attempts = 0
+
+        with self._lock:
+            while True:
+                if self._server is not None and self._expired():
+                    self._quit()
+
+                if self._server is None:
+                    self.open()
+
+                limiter = self._limiter()
+
+                if limiter is not None:
+                    waited = limiter.acquire()
+
+                    if waited:
+                        self._metrics.observe('throttle', waited)
+
+                # (the relay is forgotten if the session is dropped)
+                relay = self._relay
+
+                if relay is not None:
+                    self._relays.sending(relay)
+
+                try:
+                    return send()
+                except (SMTPException, socket.error) as error:
+                    if not _is_dropped(error):
+                        raise
+
+                    self._drop()
+
+                    if attempts >= self._retries:
+                        raise
+
+                    attempts += 1
+                finally:
+                    if relay is not None:
+                        self._relays.sent(relay)
+
+                    self._session_messages += 1
+                    self._last_used = time.time()
+
+    def _expired(self):
+        """
+        Whether the session has been used for max_messages or max_age
+        """
+        return ((self._max_messages is not None and
+                 self._session_messages >= self._max_messages) or
+                (self._max_age is not None and
+                 time.time() - self._opened_at >= self._max_age))
+
+    def _quit(self):
+        """
+        End the session politely, to start a new one
+        """
+        try:
+            self._server.quit()
+        except (SMTPException, socket.error):
+            self._drop()
+
+        self._server = None
+        self._release_relay()
+
+    def _drop(self):
+        """
+        Throw away a dropped session
+        """
+        try:
+            self._server.close()
+        except socket.error:
+            pass
+
+        self._server = None
+        self._release_relay()
+
+    def _ping(self):
+        """
+        Send a NOOP if the session has been idle for keepalive seconds,
+        throwing the session away if it has been dropped. A busy session
+        is left alone.
+        """
+        if not self._lock.acquire(False):
+            return
+
+        try:
+            if (self._server is None or
+                    time.time() - self._last_used < self._keepalive):
+                return
+
+            try:
+                self._server.noop()
+                self._last_used = time.time()
+            except (SMTPException, socket.error):
+                self._drop()
+        finally:
+            self._lock.release()
+
+    def _counting_refusals(self, sendmail, *args):
+        """
+        Call a sendmail function, counting the recipients it refuses, and
+        telling the rate limiter whether the server pushed back
+        """
+        try:
+            refused = sendmail(*args)
+        except (SMTPException, socket.error) as error:
+            if isinstance(error, SMTPRecipientsRefused):
+                self._metrics.incr('refused_recipients',
+                                   len(error.recipients))
+
+            if _is_throttling(error):
+                self._throttled()
+
+            raise
+
+        if refused:
+            self._metrics.incr('refused_recipients', len(refused))
+
+        if _any_transient(refused):
+            self._throttled()
+        elif self._limiter() is not None:
+            self._limiter().success()
+
+        return refused
+
+    def _throttled(self):
+        """
+        Slow the rate limiter down, as the server pushed back
+        """
+        self._metrics.incr('throttled')
+
+        limiter = self._limiter()
+
+        if limiter is not None:
+            limiter.throttled()
+
+    def _limiter(self):
+        """
+        The RateLimiter for the current relay: its own, or the Mailer's
+        """
+        if self._relay is not None and self._relay.rate_limiter is not None:
+            return self._relay.rate_limiter
+
+        return self._rate_limiter
+
+    def _count_sent(self, size, refused):
+        """
+        Count a message the server accepted
+        """
+        self._metrics.incr('messages_sent')
+        self._metrics.incr('bytes_sent', size)
+
 
 # pylint: disable-msg=R0913
-def build_message_string(recipients, subject, body, sender, cc_recipients=None,
-                         bcc_recipients=None, attachments=None):
+def build_message_string(recipients, subject=None, body=None, sender=None,
+                         cc_recipients=None, bcc_recipients=None,
+                         attachments=None, attachment_cache=None,
+                         message_id=None, compress=None):
     """
     Build an email message.
 
@@ -117,7 +936,9 @@ def build_message_string(recipients, subject, body, sender, cc_recipients=None,
     this. besides handling (interfacing) smtp, it also alllows fuller
     defaults.
 
-    recipients: a list of email addresses of the direct recipients.
+    recipients: a list of email addresses of the direct recipients. Or an
+                OutgoingMessage, which gives the other arguments (and
+                whose mail_as, if set, is the sender).
     subject: the header of the message
     body: the message body
     mail_as: an alias to use for sending the message. If None,
@@ -131,23 +952,192 @@ def build_message_string(recipients, subject, body, sender, cc_recipients=None,
                     Default: None
     attachments: a list of filepaths of all files that should be added
                  to the message as attachments. Default: None
+    attachment_cache: an AttachmentCache to take encoded attachments
+                      from. Default: None
+    message_id: the message's Message-ID header, such as '<id@host>'. If
+                None, it has none. Default: None
+    compress: GZIP ('gzip') or ZIP ('zip') to compress each attachment as
+              it is encoded, into a .gz file or a .zip archive holding it.
+              Attachments that are already compressed (such as images and
+              archives) are left as they are. If None, none are
+              compressed. Default: None
+    """
+    return ''.join(_message_parts(recipients, subject, body, sender,
+                                  cc_recipients, bcc_recipients, attachments,
+                                  attachment_cache, message_id=message_id,
+                                  compress=compress))
+
+
+def build_message_bytes(recipients, subject=None, body=None, sender=None,
+                        cc_recipients=None, bcc_recipients=None,
+                        attachments=None, attachment_cache=None,
+                        message_id=None, compress=None):
+    """
+    Build an email message as it is sent to the server after the DATA
+    command. Takes the same arguments as build_message_string, and returns
+    the same message as a byte string, but with CRLF line endings, lines
+    starting with '.' escaped, and the terminating <CRLF>.<CRLF>.
+    """
+    return b''.join(_message_parts(recipients, subject, body, sender,
+                                   cc_recipients, bcc_recipients,
+                                   attachments, attachment_cache,
+                                   message_id=message_id, wire=True,
+                                   compress=compress))
+
+
+def build_message_chunks(recipients, subject=None, body=None, sender=None,
+                         cc_recipients=None, bcc_recipients=None,
+                         attachments=None, attachment_cache=None,
+                         message_id=None, wire=False, compress=None):
+    """
+    Build an email message piece by piece. Takes the same arguments as
+    build_message_string, and yields the same message as a series of
+    byte strings. Attachments are read (and compressed) and base64 encoded
+    a chunk at a time, so only one chunk of each is ever held in memory
+    (unless they come from attachment_cache).
+
+    wire: whether to yield the message as build_message_bytes makes it,
+          ready to be sent after DATA. Default: False
+    """
+    if wire:
+        for part in _message_parts(recipients, subject, body, sender,
+                                   cc_recipients, bcc_recipients,
+                                   attachments, attachment_cache,
+                                   message_id=message_id, wire=True,
+                                   compress=compress):
+            yield part
+
+        return
+
+    for part in _message_parts(recipients, subject, body, sender,
+                               cc_recipients, bcc_recipients, attachments,
+                               attachment_cache, message_id=message_id,
+                               compress=compress):
+        if isinstance(part, six.text_type):
+            part = part.encode(_ENCODING)
+
+        yield part
+
+
+def _build_wire_chunks(*args, **kwargs):
+    """
+    build_message_chunks with wire set, as a builder for _prepare_message
+    """
+    return build_message_chunks(*args, wire=True, **kwargs)
+
+
+def _message_parts(recipients, subject, body, sender, cc_recipients=None,
+                   bcc_recipients=None, attachments=None,
+                   attachment_cache=None, message_id=None, wire=False,
+                   compress=None):
+    """
+    Build an email message as a series of strings: the pieces of the
+    message skeleton, with the encoded body and each attachment's encoded
+    content (streamed from its file, or taken from attachment_cache) in
+    between.
+
+    If wire is set, the strings are bytes as sent after DATA. Only the
+    skeleton's pieces need escaping: no base64 line can start with '.',
+    so the encoded content just needs CRLF line endings.
     """
-    subject = subject.encode(_ENCODING)
+    _check_message(recipients, subject, body)
 
-    message = MIMEText(body.encode(_ENCODING), _charset=_ENCODING)
+    if isinstance(recipients, OutgoingMessage):
+        if message_id is None and recipients.idempotency_key is not None:
+            message_id = _message_id(recipients.idempotency_key,
+                                     recipients.mail_as or sender)
+
+        (recipients, subject, body, sender, cc_recipients, bcc_recipients,
+         attachments) = recipients.arguments(sender)
+
+    skeleton, placeholders = _build_skeleton(recipients, subject, sender,
+                                             cc_recipients, bcc_recipients,
+                                             attachments, message_id,
+                                             compress)
+
+    payloads = [[_encode_body(body)]]
+    encode = _encode_file if attachment_cache is None \
+        else attachment_cache.chunks
+    payloads.extend(encode(attachment, compress=compress)
+                    for attachment in attachments or [])
+
+    start = 0
+
+    for placeholder, payload in zip(placeholders, payloads):
+        end = skeleton.index(placeholder, start)
+
+        if wire:
+            yield _quote_lines(_to_bytes(skeleton[start:end]))
+
+            for chunk in payload:
+                yield _to_bytes(chunk).replace(b'\n', b'\r\n')
+        else:
+            yield skeleton[start:end]
+
+            for chunk in payload:
+                yield chunk
+
+        start = end + len(placeholder)
+
+    if not wire:
+        yield skeleton[start:]
+        return
+
+    # the body or last attachment ends with a line break, so only the end
+    # of the skeleton may need one
+    tail = _quote_lines(_to_bytes(skeleton[start:]))
+
+    if tail and not tail.endswith(b'\r\n'):
+        tail += b'\r\n'
+
+    yield tail + b'.\r\n'
+
+
+def _build_skeleton(recipients, subject, sender, cc_recipients=None,
+                    bcc_recipients=None, attachments=None, message_id=None,
+                    compress=None):
+    """
+    Build an email message with placeholders where the encoded body and
+    each attachment's encoded content belong (with the names and types
+    compressed attachments have). Returns the message string and the list
+    of placeholders: the body's, then the attachments' in order.
+    """
+    # the MIME classes are only needed here, so importing mailer doesn't
+    # pay for them
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    token = uuid.uuid4().hex
+    placeholders = ['<body %s>' % token]
+
+    message = MIMEText(_encode(''), _charset=_ENCODING)
+    message.set_payload(placeholders[0])
 
     if attachments:
         full_message = MIMEMultipart()
         full_message.attach(message)
         message = full_message
 
-        for attachment in attachments:
-            application = MIMEApplication(open(attachment, 'rb').read())
+        for index, attachment in enumerate(attachments):
+            placeholder = '<attachment %s %d>' % (token, index)
+            placeholders.append(placeholder)
+
+            method = _compression(attachment, compress)
+            filename = os.path.basename(attachment)
+
+            if method is None:
+                application = MIMEApplication(b'')
+            else:
+                application = MIMEApplication(b'', method)
+                filename += '.gz' if method == GZIP else '.zip'
+
+            application.set_payload(placeholder)
             application.add_header('Content-Disposition', 'attachment',
-                                   filename=os.path.basename(attachment))
+                                   filename=filename)
             message.attach(application)
 
-    message['Subject'] = subject
+    message['Subject'] = _encode(subject)
     message['From'] = sender
     message['To'] = _format_addresses(recipients)
 
@@ -157,12 +1147,698 @@ def build_message_string(recipients, subject, body, sender, cc_recipients=None,
     if bcc_recipients:
         message['Bcc'] = _format_addresses(bcc_recipients)
 
-    return message.as_string()
+    if message_id is not None:
+        message['Message-ID'] = message_id
+
+    return message.as_string(), placeholders
+# pylint: enable-msg=R0913
+
+
+def _encoded_size(size):
+    """
+    the length of a file of size bytes once _encode_file has encoded it:
+    77 characters for every 57 bytes, plus a shorter last line
+    """
+    lines, rest = divmod(size, 57)
+
+    return lines * 77 + ((rest + 2) // 3 * 4 + 1 if rest else 0)
+
+
+def _encode_body(body):
+    """
+    base64 encode a message body, as MIMEText does for utf-8 text
+    """
+    encoded = _encodebytes(body.encode(_ENCODING))
+
+    return encoded if six.PY2 else encoded.decode('ascii')
+
+
+def _encode_file(path, chunk_size=_CHUNK_SIZE, compress=None):
+    """
+    base64 encode a file in 76 character lines, a chunk at a time,
+    compressing it first if compress (GZIP or ZIP) applies to it
+    """
+    method = _compression(path, compress)
+
+    with open(path, 'rb') as attachment:
+        chunks = iter(partial(attachment.read, chunk_size), b'')
+
+        if method == GZIP:
+            chunks = _gzip_chunks(chunks)
+        elif method == ZIP:
+            chunks = _zip_chunks(chunks, path)
+
+        for data in _whole_lines(chunks):
+            encoded = _encodebytes(data)
+
+            yield encoded if six.PY2 else encoded.decode('ascii')
+
+
+def _compression(path, compress):
+    """
+    How to compress an attachment: compress, unless the file is already
+    compressed, in which case None
+    """
+    if compress is None:
+        return None
+
+    if compress not in (GZIP, ZIP):
+        raise ValueError('unknown compression %r' % (compress,))
+
+    if os.path.splitext(path)[1].lower() in _COMPRESSED_EXTENSIONS:
+        return None
+
+    return compress
+
+
+def _whole_lines(chunks):
+    """
+    Regroup chunks of data into multiples of 57 bytes (bar the last), so
+    each base64 encodes to whole lines. Each chunk is held back until the
+    next arrives, so the last one isn't split.
+    """
+    pending = None
+
+    for chunk in chunks:
+        if pending is not None:
+            end = len(pending) - len(pending) % 57
+
+            if end:
+                yield pending[:end]
+
+            if end < len(pending):
+                chunk = pending[end:] + chunk
+
+        pending = chunk
+
+    if pending:
+        yield pending
+
+
+def _gzip_chunks(chunks):
+    """
+    Compress chunks of data into a gzip file
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def _zip_chunks(chunks, path):
+    """
+    Compress chunks of a file's data into a zip archive holding it. The
+    archive is written in one pass (its CRC and sizes follow the data, in
+    a data descriptor), so it never needs to be held whole.
+    """
+    name = os.path.basename(path).encode(_ENCODING)
+    modified = time.localtime(os.path.getmtime(path))
+    dos_time = (modified.tm_hour << 11 | modified.tm_min << 5 |
+                modified.tm_sec // 2)
+    dos_date = ((max(modified.tm_year, 1980) - 1980) << 9 |
+                modified.tm_mon << 5 | modified.tm_mday)
+    # deflated, with a data descriptor and a UTF-8 name
+    flags = 0x0808
+
+    header = struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, flags, 8, dos_time,
+                         dos_date, 0, 0, 0, len(name), 0) + name
+    yield header
+
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    crc = size = compressed_size = 0
+
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        compressed = compressor.compress(chunk)
+        compressed_size += len(compressed)
+
+        if compressed:
+            yield compressed
+
+    compressed = compressor.flush()
+    compressed_size += len(compressed)
+    crc &= 0xffffffff
+
+    # (attachments are never near the 4 GiB that needs ZIP64)
+    central = struct.pack('<4s6H3L5H2L', b'PK\x01\x02', 20, 20, flags, 8,
+                          dos_time, dos_date, crc, compressed_size, size,
+                          len(name), 0, 0, 0, 0, 0, 0) + name
+    offset = len(header) + compressed_size + 16
+
+    yield (compressed +
+           struct.pack('<4s3L', b'PK\x07\x08', crc, compressed_size, size) +
+           central +
+           struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, 1, 1, len(central),
+                       offset, 0))
+
+
+# pylint: disable-msg=R0913
+def _prepare_message(username, recipients, subject=None, body=None,
+                     mail_as=None, cc_recipients=None, bcc_recipients=None,
+                     attachments=None, idempotency_key=None,
+                     builder=build_message_string, attachment_cache=None,
+                     compress=None):
+    """
+    Normalize Mailer.send's arguments (or an OutgoingMessage, given as
+    recipients) and build the message. Returns the sender (username,
+    unless mail_as is given), the list of all recipients and the message,
+    as made by builder (build_message_string or build_message_chunks) with
+    attachment_cache and compress, and a Message-ID made from
+    idempotency_key if there is one.
+    """
+    _check_message(recipients, subject, body)
+
+    if isinstance(recipients, OutgoingMessage):
+        idempotency_key = recipients.idempotency_key
+        (recipients, subject, body, mail_as, cc_recipients, bcc_recipients,
+         attachments) = recipients.arguments()
+
+    if isinstance(recipients, six.string_types):
+        recipients = [recipients]
+
+    if mail_as is None:
+        mail_as = username
+
+    if cc_recipients is None:
+        cc_recipients = []
+    elif isinstance(cc_recipients, six.string_types):
+        cc_recipients = [cc_recipients]
+
+    if bcc_recipients is None:
+        bcc_recipients = []
+    elif isinstance(bcc_recipients, six.string_types):
+        bcc_recipients = [bcc_recipients]
+
+    if attachments is None:
+        attachments = []
+    elif isinstance(attachments, six.string_types):
+        attachments = [attachments]
+
+    # attachments are read as the message is sent, after MAIL FROM, so a
+    # missing one is found before anything is sent instead
+    for attachment in attachments:
+        open(attachment, 'rb').close()
+
+    message_id = None
+
+    if idempotency_key is not None:
+        message_id = _message_id(idempotency_key, mail_as)
+
+    message = builder(recipients, subject, body, mail_as, cc_recipients,
+                      bcc_recipients, attachments, attachment_cache,
+                      message_id=message_id, compress=compress)
+
+    # (an OutgoingMessage's recipients are tuples)
+    all_recipients = list(chain(recipients, cc_recipients, bcc_recipients))
+
+    return mail_as, all_recipients, message
+
+
+def _check_message(recipients, subject, body):
+    """
+    Raise TypeError if a message has no subject or body (which are only
+    optional when recipients is an OutgoingMessage, which gives them)
+    """
+    if not isinstance(recipients, OutgoingMessage) and (subject is None or
+                                                        body is None):
+        raise TypeError('a message needs a subject and body, unless '
+                        'recipients is an OutgoingMessage')
+
+
+def _split_attachments(max_size, recipients, subject, body, sender,
+                       cc_recipients, bcc_recipients, attachments,
+                       attachment_cache=None, message_id=None,
+                       compress=None):
+    """
+    Split a message's attachments into groups, in order, each small enough
+    to send in a message of at most max_size bytes (as sent after DATA).
+    Sizes are worked out from the files' sizes, without reading them: a
+    compressed attachment is counted as if compressing didn't shrink it.
+    Takes the arguments of build_message_string after max_size (so it can
+    be _prepare_message's builder), and returns a list of the groups.
+
+    Raises ValueError if an attachment doesn't fit in a message by itself.
+    """
+    # pylint: disable-msg=W0613
+    def size(group):
+        """
+        the size of the message with a group of attachments
+        """
+        skeleton, placeholders = _build_skeleton(
+            recipients, subject, sender, cc_recipients, bcc_recipients,
+            group, message_id, compress)
+        skeleton = skeleton.replace(placeholders[0], _encode_body(body))
+
+        for placeholder in placeholders[1:]:
+            skeleton = skeleton.replace(placeholder, '')
+
+        # (with CRLF line endings)
+        return (len(skeleton) + skeleton.count('\n') +
+                sum(_attachment_size(attachment, compress)
+                    for attachment in group))
+
+    groups = []
+    group = []
+
+    for attachment in attachments:
+        if group and size(group + [attachment]) > max_size:
+            groups.append(group)
+            group = []
+
+        group.append(attachment)
+
+        if len(group) == 1 and size(group) > max_size:
+            raise ValueError('%s is too big to attach to a message of at '
+                             'most %d bytes' % (attachment, max_size))
+
+    groups.append(group)
+
+    return groups
 # pylint: enable-msg=R0913
 
 
+def _attachment_size(path, compress=None):
+    """
+    The most bytes an attachment takes once encoded (with CRLF line
+    endings), without reading it. Compressing can make a file a little
+    bigger than it was (deflate stores what it can't compress in blocks
+    with 5 byte headers), so compressed files are allowed for that and the
+    gzip or zip headers.
+    """
+    size = os.path.getsize(path)
+    method = _compression(path, compress)
+
+    if method is not None:
+        size += (size // 16383 + 1) * 5 + 18
+
+        if method == ZIP:
+            size += 2 * len(os.path.basename(path).encode(_ENCODING)) + 98
+
+    return _encoded_size(size) + (size + 56) // 57
+
+
+def _message_id(key, sender):
+    """
+    A Message-ID made from an idempotency key, at the sender's domain
+    """
+    address = parseaddr(sender)[1]
+    domain = address.rpartition('@')[2] if '@' in address else 'localhost'
+
+    return '<%s@%s>' % (hashlib.sha1(_to_bytes(key)).hexdigest(), domain)
+
+
 def _format_addresses(addresses):
     """
     build an address string from a list of addresses
     """
-    return ', '.join(addresses).encode(_ENCODING)
+    return _encode(', '.join(addresses))
+
+
+def _format_header(name, value):
+    """
+    format a header line the way Message.as_string does (python 2 folds
+    long lines, python 3 doesn't)
+    """
+    if six.PY2:
+        if _NON_ASCII.search(value):
+            return '%s: %s\n' % (name, value)
+
+        return '%s: %s\n' % (name, Header(value, header_name=name,
+                                           maxlinelen=78).encode())
+
+    return '%s: %s\n' % (name, Header(value, header_name=name).encode(
+        maxlinelen=0))
+
+
+def _to_bytes(text):
+    """
+    the bytes of part of a message (which is text on python 3)
+    """
+    if isinstance(text, six.text_type):
+        return text.encode(_ENCODING)
+
+    return text
+
+
+def _encode(text):
+    """
+    encode text for use in a message. python 2's email package works with
+    encoded byte strings, python 3's with text.
+    """
+    if six.PY2:
+        return text.encode(_ENCODING)
+
+    return text
+
+
+def _pipelined_sendmail(server, sender, recipients, message):
+    """
+    Do what smtplib's sendmail does, but send MAIL, all RCPTs and DATA in
+    one go and only then read their replies (RFC 2920). The message is
+    given as sent after DATA (see build_message_bytes).
+    """
+    commands = ['mail FROM:%s' % quoteaddr(sender)]
+    commands.extend('rcpt TO:%s' % quoteaddr(recipient)
+                    for recipient in recipients)
+    commands.append('data')
+
+    server.send(''.join(command + '\r\n' for command in commands))
+
+    mail_reply = server.getreply()
+
+    refused = {}
+
+    for recipient in recipients:
+        code, response = server.getreply()
+
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+
+    data_reply = server.getreply()
+
+    failed = mail_reply[0] != 250 or len(refused) == len(recipients)
+
+    if data_reply[0] == 354:
+        # the server wants a message even though the transaction failed,
+        # an empty one ends it
+        server.send(b'.\r\n' if failed else message)
+        data_reply = server.getreply()
+
+    if failed or data_reply[0] != 250:
+        server.rset()
+
+    if mail_reply[0] != 250:
+        raise SMTPSenderRefused(mail_reply[0], mail_reply[1], sender)
+
+    if len(refused) == len(recipients):
+        raise SMTPRecipientsRefused(refused)
+
+    if data_reply[0] != 250:
+        raise SMTPDataError(*data_reply)
+
+    return refused
+
+
+class _SMTPOverTLS(SMTP):
+    """
+    An SMTP client that starts TLS as soon as it connects (like smtplib's
+    SMTP_SSL), with a given SSL context and, optionally, a TLS session to
+    resume
+    """
+    default_port = 465
+
+    def __init__(self, host, port, context, session=None):
+        self._context = context
+        self._session = session
+        SMTP.__init__(self, host, port)
+
+    def _get_socket(self, host, port, timeout):
+        connection = socket.create_connection((host, port), timeout)
+
+        if self._session is None:
+            return self._context.wrap_socket(connection, server_hostname=host)
+
+        return self._context.wrap_socket(connection, server_hostname=host,
+                                         session=self._session)
+
+
+def _default_ssl_context():
+    """
+    The SSL context for Mailers that aren't given one, made on first use.
+    Like smtplib's own default, it doesn't verify certificates.
+    """
+    global _DEFAULT_SSL_CONTEXT  # pylint: disable-msg=W0603
+
+    if _DEFAULT_SSL_CONTEXT is None:
+        # pylint: disable-msg=W0212
+        _DEFAULT_SSL_CONTEXT = ssl._create_stdlib_context()
+
+    return _DEFAULT_SSL_CONTEXT
+
+
+def _split_host(host, default_port=25):
+    """
+    Split a 'host:port' string, defaulting to default_port
+    """
+    hostname, _, port = host.rpartition(':')
+
+    if not hostname or not port.isdigit():
+        return host, default_port
+
+    return hostname, int(port)
+
+
+def _starttls(server, context, hostname, session):
+    """
+    Do what smtplib's starttls does, but resume session, if given (which
+    smtplib has no way to do). Python 2's smtplib can't take a context
+    either, but makes one like the default context itself.
+    """
+    if session is None:
+        if not six.PY2:
+            server.starttls(context=context)
+            return
+
+        if context is _DEFAULT_SSL_CONTEXT:
+            server.starttls()
+            return
+
+    server.ehlo_or_helo_if_needed()
+
+    if not server.has_extn('starttls'):
+        raise SMTPException('STARTTLS extension not supported by server.')
+
+    code, response = server.docmd('STARTTLS')
+
+    if code != 220:
+        raise SMTPResponseException(code, response)
+
+    if session is None:
+        server.sock = context.wrap_socket(server.sock,
+                                          server_hostname=hostname)
+    else:
+        server.sock = context.wrap_socket(server.sock,
+                                          server_hostname=hostname,
+                                          session=session)
+
+    server.file = None
+    # forget what the server said before TLS, as smtplib does
+    server.helo_resp = server.ehlo_resp = None
+    server.esmtp_features = {}
+    server.does_esmtp = False
+
+
+def _save_tls_session(server, context, host, metrics):
+    """
+    Remember a connection's TLS session, counting it if it was resumed.
+    Sessions can only be resumed on python 3.6 and later.
+    """
+    connection = getattr(server, 'sock', None)
+    session = getattr(connection, 'session', None)
+
+    if session is None:
+        return
+
+    if connection.session_reused:
+        metrics.incr('tls_resumptions')
+
+    with _TLS_SESSIONS_LOCK:
+        _TLS_SESSIONS.setdefault(context, {})[host] = session
+
+
+def _is_file_error(error):
+    """
+    Whether an error came from a local file (such as a missing
+    attachment) rather than the connection, which on python 3 are both
+    OSErrors
+    """
+    return (isinstance(error, EnvironmentError) and
+            getattr(error, 'filename', None) is not None)
+
+
+def _is_dropped(error):
+    """
+    Whether an error means the session has been dropped and can't be used
+    anymore (on python 3, SMTPException and file errors are themselves
+    socket.errors)
+    """
+    return (isinstance(error, SMTPServerDisconnected) or
+            (isinstance(error, socket.error) and
+             not isinstance(error, SMTPException) and
+             not _is_file_error(error)))
+
+
+def _is_throttling(error):
+    """
+    Whether an error from sending means the server wants us to slow down: a
+    4xx reply (to any command, or refusing any recipient) or a dropped
+    connection
+    """
+    if isinstance(error, SMTPRecipientsRefused):
+        return _any_transient(error.recipients)
+
+    if isinstance(error, SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+
+    return _is_dropped(error)
+
+
+def _any_transient(refused):
+    """
+    Whether any recipient was refused with a 4xx reply
+    """
+    return any(400 <= code < 500 for code, _ in refused.values())
+
+
+def _keep_alive(reference, stop, interval):
+    """
+    Ping a Mailer's session every interval seconds until stop is set, or
+    the Mailer is garbage collected
+    """
+    while not stop.wait(interval):
+        mailer = reference()
+
+        if mailer is None:
+            return
+
+        mailer._ping()  # pylint: disable-msg=W0212
+        del mailer
+
+
+def _envelopes(recipients, size):
+    """
+    Split recipients into lists of at most size, ordered by domain so each
+    domain's recipients are kept together (and without duplicates)
+    """
+    domains = OrderedDict()
+
+    for recipient in recipients:
+        domain = recipient.rpartition('@')[2].lower()
+        domains.setdefault(domain, OrderedDict())[recipient] = None
+
+    ordered = [recipient for addresses in domains.values()
+               for recipient in addresses]
+
+    return [ordered[index:index + size]
+            for index in range(0, len(ordered), size)]
+
+
+def _metered(chunks, built):
+    """
+    Yield chunks, adding the time spent building each to built[0] and its
+    length to built[1]
+    """
+    chunks = iter(chunks)
+
+    while True:
+        start = _TIMER()
+
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+
+        built[0] += _TIMER() - start
+        built[1] += len(chunk)
+
+        yield chunk
+
+
+def _streaming_sendmail(server, sender, recipients, chunks):
+    """
+    Do what smtplib's sendmail does, but write the message to the server a
+    chunk at a time, as the chunks are built. The chunks are given as sent
+    after DATA (see build_message_bytes), so they are written as they are.
+    """
+    server.ehlo_or_helo_if_needed()
+
+    code, response = server.mail(sender)
+
+    if code != 250:
+        server.rset()
+        raise SMTPSenderRefused(code, response, sender)
+
+    refused = {}
+
+    for recipient in recipients:
+        code, response = server.rcpt(recipient)
+
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+
+    if len(refused) == len(recipients):
+        server.rset()
+        raise SMTPRecipientsRefused(refused)
+
+    code, response = server.docmd('data')
+
+    if code != 354:
+        server.rset()
+        raise SMTPDataError(code, response)
+
+    try:
+        for chunk in chunks:
+            server.send(chunk)
+    except:
+        # the server is still waiting for the rest of the message, so the
+        # session can't be used again
+        server.close()
+        raise
+
+    code, response = server.getreply()
+
+    if code != 250:
+        server.rset()
+        raise SMTPDataError(code, response)
+
+    return refused
+
+
+def _quote_data(message):
+    """
+    convert a message into what is sent after DATA: CRLF line endings,
+    dot-stuffed, and ending with the <CRLF>.<CRLF> terminator
+    """
+    return b''.join(_quote_chunks([message]))
+
+
+def _quote_chunks(chunks):
+    """
+    _quote_data for a message given as a series of chunks, without
+    joining them. Chunks are cut after their last line break, so lines
+    split across chunks are quoted whole.
+    """
+    tail = b''
+
+    for chunk in chunks:
+        if isinstance(chunk, six.text_type):
+            chunk = chunk.encode(_ENCODING)
+
+        chunk = tail + chunk
+        end = chunk.rfind(b'\n') + 1
+        tail = chunk[end:]
+
+        if end:
+            yield _quote_lines(chunk[:end])
+
+    if tail:
+        yield _quote_lines(tail) + b'\r\n'
+
+    yield b'.\r\n'
+
+
+def _quote_lines(data):
+    """
+    convert whole lines to CRLF line endings and dot-stuff them
+    """
+    data = re.sub(br'\r\n|\n|\r', b'\r\n', data)
+
+    return re.sub(br'(?m)^\.', b'..', data)
@@ -0,0 +1,129 @@
+"""
+The OutgoingMessage class holds a message waiting to be sent, compactly
+enough to keep hundreds of thousands of them in memory.
+"""
+from __future__ import absolute_import
+
+import six
+from six.moves import intern
+
+
+class OutgoingMessage(object):
+    """
+    The OutgoingMessage class is a message to send: the arguments of
+    Mailer.send, held in __slots__ instead of a dict. Senders are interned,
+    so messages from the same sender share one string, and a single
+    recipient is kept as a string rather than in a list. An
+    OutgoingMessage with one recipient, sharing its subject and body with
+    others, takes under 200 bytes (including its recipient's address).
+
+    Mailer.send, Mailer.send_many, send_parallel and the build_message
+    functions all accept one in place of their arguments.
+    """
+    __slots__ = ('_recipients', 'subject', 'body', 'mail_as',
+                 '_cc_recipients', '_bcc_recipients', '_attachments',
+                 'idempotency_key')
+
+    # pylint: disable-msg=R0913
+    def __init__(self, recipients, subject, body, mail_as=None,
+                 cc_recipients=None, bcc_recipients=None, attachments=None,
+                 idempotency_key=None):
+        """
+        Takes the same arguments as Mailer.send.
+        """
+        self._recipients = _compact(recipients)
+        self.subject = subject
+        self.body = body
+        self.mail_as = _intern(mail_as)
+        self._cc_recipients = _compact(cc_recipients)
+        self._bcc_recipients = _compact(bcc_recipients)
+        self._attachments = _compact(attachments)
+        self.idempotency_key = idempotency_key
+    # pylint: enable-msg=R0913
+
+    @property
+    def recipients(self):
+        """
+        The tuple of direct recipients
+        """
+        return _expand(self._recipients)
+
+    @property
+    def cc_recipients(self):
+        """
+        The tuple of Carbon Copy recipients
+        """
+        return _expand(self._cc_recipients)
+
+    @property
+    def bcc_recipients(self):
+        """
+        The tuple of Blind Carbon Copy recipients
+        """
+        return _expand(self._bcc_recipients)
+
+    @property
+    def attachments(self):
+        """
+        The tuple of attached files' paths
+        """
+        return _expand(self._attachments)
+
+    def arguments(self, sender=None):
+        """
+        The message as a tuple of the positional arguments of Mailer.send,
+        with mail_as as sender if it isn't set
+        """
+        return (self.recipients, self.subject, self.body,
+                sender if self.mail_as is None else self.mail_as,
+                self.cc_recipients, self.bcc_recipients, self.attachments)
+
+    def __reduce__(self):
+        # (python 2 can't pickle __slots__ by itself)
+        return (OutgoingMessage, self.arguments() + (self.idempotency_key,))
+
+    def __repr__(self):
+        return 'OutgoingMessage(%r, %r, ...)' % (self.recipients,
+                                                 self.subject)
+
+
+# shared by every message without the addresses it is used for
+_EMPTY = ()
+
+
+def _compact(addresses):
+    """
+    Store addresses (None, one address, or a list of them) compactly: one
+    as itself, more as a tuple
+    """
+    if not addresses:
+        return _EMPTY
+
+    if isinstance(addresses, six.string_types):
+        return addresses
+
+    if len(addresses) == 1:
+        return addresses[0]
+
+    return tuple(addresses)
+
+
+def _expand(addresses):
+    """
+    Addresses stored by _compact, as a tuple
+    """
+    if isinstance(addresses, tuple):
+        return addresses
+
+    return (addresses,)
+
+
+def _intern(text):
+    """
+    Intern a sender, so every message from it shares one string (python 2
+    can only intern byte strings)
+    """
+    if type(text) is str:  # pylint: disable-msg=C0123
+        return intern(text)
+
+    return text
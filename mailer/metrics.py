@@ -0,0 +1,174 @@
+"""
+Metrics collectors, which a Mailer reports its timings and counts to.
+
+A collector is any object with these methods:
+
+    timer(name): a context manager that times the block it wraps
+    observe(name, seconds): record a duration directly
+    incr(name, value=1): add to a counter
+
+Mailer reports these timers:
+
+    connect: opening the TCP connection (and reading the greeting, and
+             with implicit_tls, the TLS handshake)
+    starttls: the STARTTLS command and TLS handshake
+    login: authenticating
+    build: building a message
+    sendmail: sending a built message, up to the server's final reply
+    throttle: waiting for the rate limiter (only when there was a wait)
+
+and these counters:
+
+    messages_sent: messages the server accepted (with max_recipients,
+                   each envelope counts)
+    bytes_sent: the size of those messages, as sent after DATA
+    refused_recipients: recipients the server refused
+    reconnects: sessions opened by a Mailer that had been opened before
+    tls_resumptions: connections that resumed an earlier TLS session
+    throttled: times the server pushed back, with a 4xx reply or by
+               dropping the connection
+    relay_failures: relays that couldn't be connected or logged in to
+    duplicates_skipped: messages not sent as their idempotency key already
+                        had been
+
+To feed another system (such as Prometheus or StatsD), subclass
+NullMetrics and override the methods.
+"""
+from __future__ import absolute_import
+import threading
+import time
+
+_TIMER = getattr(time, 'perf_counter', time.time)
+
+
+class _NullTimer(object):
+    """
+    A context manager that does nothing
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics(object):
+    """
+    The NullMetrics class discards everything reported to it. It is what a
+    Mailer uses when it isn't given a collector.
+    """
+    def timer(self, name):  # pylint: disable-msg=W0613
+        """
+        A context manager timing the block it wraps as name
+        """
+        return _NULL_TIMER
+
+    def observe(self, name, seconds):
+        """
+        Record that name took seconds
+        """
+        pass
+
+    def incr(self, name, value=1):
+        """
+        Add value to the counter name
+        """
+        pass
+
+
+class _Timer(object):
+    """
+    A context manager that observes how long its block took
+    """
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = _TIMER()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.observe(self._name, _TIMER() - self._start)
+
+
+class InMemoryMetrics(NullMetrics):
+    """
+    The InMemoryMetrics class keeps counters, and the count, total, minimum
+    and maximum of each timer, in memory. It is safe to share between
+    threads (and so between the Mailers of a MailerPool).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timers = {}
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timing = self._timers.get(name)
+
+            if timing is None:
+                self._timers[name] = [1, seconds, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+
+                if seconds < timing[2]:
+                    timing[2] = seconds
+
+                if seconds > timing[3]:
+                    timing[3] = seconds
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def counter(self, name):
+        """
+        The value of the counter name (0 if it was never incremented)
+        """
+        return self._counters.get(name, 0)
+
+    def timing(self, name):
+        """
+        A dict of the count, total, min, max and mean seconds of the timer
+        name, or None if it was never observed
+        """
+        with self._lock:
+            timing = self._timers.get(name)
+
+            if timing is None:
+                return None
+
+            count, total, minimum, maximum = timing
+
+        return {'count': count, 'total': total, 'min': minimum,
+                'max': maximum, 'mean': total / count}
+
+    def snapshot(self):
+        """
+        A dict of everything collected: {'counters': {name: value},
+        'timers': {name: timing}}, with timings as returned by timing
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            names = list(self._timers)
+
+        return {'counters': counters,
+                'timers': dict((name, self.timing(name)) for name in names)}
+
+    def reset(self):
+        """
+        Forget everything collected
+        """
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
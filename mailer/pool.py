@@ -0,0 +1,207 @@
+"""
+The MailerPool class keeps several logged-in Mailer sessions that can be
+shared between threads.
+"""
+from __future__ import absolute_import
+from contextlib import contextmanager
+from smtplib import SMTPException
+import socket
+import threading
+import time
+
+from .mailer import _is_dropped, Mailer
+from .relay import RelaySet
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no Mailer became available in a MailerPool in time.
+    """
+    pass
+
+
+class MailerPool(object):
+    """
+    The MailerPool class keeps up to size open Mailer sessions and hands
+    them out to threads, so messages can be sent over several connections
+    at once.
+    """
+    # pylint: disable-msg=R0913
+    def __init__(self, username, password, host='smtp.gmail.com:587',
+                 size=4, max_idle=30, **mailer_kwargs):
+        """
+        username, password, host: passed to every Mailer in the pool. A
+                                  list of relays is made into one
+                                  RelaySet that they share, so the
+                                  pool's sessions are spread across the
+                                  relays.
+        size: the maximum number of open sessions. Default: 4
+        max_idle: the number of seconds a session may sit unused before it
+                  is checked with NOOP on its next checkout. Default: 30
+        mailer_kwargs: any additional keyword arguments for Mailer.
+        """
+        self._username = username
+        self._password = password
+        self._host = RelaySet(host) if isinstance(host, (list, tuple)) \
+            else host
+        self._size = size
+        self._max_idle = max_idle
+        self._mailer_kwargs = mailer_kwargs
+
+        self._condition = threading.Condition()
+        self._idle = []
+        self._created = 0
+        self._closed = False
+    # pylint: enable-msg=R0913
+
+    @property
+    def size(self):
+        """
+        The maximum number of sessions the pool will open
+        """
+        return self._size
+
+    def _new_mailer(self):
+        """
+        Create a new (unopened) Mailer with the pool's settings
+        """
+        return Mailer(self._username, self._password, self._host,
+                      **self._mailer_kwargs)
+
+    def checkout(self, timeout=None):
+        """
+        Take an open Mailer out of the pool, opening a new session if
+        fewer than size exist. Idle sessions are health checked, and
+        dropped ones reconnected, before being handed out.
+
+        timeout: the number of seconds to wait for a Mailer to be returned
+                 when all sessions are in use. If None, wait forever.
+                 Default: None
+
+        Raises PoolTimeout if no Mailer became available in time.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ValueError('the pool is closed')
+
+                if self._idle:
+                    mailer, last_used = self._idle.pop()
+                    break
+
+                if self._created < self._size:
+                    self._created += 1
+                    mailer, last_used = self._new_mailer(), None
+                    break
+
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+
+                    if remaining <= 0:
+                        raise PoolTimeout('no mailer available after %s '
+                                          'seconds' % timeout)
+
+                    self._condition.wait(remaining)
+
+        try:
+            if last_used is None:
+                mailer.open()
+            elif not mailer.is_open() or (
+                    time.time() - last_used > self._max_idle and
+                    not mailer.is_alive()):
+                _reconnect(mailer)
+        except:
+            self.checkin(mailer, discard=True)
+            raise
+
+        return mailer
+
+    def checkin(self, mailer, discard=False):
+        """
+        Return a Mailer taken with checkout to the pool.
+
+        discard: if True, close the session instead of keeping it for
+                 reuse. Default: False
+        """
+        if discard or self._closed or not mailer.is_open():
+            _close_quietly(mailer)
+
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+        else:
+            with self._condition:
+                self._idle.append((mailer, time.time()))
+                self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Check a Mailer out for the duration of a with block. If the block
+        fails because the session was dropped, the session is discarded
+        rather than returned to the pool.
+
+        timeout: see checkout. Default: None
+        """
+        mailer = self.checkout(timeout)
+        discard = False
+
+        try:
+            yield mailer
+        except (SMTPException, socket.error) as error:
+            discard = _is_dropped(error)
+            raise
+        finally:
+            self.checkin(mailer, discard=discard)
+
+    def send(self, *args, **kwargs):
+        """
+        Send an email message over one of the pooled sessions. Takes the
+        same arguments as Mailer.send.
+        """
+        with self.connection() as mailer:
+            return mailer.send(*args, **kwargs)
+
+    def close(self):
+        """
+        Close all idle sessions. Sessions that are checked out are closed
+        when they are returned.
+        """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._condition.notify_all()
+
+        for mailer, _ in idle:
+            _close_quietly(mailer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _reconnect(mailer):
+    """
+    Throw away a Mailer's current session and log in again
+    """
+    _close_quietly(mailer)
+    mailer.open()
+
+
+def _close_quietly(mailer):
+    """
+    Close a Mailer's session, ignoring errors from an already dropped
+    connection
+    """
+    if mailer.is_open():
+        try:
+            mailer.close()
+        except (SMTPException, socket.error):
+            mailer._server = None  # pylint: disable-msg=W0212
@@ -0,0 +1,202 @@
+"""
+The RelaySet class spreads a Mailer's (or a MailerPool's) sessions across
+several relays, and steers them away from relays that are failing.
+"""
+from __future__ import absolute_import, division
+import threading
+import time
+
+import six
+
+# the ways a RelaySet can choose a relay
+WEIGHTED = 'weighted'
+LEAST_OUTSTANDING = 'least_outstanding'
+
+
+class Relay(object):
+    """
+    One mail server to send through.
+
+    host: the 'host:port' address of the server
+    weight: its share of sessions, relative to the other relays. Default: 1
+    username, password: the credentials to log in with. If None, the
+                        Mailer's are used. Default: None
+    rate_limiter: a RateLimiter for sending through this relay. If None,
+                  the Mailer's is used. Default: None
+    """
+    # pylint: disable-msg=R0913
+    def __init__(self, host, weight=1, username=None, password=None,
+                 rate_limiter=None):
+        if weight <= 0:
+            raise ValueError('weight must be positive')
+
+        self.host = host
+        self.weight = weight
+        self.username = username
+        self.password = password
+        self.rate_limiter = rate_limiter
+    # pylint: enable-msg=R0913
+
+    def __repr__(self):
+        return 'Relay(%r, weight=%r)' % (self.host, self.weight)
+
+
+class RelaySet(object):
+    """
+    The RelaySet class chooses which relay each new session connects to.
+    A relay that can't be connected or logged in to is left out for
+    retry_after seconds, and then tried again. It is safe to share between
+    threads, and so between the Mailers of a MailerPool (which makes one
+    when given a list of relays).
+
+    Relays are only chosen when a session is opened, so a Mailer sends
+    everything through one relay until its session ends. Load is spread
+    across relays by a MailerPool's sessions, or by starting new sessions
+    with max_messages or max_age.
+    """
+    def __init__(self, relays, strategy=WEIGHTED, retry_after=30):
+        """
+        relays: a list of relays, each a 'host:port' address, a dict of
+                Relay's arguments, or a Relay.
+        strategy: how to choose between the healthy relays:
+                  WEIGHTED ('weighted') takes turns, in proportion to their
+                  weights; LEAST_OUTSTANDING ('least_outstanding') takes
+                  the one with the fewest messages being sent through it
+                  for its weight (and then the fewest open sessions), so
+                  relays that are slow to get through messages get fewer
+                  new sessions. Default: WEIGHTED
+        retry_after: the seconds a relay is left out for after failing.
+                     Default: 30
+        """
+        if strategy not in (WEIGHTED, LEAST_OUTSTANDING):
+            raise ValueError('unknown strategy %r' % (strategy,))
+
+        self._relays = [_relay(relay) for relay in relays]
+
+        if not self._relays:
+            raise ValueError('no relays given')
+
+        self._strategy = strategy
+        self._retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._sessions = dict((relay, 0) for relay in self._relays)
+        self._outstanding = dict((relay, 0) for relay in self._relays)
+        self._current = dict((relay, 0) for relay in self._relays)
+        self._down_until = {}
+
+    @property
+    def relays(self):
+        """
+        The list of Relays
+        """
+        return list(self._relays)
+
+    def __len__(self):
+        return len(self._relays)
+
+    def choose(self, exclude=()):
+        """
+        The relay for a new session to connect to, leaving out those in
+        exclude. If every other relay is failing, the one that is soonest
+        due to be tried again is chosen. Returns None if every relay is
+        excluded.
+        """
+        now = time.time()
+
+        with self._lock:
+            candidates = [relay for relay in self._relays
+                          if relay not in exclude]
+
+            if not candidates:
+                return None
+
+            healthy = [relay for relay in candidates
+                       if self._down_until.get(relay, 0) <= now]
+
+            if not healthy:
+                return min(candidates, key=self._down_until.get)
+
+            if self._strategy == LEAST_OUTSTANDING:
+                return min(healthy, key=lambda relay: (
+                    self._outstanding[relay] / relay.weight,
+                    self._sessions[relay] / relay.weight))
+
+            # smooth weighted round robin: each relay earns its weight, and
+            # the chosen one pays back everyone's
+            for relay in healthy:
+                self._current[relay] += relay.weight
+
+            chosen = max(healthy, key=self._current.get)
+            self._current[chosen] -= sum(relay.weight for relay in healthy)
+
+            return chosen
+
+    def is_healthy(self, relay):
+        """
+        Whether a relay isn't being left out for failing
+        """
+        return self._down_until.get(relay, 0) <= time.time()
+
+    def outstanding(self, relay):
+        """
+        The number of messages being sent through a relay
+        """
+        return self._outstanding[relay]
+
+    def sessions(self, relay):
+        """
+        The number of sessions open to a relay
+        """
+        return self._sessions[relay]
+
+    def opened(self, relay):
+        """
+        Record that a session to a relay was opened, so it is healthy
+        """
+        with self._lock:
+            self._sessions[relay] += 1
+            self._down_until.pop(relay, None)
+
+    def closed(self, relay):
+        """
+        Record that a session to a relay was closed
+        """
+        with self._lock:
+            self._sessions[relay] -= 1
+
+    def sending(self, relay):
+        """
+        Record that a message started being sent through a relay
+        """
+        with self._lock:
+            self._outstanding[relay] += 1
+
+    def sent(self, relay):
+        """
+        Record that a message finished being sent (or failed) through a
+        relay
+        """
+        with self._lock:
+            self._outstanding[relay] -= 1
+
+    def failed(self, relay):
+        """
+        Record that a relay couldn't be connected or logged in to, leaving
+        it out for retry_after seconds
+        """
+        with self._lock:
+            self._down_until[relay] = time.time() + self._retry_after
+
+
+def _relay(relay):
+    """
+    Make a Relay from an address or a dict of arguments
+    """
+    if isinstance(relay, Relay):
+        return relay
+
+    if isinstance(relay, six.string_types):
+        return Relay(relay)
+
+    return Relay(**relay)
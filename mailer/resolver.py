@@ -0,0 +1,169 @@
+"""
+Resolvers look up the mail servers (MX records) of a domain, for a
+DirectTransport to deliver to.
+"""
+from __future__ import absolute_import
+from collections import OrderedDict
+import socket
+import threading
+import time
+
+import six
+
+# what a domain without MX records is cached for by DNSResolver
+_NEGATIVE_TTL = 300
+
+
+class Resolver(object):
+    """
+    The Resolver class is the interface a DirectTransport's resolver has.
+    Subclass it and override resolve.
+    """
+    def resolve(self, domain):
+        """
+        Look up a domain's mail servers.
+
+        Returns a (records, ttl) tuple: records is a list of (preference,
+        host) tuples, with each host a name or a 'host:port' address
+        (lower preferences are tried first), and ttl is the seconds the
+        answer may be cached for. records is empty if the domain takes no
+        mail. Raises socket.error if the lookup failed.
+        """
+        raise NotImplementedError
+
+
+class StaticResolver(Resolver):
+    """
+    The StaticResolver class answers from a dict instead of the DNS, for
+    tests (with SMTPSinks as the mail servers) or to pin domains to known
+    servers.
+
+    lookups: the number of times resolve has been called
+    """
+    def __init__(self, records, ttl=300):
+        """
+        records: a dict of domain: its mail servers, as a host, or a list
+                 of hosts (in order of preference) or (preference, host)
+                 tuples. Domains not in it take no mail.
+        ttl: the seconds answers may be cached for. Default: 300
+        """
+        self._records = dict((domain.lower(), _records(hosts))
+                             for domain, hosts in records.items())
+        self._ttl = ttl
+        self.lookups = 0
+
+    def resolve(self, domain):
+        self.lookups += 1
+
+        return list(self._records.get(domain.lower(), ())), self._ttl
+
+
+class DNSResolver(Resolver):
+    """
+    The DNSResolver class looks MX records up in the DNS, with dnspython
+    (which needs to be installed). A domain without MX records is its own
+    mail server (RFC 5321), unless it doesn't exist or has a null MX
+    record (RFC 7505).
+    """
+    def __init__(self, nameservers=None, timeout=10):
+        """
+        nameservers: a list of the IP addresses of the name servers to ask.
+                     If None, the system's are used. Default: None
+        timeout: the seconds to wait for an answer. Default: 10
+        """
+        try:
+            import dns.resolver
+        except ImportError:
+            raise ImportError('DNSResolver needs dnspython '
+                              '(pip install dnspython)')
+
+        self._dns = dns
+        self._resolver = dns.resolver.Resolver()
+        self._resolver.lifetime = timeout
+
+        if nameservers is not None:
+            self._resolver.nameservers = list(nameservers)
+
+    def resolve(self, domain):
+        resolver = self._dns.resolver
+        # dnspython 2 renamed query to resolve
+        query = getattr(self._resolver, 'resolve', self._resolver.query)
+
+        try:
+            answer = query(domain, 'MX')
+        except resolver.NXDOMAIN:
+            return [], _NEGATIVE_TTL
+        except resolver.NoAnswer:
+            return [(0, domain)], _NEGATIVE_TTL
+        except self._dns.exception.DNSException as error:
+            raise socket.gaierror('looking up MX records for %s failed: %s'
+                                  % (domain, error))
+
+        records = [(record.preference,
+                    record.exchange.to_text(omit_final_dot=True))
+                   for record in answer]
+
+        if records == [(0, '')] or records == [(0, '.')]:
+            return [], answer.rrset.ttl
+
+        return records, answer.rrset.ttl
+
+
+class CachingResolver(Resolver):
+    """
+    The CachingResolver class remembers another resolver's answers for as
+    long as their ttl allows (up to max_ttl), so each domain is only
+    looked up once in a while however many messages go to it. Failed
+    lookups aren't remembered. It is safe to share between threads.
+    """
+    def __init__(self, resolver, max_ttl=24 * 60 * 60, max_entries=10000):
+        """
+        resolver: the Resolver to ask
+        max_ttl: the most seconds to remember an answer for, whatever its
+                 ttl. Default: 86400
+        max_entries: the most domains to remember. Default: 10000
+        """
+        self._resolver = resolver
+        self._max_ttl = max_ttl
+        self._max_entries = max_entries
+
+        # domain: (when it expires, its records), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, domain):
+        domain = domain.lower()
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.pop(domain, None)
+
+            if entry is not None and entry[0] > now:
+                self._entries[domain] = entry
+
+                return list(entry[1]), entry[0] - now
+
+        # (looked up outside the lock, so one slow domain doesn't hold up
+        # the rest)
+        records, ttl = self._resolver.resolve(domain)
+        ttl = min(ttl, self._max_ttl)
+
+        if ttl > 0:
+            with self._lock:
+                self._entries[domain] = (now + ttl, tuple(records))
+
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+
+        return records, ttl
+
+
+def _records(hosts):
+    """
+    A StaticResolver's records for a domain, as (preference, host) tuples
+    """
+    if isinstance(hosts, six.string_types):
+        hosts = [hosts]
+
+    return tuple(host if isinstance(host, tuple) else (index * 10, host)
+                 for index, host in enumerate(hosts))
@@ -0,0 +1,387 @@
+"""
+The MailQueue class stores outgoing messages on disk and delivers them in
+the background, retrying failures.
+"""
+from __future__ import absolute_import
+from itertools import chain
+import json
+from smtplib import (SMTPException, SMTPRecipientsRefused,
+                     SMTPResponseException)
+import socket
+import sqlite3
+import threading
+import time
+
+import six
+
+from .mailer import _is_dropped, _is_file_error
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_due ON messages (status, next_attempt);
+"""
+
+# a message is 'queued' until a worker claims it, 'sending' while it is
+# being delivered (and removed once it has been) and 'dead' once it has
+# failed permanently or max_attempts times
+_QUEUED, _SENDING, _DEAD = 'queued', 'sending', 'dead'
+
+
+# the queue needs its settings
+# pylint: disable-msg=R0902
+class MailQueue(object):
+    """
+    The MailQueue class is a durable spool of outgoing messages. enqueue
+    only writes the message to an SQLite database, so it returns without
+    waiting on the mail server; worker threads started with start deliver
+    the messages over a MailerPool.
+
+    Messages that fail with a transient error (a 4xx reply or a dropped
+    connection) are retried with exponential backoff, as are the
+    recipients of a message that were refused with a 4xx reply (only they
+    are sent the retry). Messages that fail permanently, or max_attempts
+    times, are kept as dead letters.
+    """
+    # pylint: disable-msg=R0913
+    def __init__(self, path, max_attempts=8, retry_delay=30,
+                 max_retry_delay=3600, poll_interval=1):
+        """
+        path: the SQLite database file to store messages in.
+        max_attempts: how many times to try delivering a message before
+                      giving up on it. Default: 8
+        retry_delay: seconds to wait before the first retry. Each
+                     following retry waits twice as long. Default: 30
+        max_retry_delay: the longest to wait between retries, in seconds.
+                         Default: 3600
+        poll_interval: how often idle workers check for messages that
+                       have become due, in seconds. Default: 1
+        """
+        self._max_attempts = max_attempts
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._poll_interval = poll_interval
+
+        self._database = sqlite3.connect(path, isolation_level=None,
+                                         check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._database.execute('PRAGMA journal_mode=WAL')
+            self._database.execute('PRAGMA synchronous=NORMAL')
+            self._database.executescript(_SCHEMA)
+
+            # messages being sent when the queue last stopped may not have
+            # been delivered
+            self._database.execute(
+                'UPDATE messages SET status = ? WHERE status = ?',
+                (_QUEUED, _SENDING))
+
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._workers = []
+    # pylint: enable-msg=R0913
+
+    # pylint: disable-msg=R0913
+    def enqueue(self, recipients, subject, body, mail_as=None,
+                cc_recipients=None, bcc_recipients=None, attachments=None,
+                delay=0):
+        """
+        Store an email message for delivery. Takes the same arguments as
+        Mailer.send (attachments are read when the message is delivered,
+        so the files must still exist then), plus:
+
+        delay: seconds to wait before the first delivery attempt.
+               Default: 0
+
+        Returns the message's id.
+        """
+        message = json.dumps({
+            'recipients': recipients,
+            'subject': subject,
+            'body': body,
+            'mail_as': mail_as,
+            'cc_recipients': cc_recipients,
+            'bcc_recipients': bcc_recipients,
+            'attachments': attachments,
+        })
+
+        with self._lock:
+            cursor = self._database.execute(
+                'INSERT INTO messages (message, next_attempt) VALUES (?, ?)',
+                (message, time.time() + delay))
+
+        with self._wakeup:
+            self._wakeup.notify()
+
+        return cursor.lastrowid
+    # pylint: enable-msg=R0913
+
+    def __len__(self):
+        """
+        The number of messages waiting to be delivered
+        """
+        with self._lock:
+            return self._database.execute(
+                'SELECT COUNT(*) FROM messages WHERE status != ?',
+                (_DEAD,)).fetchone()[0]
+
+    def dead_letters(self):
+        """
+        The messages that couldn't be delivered, as a list of (id, send
+        arguments, attempts, error) tuples
+        """
+        with self._lock:
+            rows = self._database.execute(
+                'SELECT id, message, attempts, error FROM messages '
+                'WHERE status = ? ORDER BY id', (_DEAD,)).fetchall()
+
+        return [(message_id, json.loads(message), attempts, error)
+                for message_id, message, attempts, error in rows]
+
+    def retry_dead_letters(self):
+        """
+        Queue every dead letter for delivery again
+        """
+        with self._lock:
+            self._database.execute(
+                'UPDATE messages SET status = ?, attempts = 0, '
+                'next_attempt = ? WHERE status = ?',
+                (_QUEUED, time.time(), _DEAD))
+
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def process(self, pool):
+        """
+        Deliver the next due message, if there is one, over a Mailer from
+        pool.
+
+        Returns whether a message was processed.
+        """
+        claimed = self._claim()
+
+        if claimed is None:
+            return False
+
+        message_id, message, attempts = claimed
+
+        try:
+            mailer = pool.checkout()
+        except Exception as error:  # pylint: disable-msg=W0703
+            # not the message's fault, so it doesn't count as an attempt
+            self._retry(message_id, attempts, error)
+            return True
+
+        arguments = json.loads(message)
+        discard = False
+
+        try:
+            refused = mailer.send(**arguments)
+        except SMTPRecipientsRefused as error:
+            self._retry_refused(message_id, arguments, attempts + 1,
+                                error.recipients, error)
+        except Exception as error:  # pylint: disable-msg=W0703
+            discard = _is_dropped(error)
+
+            if _is_transient(error) and attempts + 1 < self._max_attempts:
+                self._retry(message_id, attempts + 1, error)
+            else:
+                self._bury(message_id, attempts + 1, error)
+        else:
+            if _transient_recipients(refused):
+                self._retry_refused(message_id, arguments, attempts + 1,
+                                    refused, SMTPRecipientsRefused(refused))
+            else:
+                with self._lock:
+                    self._database.execute(
+                        'DELETE FROM messages WHERE id = ?', (message_id,))
+        finally:
+            pool.checkin(mailer, discard=discard)
+
+        return True
+
+    def start(self, pool, workers=None):
+        """
+        Start delivering messages in background threads.
+
+        pool: the MailerPool to send over.
+        workers: the number of delivery threads. If None, one per session
+                 in pool. Default: None
+        """
+        if workers is None:
+            workers = pool.size
+
+        self._stopping.clear()
+
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work, args=(pool,))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        """
+        Stop the background workers, waiting for messages they are
+        sending to finish
+        """
+        self._stopping.set()
+
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+        for worker in self._workers:
+            worker.join()
+
+        self._workers = []
+
+    def close(self):
+        """
+        Stop the workers and close the database
+        """
+        self.stop()
+        self._database.close()
+
+    def _work(self, pool):
+        """
+        A worker thread's loop: deliver messages until stopped
+        """
+        while not self._stopping.is_set():
+            if not self.process(pool):
+                with self._wakeup:
+                    if not self._stopping.is_set():
+                        self._wakeup.wait(self._poll_interval)
+
+    def _claim(self):
+        """
+        Mark the next due message as being sent. Returns its id, stored
+        arguments and attempts so far, or None.
+        """
+        with self._lock:
+            self._database.execute('BEGIN IMMEDIATE')
+
+            try:
+                row = self._database.execute(
+                    'SELECT id, message, attempts FROM messages '
+                    'WHERE status = ? AND next_attempt <= ? '
+                    'ORDER BY next_attempt LIMIT 1',
+                    (_QUEUED, time.time())).fetchone()
+
+                if row is not None:
+                    self._database.execute(
+                        'UPDATE messages SET status = ? WHERE id = ?',
+                        (_SENDING, row[0]))
+            finally:
+                self._database.execute('COMMIT')
+
+        return row
+
+    def _retry(self, message_id, attempts, error, arguments=None):
+        """
+        Put a message back in the queue, due after the backoff delay (and
+        with new send arguments, if given)
+        """
+        delay = min(self._retry_delay * 2 ** max(attempts - 1, 0),
+                    self._max_retry_delay)
+
+        with self._lock:
+            self._database.execute(
+                'UPDATE messages SET status = ?, attempts = ?, '
+                'next_attempt = ?, error = ? WHERE id = ?',
+                (_QUEUED, attempts, time.time() + delay, repr(error),
+                 message_id))
+
+            if arguments is not None:
+                self._database.execute(
+                    'UPDATE messages SET message = ? WHERE id = ?',
+                    (json.dumps(arguments), message_id))
+
+    def _bury(self, message_id, attempts, error, arguments=None):
+        """
+        Give up on a message, keeping it as a dead letter (with new send
+        arguments, if given)
+        """
+        with self._lock:
+            self._database.execute(
+                'UPDATE messages SET status = ?, attempts = ?, error = ? '
+                'WHERE id = ?', (_DEAD, attempts, repr(error), message_id))
+
+            if arguments is not None:
+                self._database.execute(
+                    'UPDATE messages SET message = ? WHERE id = ?',
+                    (json.dumps(arguments), message_id))
+
+    # pylint: disable-msg=R0913
+    def _retry_refused(self, message_id, arguments, attempts, refused,
+                       error):
+        """
+        Retry a message for just those of its recipients that were refused
+        with a 4xx reply (in refused, a dict of recipient: (code, reply)),
+        or keep it as a dead letter (for just them, if there are any) once
+        it has been tried max_attempts times
+        """
+        fields = ('recipients', 'cc_recipients', 'bcc_recipients')
+        later = _transient_recipients(refused)
+        recipients = {}
+
+        for field in fields:
+            recipients[field] = arguments.get(field) or []
+
+            if isinstance(recipients[field], six.string_types):
+                recipients[field] = [recipients[field]]
+
+        if later and later != set(chain(*recipients.values())):
+            arguments = dict(arguments)
+
+            for field in fields:
+                arguments[field] = [recipient
+                                    for recipient in recipients[field]
+                                    if recipient in later]
+        else:
+            # (unchanged)
+            arguments = None
+
+        if later and attempts < self._max_attempts:
+            self._retry(message_id, attempts, error, arguments)
+        else:
+            self._bury(message_id, attempts, error, arguments)
+    # pylint: enable-msg=R0913
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+# pylint: enable-msg=R0902
+
+
+def _is_transient(error):
+    """
+    Whether an error from sending might not happen on a later attempt (a
+    missing or unreadable attachment won't get better by itself)
+    """
+    if isinstance(error, SMTPRecipientsRefused):
+        return bool(_transient_recipients(error.recipients))
+
+    if isinstance(error, SMTPResponseException):
+        return error.smtp_code < 500
+
+    if _is_file_error(error):
+        return False
+
+    return isinstance(error, (SMTPException, socket.error))
+
+
+def _transient_recipients(refused):
+    """
+    The recipients in a dict of refused recipients: (code, reply) that
+    were refused with a 4xx reply, and might be accepted later
+    """
+    return set(recipient for recipient, (code, _) in refused.items()
+               if 400 <= code < 500)
@@ -0,0 +1,183 @@
+"""
+The MessageTemplate class builds many similar messages (a mail merge)
+without serializing a whole MIME message for each one.
+"""
+from __future__ import absolute_import
+from string import Template
+import uuid
+
+import six
+
+from .mailer import (_build_skeleton, _encode, _encode_body, _encode_file,
+                     _format_addresses, _format_header, _quote_lines,
+                     _to_bytes)
+
+# the kinds of piece a compiled template is made of
+_TEXT, _SUBJECT, _TO, _BODY = range(4)
+
+
+class MessageTemplate(object):
+    """
+    The MessageTemplate class is a message whose subject and body contain
+    $placeholders (as used by string.Template), to be filled in with
+    different values for each recipient.
+
+    The message is serialized once, when the template is created, with
+    its fixed headers and attachments already encoded (and, the first
+    time render_bytes is used, in the form sent after DATA). Rendering it
+    for a recipient only encodes the subject, To header and body, and
+    joins them with the pre-built pieces.
+    """
+    # pylint: disable-msg=R0913
+    def __init__(self, subject, body, sender, cc_recipients=None,
+                 bcc_recipients=None, attachments=None, compress=None):
+        """
+        subject: the header of the message, with $placeholders
+        body: the message body, with $placeholders
+        sender: the address the message is sent from
+        cc_recipients, bcc_recipients, attachments: as for Mailer.send,
+            the same for every message.
+        compress: how to compress the attachments, as for
+                  build_message_string. Default: None
+        """
+        if isinstance(cc_recipients, six.string_types):
+            cc_recipients = [cc_recipients]
+
+        if isinstance(bcc_recipients, six.string_types):
+            bcc_recipients = [bcc_recipients]
+
+        if isinstance(attachments, six.string_types):
+            attachments = [attachments]
+
+        self.sender = sender
+        self.cc_recipients = list(cc_recipients or [])
+        self.bcc_recipients = list(bcc_recipients or [])
+
+        self._subject = Template(subject)
+        self._body = Template(body)
+        self._pieces = _compile(sender, self.cc_recipients,
+                                self.bcc_recipients, attachments or [],
+                                compress)
+        self._wire_pieces = None
+    # pylint: enable-msg=R0913
+
+    def render(self, recipients, **fields):
+        """
+        Build the message for some recipients.
+
+        recipients: either an email address, or a list of email addresses
+                    of the direct recipients of the message.
+        fields: the values for the subject's and body's placeholders.
+
+        Returns the message string, the same as build_message_string
+        would make.
+        """
+        return ''.join(self._render(self._pieces, recipients, fields))
+
+    def render_bytes(self, recipients, **fields):
+        """
+        Build the message for some recipients as it is sent after DATA.
+        Takes the same arguments as render, and returns the message byte
+        string, the same as build_message_bytes would make.
+        """
+        if self._wire_pieces is None:
+            self._wire_pieces = _to_wire(self._pieces)
+
+        return b''.join(self._render(self._wire_pieces, recipients, fields,
+                                     wire=True))
+
+    def _render(self, pieces, recipients, fields, wire=False):
+        """
+        Fill in compiled pieces for some recipients, as text, or if wire,
+        as bytes ready to send after DATA
+        """
+        if isinstance(recipients, six.string_types):
+            recipients = [recipients]
+
+        for kind, text in pieces:
+            if kind == _TEXT:
+                yield text
+                continue
+
+            if kind == _SUBJECT:
+                text = _format_header(
+                    'Subject', _encode(self._subject.substitute(fields)))
+            elif kind == _TO:
+                text = _format_header('To', _format_addresses(recipients))
+            else:
+                text = _encode_body(self._body.substitute(fields))
+
+            if wire:
+                # (base64 lines never start with '.')
+                text = _to_bytes(text).replace(b'\n', b'\r\n') \
+                    if kind == _BODY else _quote_lines(_to_bytes(text))
+
+            yield text
+
+
+def _compile(sender, cc_recipients, bcc_recipients, attachments,
+             compress=None):
+    """
+    Cut a message skeleton into the pieces a template is rendered from: a
+    list of (kind, text) pairs, where the text of the _TEXT pieces is used
+    as-is and the other kinds are filled in when rendering.
+    """
+    token = '<%s>' % uuid.uuid4().hex
+
+    skeleton, placeholders = _build_skeleton([token], token, sender,
+                                             cc_recipients, bcc_recipients,
+                                             attachments, compress=compress)
+
+    # each slot is the text to cut out, what replaces it, and its kind
+    slots = [(_format_header('Subject', token), None, _SUBJECT),
+             (_format_header('To', token), None, _TO),
+             (placeholders[0], None, _BODY)]
+    slots.extend((placeholder,
+                  ''.join(_encode_file(attachment, compress=compress)), _TEXT)
+                 for placeholder, attachment in zip(placeholders[1:],
+                                                    attachments))
+    slots.sort(key=lambda slot: skeleton.index(slot[0]))
+
+    pieces = []
+    start = 0
+
+    for text, replacement, kind in slots:
+        end = skeleton.index(text, start)
+
+        pieces.append((_TEXT, skeleton[start:end]))
+        pieces.append((kind, replacement))
+
+        start = end + len(text)
+
+    pieces.append((_TEXT, skeleton[start:]))
+
+    # join neighbouring fixed pieces
+    merged = []
+
+    for kind, text in pieces:
+        if kind == _TEXT and merged and merged[-1][0] == _TEXT:
+            merged[-1] = (_TEXT, merged[-1][1] + text)
+        else:
+            merged.append((kind, text))
+
+    return merged
+
+
+def _to_wire(pieces):
+    """
+    A compiled template's pieces with the fixed text as it is sent after
+    DATA: CRLF line endings, dot-stuffed, and the last piece ending with
+    the <CRLF>.<CRLF> terminator
+    """
+    wire = [(kind, _quote_lines(_to_bytes(text)) if kind == _TEXT else text)
+            for kind, text in pieces]
+
+    # (the last piece is always fixed text)
+    tail = wire[-1][1]
+
+    if tail and not tail.endswith(b'\r\n'):
+        tail += b'\r\n'
+
+    wire[-1] = (_TEXT, tail + b'.\r\n')
+
+    return wire
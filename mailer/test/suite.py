@@ -9,10 +9,42 @@ def build():
     """
     Build the test suite.
     """
+    from mailer.test.test_aio import TestAsyncMailer
+    from mailer.test.test_batch import TestBatch
+    from mailer.test.test_bench import TestBench
+    from mailer.test.test_bulk import TestBulk
+    from mailer.test.test_cache import TestAttachmentCache
+    from mailer.test.test_idempotency import TestIdempotencyIndex
+    from mailer.test.test_imports import TestImports
     from mailer.test.test_mailer import TestMailer
+    from mailer.test.test_message import TestOutgoingMessage
+    from mailer.test.test_metrics import TestMetrics
+    from mailer.test.test_pool import TestMailerPool
+    from mailer.test.test_relay import TestRelaySet
+    from mailer.test.test_resolver import TestResolvers
+    from mailer.test.test_spool import TestMailQueue
+    from mailer.test.test_template import TestMessageTemplate
+    from mailer.test.test_throttle import TestRateLimiter
+    from mailer.test.test_transport import TestTransports
 
     suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestAsyncMailer))
+    suite.addTest(unittest.makeSuite(TestBatch))
+    suite.addTest(unittest.makeSuite(TestBench))
+    suite.addTest(unittest.makeSuite(TestBulk))
+    suite.addTest(unittest.makeSuite(TestAttachmentCache))
+    suite.addTest(unittest.makeSuite(TestIdempotencyIndex))
+    suite.addTest(unittest.makeSuite(TestImports))
     suite.addTest(unittest.makeSuite(TestMailer))
+    suite.addTest(unittest.makeSuite(TestOutgoingMessage))
+    suite.addTest(unittest.makeSuite(TestMetrics))
+    suite.addTest(unittest.makeSuite(TestMailerPool))
+    suite.addTest(unittest.makeSuite(TestRelaySet))
+    suite.addTest(unittest.makeSuite(TestResolvers))
+    suite.addTest(unittest.makeSuite(TestMailQueue))
+    suite.addTest(unittest.makeSuite(TestMessageTemplate))
+    suite.addTest(unittest.makeSuite(TestRateLimiter))
+    suite.addTest(unittest.makeSuite(TestTransports))
 
     return suite
 
@@ -0,0 +1,187 @@
+"""
+A collection of unittests for the mailer module's AsyncMailer object
+"""
+from __future__ import absolute_import
+import sys
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904, W0212
+@unittest.skipIf(sys.version_info < (3, 7), 'AsyncMailer needs python 3.7')
+class TestAsyncMailer(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's AsyncMailer object
+    """
+    def test_split_host(self):
+        """
+        host strings are split into a hostname and port
+        """
+        from mailer.aio import _split_host
+
+        self.assertEqual(_split_host('smtp.gmail.com:587'),
+                         ('smtp.gmail.com', 587))
+        self.assertEqual(_split_host('localhost'), ('localhost', 25))
+
+    def test_send(self):
+        """
+        messages are delivered, and refused recipients reported (without
+        giving up on the connection)
+        """
+        import asyncio
+        from email import message_from_string
+        from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+
+        from mailer.aio import AsyncMailer
+        from mailer.bench.smtp_sink import SMTPSink
+
+        for pipelining in (True, False):
+            with SMTPSink(pipelining=pipelining,
+                          refuse=['bad@example.com']) as sink:
+                mailer_object = AsyncMailer('user', 'pass', sink.host,
+                                            concurrency=1, starttls=False)
+
+                loop = asyncio.new_event_loop()
+
+                try:
+                    self.assertRaises(
+                        SMTPServerDisconnected, loop.run_until_complete,
+                        mailer_object.send('to@example.com', 'subject',
+                                           'body'))
+
+                    loop.run_until_complete(mailer_object.open())
+                    refused = loop.run_until_complete(mailer_object.send(
+                        ['to@example.com', 'bad@example.com'], 'subject',
+                        'body', cc_recipients='cc@example.com'))
+
+                    for _ in range(3):
+                        self.assertRaises(
+                            SMTPRecipientsRefused, loop.run_until_complete,
+                            mailer_object.send('bad@example.com', 'subject',
+                                               'body'))
+
+                    self.assertEqual(len(mailer_object._idle), 1)
+                    loop.run_until_complete(mailer_object.close())
+                finally:
+                    loop.close()
+
+            self.assertEqual(list(refused), ['bad@example.com'])
+            self.assertEqual(len(sink.messages), 1)
+            self.assertEqual(sink.connections, 1)
+
+            sender, recipients, data = sink.messages[0]
+            message = message_from_string(data.decode('ascii'))
+
+            self.assertEqual(sender, 'user')
+            self.assertEqual(recipients, ['to@example.com', 'cc@example.com'])
+            self.assertEqual(message['Subject'], 'subject')
+
+    def test_bounded_concurrency(self):
+        """
+        concurrent sends use at most concurrency connections
+        """
+        import asyncio
+
+        from mailer.aio import AsyncMailer
+        from mailer.bench.smtp_sink import SMTPSink
+
+        with SMTPSink(latency=0.005) as sink:
+            mailer_object = AsyncMailer('user', 'pass', sink.host,
+                                        concurrency=3, starttls=False)
+
+            loop = asyncio.new_event_loop()
+
+            try:
+                loop.run_until_complete(mailer_object.open())
+                results = loop.run_until_complete(mailer_object.send_many(
+                    ('to%d@example.com' % index, 'subject', 'body')
+                    for index in range(20)))
+                loop.run_until_complete(mailer_object.close())
+            finally:
+                loop.close()
+
+        self.assertEqual(results, [{}] * 20)
+        self.assertEqual(len(sink.messages), 20)
+        self.assertTrue(1 < sink.connections <= 3)
+
+    def test_close(self):
+        """
+        messages are only built once they can be sent, and closing the
+        mailer mid-send leaves no connections open
+        """
+        import asyncio
+        from smtplib import SMTPServerDisconnected
+
+        import mailer.aio
+        from mailer.aio import AsyncMailer
+        from mailer.bench.smtp_sink import SMTPSink
+
+        prepare_message = mailer.aio._prepare_message
+        waiting = []
+
+        def prepare(*args, **kwargs):
+            """
+            count the messages built but not yet sent
+            """
+            waiting.append(len(waiting) - len(sink.messages))
+            return prepare_message(*args, **kwargs)
+
+        mailer.aio._prepare_message = prepare
+
+        try:
+            with SMTPSink(latency=0.005) as sink:
+                mailer_object = AsyncMailer('user', 'pass', sink.host,
+                                            concurrency=2, starttls=False)
+
+                loop = asyncio.new_event_loop()
+
+                try:
+                    loop.run_until_complete(mailer_object.open())
+                    sends = loop.create_task(mailer_object.send_many(
+                        ('to%d@example.com' % index, 'subject', 'body')
+                        for index in range(20)))
+
+                    # close the mailer while messages are being sent
+                    while len(sink.messages) < 4:
+                        loop.run_until_complete(asyncio.sleep(0.001))
+
+                    loop.run_until_complete(mailer_object.close())
+                    results = loop.run_until_complete(sends)
+                finally:
+                    loop.close()
+        finally:
+            mailer.aio._prepare_message = prepare_message
+
+        self.assertTrue(max(waiting) <= 2)
+        self.assertTrue(results[0] == {})
+        self.assertTrue(isinstance(results[-1], SMTPServerDisconnected))
+        self.assertEqual(mailer_object._idle, [])
+# pylint: enable-msg=R0904, W0212
+
+
+def run_tests():
+    """
+    Run all TestAsyncMailer tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
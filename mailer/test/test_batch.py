@@ -0,0 +1,93 @@
+"""
+A collection of unittests for the mailer module's batch sending
+"""
+from __future__ import absolute_import
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestBatch(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's batch sending
+    """
+    def test_shards(self):
+        """
+        message streams are cut into shards
+        """
+        from mailer.batch import _shards
+
+        self.assertEqual(list(_shards(iter(range(7)), 3)),
+                         [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(_shards([], 3)), [])
+
+    def test_send_parallel(self):
+        """
+        every message is sent, and results come back in order
+        """
+        import multiprocessing
+
+        import mailer.mailer
+        from mailer.batch import send_parallel
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        # worker processes only see the fake smtp class if they are forked
+        if 'fork' not in getattr(multiprocessing, 'get_all_start_methods',
+                                 lambda: ['fork'])():
+            return
+
+        messages = [('to%d@example.com' % index, 'subject %d' % index, 'body')
+                    for index in range(30)]
+        messages[7] = ('bad@example.com', 'subject', 'body')
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink(refuse=['bad@example.com']) as sink:
+                result = send_parallel(iter(messages), 'user', 'pass',
+                                       sink.host, processes=2,
+                                       connections_per_process=2,
+                                       shard_size=4)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        self.assertEqual(len(result.results), 30)
+        self.assertEqual((result.sent, result.failed), (29, 1))
+        self.assertFalse(result.results[7].ok)
+        self.assertEqual([sent.accepted for sent in result.results[:3]],
+                         [['to0@example.com'], ['to1@example.com'],
+                          ['to2@example.com']])
+        self.assertTrue(result.rate > 0)
+
+        self.assertEqual(len(sink.messages), 29)
+        self.assertTrue(sink.connections <= 4)
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestBatch tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,82 @@
+"""
+A collection of unittests for the mailer.bench benchmarks
+"""
+from __future__ import absolute_import
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestBench(unittest.TestCase):
+    """
+    A collection of unittests for the mailer.bench benchmarks
+    """
+    def test_stats(self):
+        """
+        rates and percentiles are worked out from the latencies
+        """
+        from mailer.bench import Stats
+
+        stats = Stats('test', [0.003, 0.001, 0.002, 0.004], 2.0, None)
+
+        self.assertEqual(stats.count, 4)
+        self.assertEqual(stats.rate, 2.0)
+        self.assertEqual(stats.p50, 0.003)
+        self.assertEqual(stats.p99, 0.004)
+        self.assertTrue(stats.row().startswith('test '))
+        self.assertEqual(Stats('empty', [], 0, None).p99, 0.0)
+
+    def test_bench_build(self):
+        """
+        building is measured for every message
+        """
+        from mailer.bench import bench_build
+
+        for streaming in (False, True):
+            stats = bench_build(count=3, recipients=2, attachment_size=1000,
+                                streaming=streaming)
+
+            self.assertEqual(stats.count, 3)
+            self.assertTrue(stats.p50 <= stats.p99)
+
+    def test_bench_send(self):
+        """
+        every message is sent to the sink, over STARTTLS
+        """
+        from mailer.bench import bench_send
+
+        for batch in (False, True):
+            stats = bench_send(count=5, concurrency=2, batch=batch,
+                               pipelining=not batch)
+
+            self.assertEqual(stats.count, 5)
+            self.assertTrue(stats.rate > 0)
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestBench tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
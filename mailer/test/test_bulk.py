@@ -0,0 +1,240 @@
+"""
+A collection of unittests for the mailer module's bulk sending command
+"""
+from __future__ import absolute_import
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestBulk(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's bulk sending command
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _path(self, name):
+        """
+        A path in the test's directory
+        """
+        return os.path.join(self.directory, name)
+
+    def _write(self, name, text):
+        """
+        Write a file in the test's directory, returning its path
+        """
+        with io.open(self._path(name), 'w', encoding='utf-8') as output:
+            output.write(text)
+
+        return self._path(name)
+
+    def test_send_jsonl(self):
+        """
+        every message is sent, failures are written out, and a second run
+        with the same resume file sends nothing
+        """
+        from six import StringIO
+
+        from mailer.__main__ import main
+        from mailer.bench.smtp_sink import CERTFILE, SMTPSink
+
+        messages = [{'recipients': ['to%d@example.com' % index,
+                                    'bad@example.com'],
+                     'subject': 'subject %d' % index, 'body': 'body'}
+                    for index in range(30)]
+        messages[7] = {'recipients': 'bad@example.com', 'subject': 'lost',
+                       'body': 'body'}
+        path = self._write('messages.jsonl', u''.join(
+            u'%s\n' % json.dumps(message) for message in messages))
+
+        arguments = ['send', path, '--username', 'user', '--password',
+                     'pass', '--connections', '3', '--interval', '0.05',
+                     '--resume', self._path('resume.json'),
+                     '--failures', self._path('failures.jsonl')]
+
+        with SMTPSink(certfile=CERTFILE, refuse=['bad@example.com']) as sink:
+            arguments[6:6] = ['--host', sink.host]
+            report = StringIO()
+
+            self.assertEqual(main(arguments, report), 1)
+            self.assertEqual(len(sink.messages), 29)
+
+            again = StringIO()
+
+            self.assertEqual(main(arguments, again), 0)
+            self.assertEqual(len(sink.messages), 29)
+
+        lines = report.getvalue().splitlines()
+
+        self.assertTrue(lines[-1].startswith('mean '))
+        self.assertTrue(any(line.startswith('latency') for line in lines))
+        self.assertTrue(any(line.startswith('29 sent, 1 failed, 29 '
+                                            'recipients refused, 0 skipped')
+                            for line in lines))
+        self.assertTrue('0 sent, 0 failed, 0 recipients refused, 30 '
+                        'skipped' in again.getvalue())
+
+        with open(self._path('resume.json')) as resume:
+            self.assertEqual(json.load(resume)['done'], 30)
+
+        with open(self._path('failures.jsonl')) as failures:
+            failed = [json.loads(line) for line in failures]
+
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0]['number'], 8)
+        self.assertEqual(failed[0]['message']['subject'], 'lost')
+
+    def test_send_csv(self):
+        """
+        CSV columns fill in the defaults' placeholders, and lists are
+        separated by ';'
+        """
+        from email import message_from_string
+
+        from six import StringIO
+
+        from mailer.__main__ import main
+        from mailer.bench.smtp_sink import CERTFILE, SMTPSink
+
+        path = self._write('people.csv', u'recipients,name,cc_recipients\n'
+                                         u'ann@example.com,Ann,\n'
+                                         u'bob@example.com,Bob,'
+                                         u'x@example.com; y@example.com\n')
+        body = self._write('body.txt', u'Dear $name, $unknown stays.')
+
+        with SMTPSink(certfile=CERTFILE) as sink:
+            status = main(['send', path, '--host', sink.host,
+                           '--username', 'user', '--password', 'pass',
+                           '--subject', 'Hello $name', '--body-file', body,
+                           '--sender', 'news@example.com',
+                           '--connections', '1'], StringIO())
+
+        self.assertEqual(status, 0)
+        self.assertEqual([(sender, recipients)
+                          for sender, recipients, _ in sink.messages],
+                         [('news@example.com', ['ann@example.com']),
+                          ('news@example.com', ['bob@example.com',
+                                                'x@example.com',
+                                                'y@example.com'])])
+
+        message = message_from_string(sink.messages[1][2].decode('ascii'))
+
+        self.assertEqual(message['Subject'], 'Hello Bob')
+        self.assertEqual(message.get_payload(decode=True),
+                         b'Dear Bob, $unknown stays.')
+
+    def test_checkpoint(self):
+        """
+        a checkpoint only moves past messages once all before them are
+        finished, and is resumed from its file
+        """
+        from mailer.bulk import Checkpoint
+
+        path = self._path('resume.json')
+        source = self._write('messages.jsonl', u'')
+        checkpoint = Checkpoint(path, source)
+
+        for number in (2, 3, 5):
+            checkpoint.finish(number)
+
+        self.assertEqual(checkpoint.done, 0)
+
+        checkpoint.finish(1)
+        checkpoint.save()
+
+        self.assertEqual(checkpoint.done, 3)
+        self.assertEqual(Checkpoint(path, source).done, 3)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+        # not for another file
+        other = self._write('other.jsonl', u'')
+
+        self.assertRaises(ValueError, Checkpoint, path, other)
+
+    def test_bad_line(self):
+        """
+        a line that isn't a message stops sending, after the ones before
+        it, with an error
+        """
+        from six import StringIO
+
+        from mailer.__main__ import main
+        from mailer.bench.smtp_sink import CERTFILE, SMTPSink
+
+        path = self._write('messages.jsonl',
+                           u'{"recipients": "to@example.com", '
+                           u'"subject": "s", "body": "b"}\n'
+                           u'[1, 2]\n')
+        report = StringIO()
+
+        with SMTPSink(certfile=CERTFILE) as sink:
+            status = main(['send', path, '--host', sink.host,
+                           '--username', 'user', '--password', 'pass'],
+                          report)
+
+        self.assertEqual(status, 1)
+        self.assertEqual(len(sink.messages), 1)
+        self.assertTrue('line 2 of %s is not a JSON object' % path in
+                        report.getvalue())
+
+    def test_histogram(self):
+        """
+        latencies are counted into buckets, shown from the first used to
+        the last
+        """
+        from mailer.bulk import BulkStats
+
+        stats = BulkStats()
+
+        for latency in (0.003, 0.004, 0.004, 0.03, 0.5):
+            stats.record(latency)
+
+        stats.record(0.004, failed=True)
+
+        lines = stats.histogram()
+
+        self.assertEqual((stats.sent, stats.failed), (5, 1))
+        self.assertEqual([line.split()[:2] for line in lines[1:-1]],
+                         [['<5ms', '4'], ['<10ms', '0'], ['<20ms', '0'],
+                          ['<50ms', '1'], ['<100ms', '0'], ['<200ms', '0'],
+                          ['<500ms', '1']])
+        self.assertEqual(lines[1].split()[2], '#' * 40)
+        self.assertEqual(BulkStats().histogram(), ['no messages sent'])
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestBulk tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,167 @@
+"""
+A collection of unittests for the mailer module's AttachmentCache object
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestAttachmentCache(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's AttachmentCache object
+    """
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _write(self, name, size, mtime=None):
+        """
+        write a file of random bytes, returning its path
+        """
+        path = os.path.join(self._directory, name)
+
+        with open(path, 'wb') as attachment:
+            attachment.write(os.urandom(size))
+
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+        return path
+
+    def test_hits_and_misses(self):
+        """
+        files are encoded once, and again when they change
+        """
+        from mailer.cache import AttachmentCache
+        from mailer.mailer import _encode_file, GZIP
+
+        cache = AttachmentCache()
+        path = self._write('a', 1000, mtime=1000000)
+
+        encoded = ''.join(_encode_file(path))
+
+        self.assertEqual(cache.chunks(path), [encoded])
+        self.assertEqual(cache.chunks(path), [encoded])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.size, len(encoded))
+
+        # a changed file is a miss, and replaces the old entry
+        path = self._write('a', 2000, mtime=2000000)
+        encoded = ''.join(_encode_file(path))
+
+        self.assertEqual(cache.chunks(path), [encoded])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, len(encoded))
+
+        # compressed, the same file is another entry
+        compressed = ''.join(_encode_file(path, compress=GZIP))
+
+        self.assertEqual(cache.chunks(path, GZIP), [compressed])
+        self.assertEqual(cache.chunks(path, GZIP), [compressed])
+        self.assertEqual(cache.chunks(path), [encoded])
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+    def test_eviction(self):
+        """
+        the least recently used files are evicted to stay under max_size,
+        and files too big for the cache aren't stored
+        """
+        from mailer.cache import AttachmentCache
+
+        # each file encodes to 1354 bytes
+        cache = AttachmentCache(max_size=3000)
+        first, second, third = [self._write(name, 1000)
+                                for name in ('a', 'b', 'c')]
+
+        cache.chunks(first)
+        cache.chunks(second)
+        cache.chunks(first)
+        cache.chunks(third)
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+
+        # second was evicted, first wasn't
+        cache.chunks(first)
+        self.assertEqual(cache.hits, 2)
+        cache.chunks(second)
+        self.assertEqual(cache.misses, 4)
+
+        big = self._write('big', 10000)
+        chunks = cache.chunks(big)
+
+        self.assertFalse(isinstance(chunks, list))
+        self.assertEqual(len(''.join(chunks)), 13512)
+        self.assertEqual(len(cache), 2)
+
+    def test_build_message(self):
+        """
+        messages built with a cache are the same as without
+        """
+        from email import message_from_string
+
+        from mailer.cache import AttachmentCache
+        from mailer.mailer import build_message_chunks, build_message_string
+
+        cache = AttachmentCache()
+        path = self._write('a', 5000)
+
+        with open(path, 'rb') as attachment:
+            data = attachment.read()
+
+        for _ in range(2):
+            message = message_from_string(build_message_string(
+                ['to@example.com'], 'subject', 'body', 'from@example.com',
+                attachments=[path], attachment_cache=cache))
+
+            self.assertEqual(message.get_payload()[1].get_payload(decode=True),
+                             data)
+
+            message = message_from_string(b''.join(build_message_chunks(
+                ['to@example.com'], 'subject', 'body', 'from@example.com',
+                attachments=[path], attachment_cache=cache)).decode('ascii'))
+
+            self.assertEqual(message.get_payload()[1].get_payload(decode=True),
+                             data)
+
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestAttachmentCache tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,159 @@
+"""
+A collection of unittests for the mailer module's IdempotencyIndex object
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestIdempotencyIndex(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's IdempotencyIndex
+    object
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index(self):
+        """
+        keys are claimed once, and forgotten after ttl or beyond
+        max_entries
+        """
+        from mailer.idempotency import IdempotencyIndex
+
+        index = IdempotencyIndex(ttl=0.05, max_entries=3)
+
+        self.assertTrue(index.claim('a'))
+        # being sent counts as sent
+        self.assertFalse(index.claim('a'))
+        self.assertFalse('a' in index)
+
+        index.abandon('a')
+        self.assertTrue(index.claim('a'))
+
+        index.complete('a')
+        self.assertTrue('a' in index)
+        self.assertFalse(index.claim('a'))
+
+        for key in 'bcd':
+            index.add(key)
+
+        self.assertEqual(len(index), 3)
+        self.assertFalse('a' in index)
+
+        time.sleep(0.06)
+
+        self.assertEqual(len(index), 0)
+        self.assertTrue(index.claim('b'))
+
+    def test_persistent(self):
+        """
+        keys stored in a database are remembered by the next index
+        """
+        from mailer.idempotency import IdempotencyIndex
+
+        path = os.path.join(self.directory, 'sent.db')
+
+        with IdempotencyIndex(max_entries=2, path=path) as index:
+            for key in ('a', 'b', 'c'):
+                index.add(key)
+
+        with IdempotencyIndex(max_entries=2, path=path) as index:
+            self.assertEqual(len(index), 2)
+            self.assertFalse('a' in index)
+            self.assertTrue('c' in index)
+
+        with IdempotencyIndex(ttl=0, path=path) as index:
+            self.assertEqual(len(index), 0)
+
+    def test_mailer(self):
+        """
+        a message is only sent once per key, with a Message-ID made from
+        it, and a failed send can be tried again
+        """
+        from email import message_from_string
+
+        from mailer.idempotency import IdempotencyIndex
+        from mailer.mailer import Mailer
+        from mailer.metrics import InMemoryMetrics
+        from mailer.transport import MemoryTransport
+
+        transport = MemoryTransport()
+        metrics = InMemoryMetrics()
+        mailer = Mailer('user@example.com', 'pass', transport=transport,
+                        idempotency_index=IdempotencyIndex(),
+                        metrics=metrics)
+
+        for _ in range(2):
+            self.assertEqual(mailer.send('to@example.com', 'subject', 'body',
+                                         idempotency_key='order-1'), {})
+
+        mailer.send('to@example.com', 'subject', 'body')
+        mailer.send('to@example.com', 'subject', 'body')
+
+        results = mailer.send_many([
+            {'recipients': 'to@example.com', 'subject': 's', 'body': 'b',
+             'idempotency_key': 'order-1'},
+            {'recipients': 'to@example.com', 'subject': 's', 'body': 'b',
+             'idempotency_key': 'order-2'}])
+
+        self.assertTrue(results[0].duplicate)
+        self.assertTrue(results[0].ok)
+        self.assertFalse(results[1].duplicate)
+        self.assertEqual(len(transport.messages), 4)
+        self.assertEqual(metrics.counter('duplicates_skipped'), 2)
+
+        message = message_from_string(transport.messages[0][2].decode())
+
+        self.assertTrue(message['Message-ID'].endswith('@example.com>'))
+        self.assertFalse('Message-ID' in message_from_string(
+            transport.messages[1][2].decode()))
+
+        # a send that fails doesn't use up the key
+        transport.send = lambda *args: 1 / 0
+
+        self.assertRaises(ZeroDivisionError, mailer.send, 'to@example.com',
+                          's', 'b', idempotency_key='order-3')
+
+        del transport.send
+
+        mailer.send('to@example.com', 's', 'b', idempotency_key='order-3')
+
+        self.assertEqual(len(transport.messages), 5)
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestIdempotencyIndex tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,110 @@
+"""
+A collection of unittests for how cheaply the mailer module imports
+"""
+from __future__ import absolute_import
+import sys
+import unittest
+
+# the most seconds importing mailer may take (it takes well under a
+# millisecond; this leaves room for slow machines)
+IMPORT_BUDGET = 0.02
+
+# modules importing mailer shouldn't pull in
+HEAVY_MODULES = ['email.mime.text', 'mailer.mailer', 'six', 'smtplib', 'ssl',
+                 'sqlite3']
+
+
+def _run(code):
+    """
+    Run python code in a fresh interpreter, returning what it printed
+    """
+    import os
+    import subprocess
+
+    import mailer
+
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.path.dirname(
+        os.path.dirname(os.path.abspath(mailer.__file__)))
+
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     env=environment)
+
+    return output.decode('ascii').strip()
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+@unittest.skipIf(sys.version_info < (3, 7),
+                 'lazy imports need python 3.7 or later')
+class TestImports(unittest.TestCase):
+    """
+    A collection of unittests for how cheaply the mailer module imports
+    """
+    def test_lazy(self):
+        """
+        importing mailer doesn't import smtplib or the MIME classes, and
+        names are imported when first used
+        """
+        loaded = _run('import sys; import mailer; '
+                      'print(",".join(sorted(sys.modules)))').split(',')
+
+        for module in HEAVY_MODULES:
+            self.assertFalse(module in loaded, module)
+
+        self.assertEqual(_run(
+            'import sys; from mailer import Mailer; '
+            'import mailer.mailer; '
+            'print(Mailer is mailer.mailer.Mailer, '
+            '"email.mime.text" in sys.modules)'), 'True False')
+
+        # submodules are still attributes of the package
+        self.assertEqual(_run(
+            'import mailer; print(mailer.mailer.Mailer.__name__, '
+            'mailer.pool.MailerPool.__name__)'), 'Mailer MailerPool')
+
+        import mailer
+
+        self.assertRaises(AttributeError, getattr, mailer, 'Missing')
+        self.assertTrue('MailerPool' in dir(mailer))
+
+    def test_budget(self):
+        """
+        importing mailer takes less than IMPORT_BUDGET seconds
+        """
+        # the fastest of a few tries, to ignore noise from the machine
+        elapsed = min(float(_run(
+            'import time; start = time.perf_counter(); import mailer; '
+            'print(time.perf_counter() - start)')) for _ in range(3))
+
+        self.assertTrue(elapsed < IMPORT_BUDGET,
+                        'importing mailer took %.4fs' % elapsed)
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestImports tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
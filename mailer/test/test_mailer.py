@@ -195,6 +195,601 @@ class TestMailer(unittest.TestCase):
                 raise ValueError('attachment missing')
     # pylint: enable-msg=R0912, R0914
 
+    def test_build_message_chunks(self):
+        """
+        test that attachments are encoded in chunks, and that the chunks
+        make up the same message build_message_string does
+        """
+        import base64
+        from email import message_from_string
+        import os
+        import tempfile
+
+        from mailer.mailer import (_encode_file, _quote_chunks, _quote_data,
+                                   build_message_chunks, build_message_string)
+
+        handle, path = tempfile.mkstemp()
+
+        try:
+            os.write(handle, os.urandom(1000))
+            os.close(handle)
+
+            with open(path, 'rb') as attachment:
+                data = attachment.read()
+
+            chunks = list(_encode_file(path, chunk_size=57 * 3))
+
+            self.assertEqual(len(chunks), 6)
+            self.assertEqual(base64.b64decode(''.join(chunks)), data)
+            self.assertTrue(all(len(line) == 76
+                                for line in ''.join(chunks).splitlines()[:-1]))
+
+            chunks = list(build_message_chunks(['to@example.com'], 'subject',
+                                               'body', 'from@example.com',
+                                               attachments=[path, path]))
+
+            self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+
+            message = message_from_string(b''.join(chunks).decode('ascii'))
+            parts = message.get_payload()
+
+            self.assertEqual(len(parts), 3)
+            self.assertEqual(parts[1].get_payload(decode=True), data)
+            self.assertEqual(parts[2].get_payload(decode=True), data)
+            self.assertEqual(parts[2].get_filename(), os.path.basename(path))
+
+            # the placeholders differ, everything else matches
+            message_string = build_message_string(
+                ['to@example.com'], 'subject', 'body', 'from@example.com',
+                attachments=[path])
+            chunks = b''.join(build_message_chunks(
+                ['to@example.com'], 'subject', 'body', 'from@example.com',
+                attachments=[path])).decode('ascii')
+
+            self.assertEqual(len(message_string), len(chunks))
+
+            # quoting is unchanged by where a message is cut into chunks
+            self.assertEqual(b''.join(_quote_chunks([b'a\n.b', b'\r', b'\nc',
+                                                     b'\n.d'])),
+                             _quote_data(b'a\n.b\r\nc\n.d'))
+        finally:
+            os.remove(path)
+
+    def test_build_message_bytes(self):
+        """
+        test that messages can be built as they are sent after DATA
+        """
+        from os.path import abspath, dirname, join
+
+        from mailer.mailer import (_quote_data, build_message_bytes,
+                                   build_message_chunks, build_message_string)
+
+        attachment_a = join(dirname(abspath(__file__)), 'attachmentA.txt')
+        arguments = (['to@example.com'], 'subject', '.body\n.\n',
+                     'from@example.com')
+
+        message = build_message_bytes(*arguments)
+
+        self.assertEqual(message,
+                         _quote_data(build_message_string(*arguments)))
+        self.assertEqual(b''.join(build_message_chunks(*arguments, wire=True)),
+                         message)
+
+        # the boundaries differ, everything else matches
+        message = build_message_bytes(*arguments, attachments=[attachment_a])
+        chunks = list(build_message_chunks(*arguments, wire=True,
+                                           attachments=[attachment_a]))
+
+        self.assertEqual(len(message), len(_quote_data(build_message_string(
+            *arguments, attachments=[attachment_a]))))
+        self.assertEqual(len(b''.join(chunks)), len(message))
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertTrue(message.endswith(b'\r\n.\r\n'))
+        self.assertFalse(b'\n' in message.replace(b'\r\n', b''))
+
+    def test_send_attachments(self):
+        """
+        check that messages with attachments are streamed to the server
+        """
+        from email import message_from_string
+        from os.path import abspath, dirname, join
+
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        attachment_a = join(dirname(abspath(__file__)), 'attachmentA.txt')
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink(refuse=['bad@example.com']) as sink:
+                with mailer.mailer.Mailer('user', 'pass',
+                                          sink.host) as mailer_object:
+                    refused = mailer_object.send(
+                        ['to@example.com', 'bad@example.com'], 'subject',
+                        'body', attachments=attachment_a)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        self.assertEqual(list(refused), ['bad@example.com'])
+        self.assertEqual(len(sink.messages), 1)
+
+        _, recipients, data = sink.messages[0]
+        message = message_from_string(data.decode('ascii'))
+
+        self.assertEqual(recipients, ['to@example.com'])
+
+        with open(attachment_a, 'rb') as attachment:
+            self.assertEqual(message.get_payload()[1].get_payload(decode=True),
+                             attachment.read())
+
+    def test_compress_attachments(self):
+        """
+        attachments are compressed into gzip files or zip archives as they
+        are encoded, apart from those already compressed
+        """
+        import base64
+        from email import message_from_string
+        import gzip
+        import io
+        import os
+        import shutil
+        import tempfile
+        import zipfile
+
+        from mailer.mailer import (_encode_file, build_message_string, GZIP,
+                                   ZIP)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        report = os.path.join(directory, 'report.csv')
+        image = os.path.join(directory, 'image.png')
+        data = b''.join(b'%d,row %d,0.5\n' % (index, index)
+                        for index in range(20000))
+
+        with open(report, 'wb') as output:
+            output.write(data)
+
+        with open(image, 'wb') as output:
+            output.write(os.urandom(100))
+
+        # streamed in small chunks, so lines are cut across them
+        encoded = ''.join(_encode_file(report, chunk_size=1000,
+                                       compress=GZIP))
+
+        self.assertTrue(all(len(line) == 76
+                            for line in encoded.splitlines()[:-1]))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(
+            base64.b64decode(encoded))).read(), data)
+
+        message = message_from_string(build_message_string(
+            ['to@example.com'], 'subject', 'body', 'from@example.com',
+            attachments=[report, image], compress=ZIP))
+        compressed, uncompressed = message.get_payload()[1:]
+
+        self.assertEqual(compressed.get_content_type(), 'application/zip')
+        self.assertEqual(compressed.get_filename(), 'report.csv.zip')
+        self.assertTrue(len(compressed.get_payload()) < len(data) / 2)
+
+        archive = zipfile.ZipFile(io.BytesIO(
+            compressed.get_payload(decode=True)))
+
+        self.assertEqual(archive.testzip(), None)
+        self.assertEqual(archive.namelist(), ['report.csv'])
+        self.assertEqual(archive.read('report.csv'), data)
+
+        self.assertEqual(uncompressed.get_content_type(),
+                         'application/octet-stream')
+        self.assertEqual(uncompressed.get_filename(), 'image.png')
+
+        self.assertRaises(ValueError, build_message_string,
+                          ['to@example.com'], 'subject', 'body',
+                          'from@example.com', attachments=[report],
+                          compress='bzip2')
+
+    def test_split_attachments(self):
+        """
+        a message too big for max_message_size is sent as several, each
+        under it, and one that can't be is refused before anything is
+        sent
+        """
+        from email import message_from_string
+        import os
+        import shutil
+        import tempfile
+
+        from mailer.mailer import GZIP, Mailer
+        from mailer.transport import MemoryTransport
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        attachments = []
+
+        for index, size in enumerate([30000, 30000, 30000, 80000]):
+            attachments.append(os.path.join(directory, '%d.bin' % index))
+
+            with open(attachments[-1], 'wb') as output:
+                output.write(os.urandom(size))
+
+        huge = attachments.pop()
+
+        transport = MemoryTransport()
+
+        with Mailer('user', 'pass', transport=transport,
+                    max_message_size=100000) as mailer:
+            mailer.send('to@example.com', 'Reports', 'body',
+                        attachments=attachments, idempotency_key='reports')
+            mailer.send('to@example.com', 'Report', 'body',
+                        attachments=attachments[0])
+
+            self.assertRaises(ValueError, mailer.send, 'to@example.com',
+                              'Everything', 'body',
+                              attachments=[attachments[0], huge])
+
+        self.assertEqual(len(transport.messages), 3)
+
+        messages = [message_from_string(data.decode('ascii'))
+                    for _, _, data in transport.messages]
+
+        self.assertEqual([message['Subject'] for message in messages],
+                         ['Reports (1/2)', 'Reports (2/2)', 'Report'])
+        self.assertEqual([len(message.get_payload()) for message in messages],
+                         [3, 2, 2])
+        self.assertNotEqual(messages[0]['Message-ID'],
+                            messages[1]['Message-ID'])
+
+        for _, _, data in transport.messages:
+            self.assertTrue(len(data) + data.count(b'\n') <= 100000)
+
+        # with compression, sizes are still worked out without reading
+        # (random data doesn't compress, so nothing shrinks)
+        transport = MemoryTransport()
+
+        with Mailer('user', 'pass', transport=transport, compress=GZIP,
+                    max_message_size=100000) as mailer:
+            mailer.send('to@example.com', 'Reports', 'body',
+                        attachments=attachments)
+
+        self.assertEqual(len(transport.messages), 2)
+
+        for _, _, data in transport.messages:
+            self.assertTrue(len(data) + data.count(b'\n') <= 100000)
+
+    def test_quote_data(self):
+        """
+        test that messages are converted to CRLF, dot-stuffed and
+        terminated before being sent after DATA
+        """
+        from mailer.mailer import _quote_data
+
+        self.assertEqual(_quote_data('a\n.b\r\nc\rd'),
+                         b'a\r\n..b\r\nc\r\nd\r\n.\r\n')
+        self.assertEqual(_quote_data(b'.\r\n'), b'..\r\n.\r\n')
+
+    def test_send_many(self):
+        """
+        check that send_many sends every message, with and without
+        PIPELINING, and reports refused recipients per message
+        """
+        from email import message_from_string
+
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        messages = [
+            (['a@example.com'], 'first', 'body'),
+            {'recipients': ['b@example.com', 'bad@example.com'],
+             'subject': 'second', 'body': 'body', 'cc_recipients': None},
+            (['bad@example.com', 'later@example.com'], 'third', 'body'),
+            ('c@example.com', 'fourth', 'body'),
+        ]
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            for pipelining in (True, False):
+                with SMTPSink(pipelining=pipelining,
+                              refuse=['bad@example.com'],
+                              tempfail=['later@example.com']) as sink:
+                    with mailer.mailer.Mailer('user', 'pass',
+                                              sink.host) as mailer_object:
+                        results = mailer_object.send_many(
+                            message for message in messages)
+
+                self.assertEqual(len(results), 4)
+
+                self.assertTrue(results[0].ok)
+                self.assertEqual(results[0].accepted, ['a@example.com'])
+                self.assertEqual(results[0].refused, {})
+
+                self.assertTrue(results[1].ok)
+                self.assertEqual(results[1].accepted, ['b@example.com'])
+                self.assertEqual(list(results[1].refused), ['bad@example.com'])
+                self.assertEqual(results[1].refused['bad@example.com'][0], 550)
+
+                self.assertFalse(results[2].ok)
+                self.assertEqual(results[2].accepted, [])
+                self.assertEqual(results[2].refused['later@example.com'][0],
+                                 451)
+                self.assertEqual(results[2].error, None)
+
+                self.assertTrue(results[3].ok)
+
+                self.assertEqual([recipients for _, recipients, _
+                                  in sink.messages],
+                                 [['a@example.com'], ['b@example.com'],
+                                  ['c@example.com']])
+
+                subjects = [
+                    message_from_string(data.decode('ascii'))['Subject']
+                    for _, _, data in sink.messages]
+                self.assertEqual(subjects, ['first', 'second', 'fourth'])
+        finally:
+            mailer.mailer.SMTP = smtp
+
+    def test_send_many_build_failure(self):
+        """
+        check that a message send_many can't build fails on its own, and
+        the rest of the batch is still sent
+        """
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        messages = [
+            ('a@example.com', 'first', 'body'),
+            {'recipients': 'b@example.com', 'subject': 'second',
+             'body': 'body', 'attachments': '/nonexistent/attachment.txt'},
+            ('c@example.com', 'third', None),
+            ('d@example.com', 'fourth', 'body'),
+        ]
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink() as sink:
+                with mailer.mailer.Mailer('user', 'pass',
+                                          sink.host) as mailer_object:
+                    results = mailer_object.send_many(messages)
+
+            self.assertEqual([result.ok for result in results],
+                             [True, False, False, True])
+            self.assertTrue(isinstance(results[1].error, EnvironmentError))
+            self.assertNotEqual(results[2].error, None)
+            self.assertEqual([recipients for _, recipients, _
+                              in sink.messages],
+                             [['a@example.com'], ['d@example.com']])
+            self.assertEqual(sink.connections, 1)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+    def test_reconnect(self):
+        """
+        check that a dropped session is reconnected and the message sent,
+        unless retries is 0
+        """
+        from os.path import abspath, dirname, join
+        from smtplib import SMTPServerDisconnected
+        import socket
+
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        attachment = join(dirname(abspath(__file__)), 'attachmentA.txt')
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink() as sink:
+                with mailer.mailer.Mailer('user', 'pass',
+                                          sink.host) as mailer_object:
+                    mailer_object.send('a@example.com', 'first', 'body')
+                    sink.drop()
+                    mailer_object.send('b@example.com', 'second', 'body')
+                    sink.drop()
+                    mailer_object.send('c@example.com', 'third', 'body',
+                                       attachments=attachment)
+                    sink.drop()
+                    results = mailer_object.send_many(
+                        [('d@example.com', 'fourth', 'body')])
+
+                self.assertTrue(results[0].ok)
+                self.assertEqual(len(sink.messages), 4)
+                self.assertEqual(sink.connections, 4)
+
+                with mailer.mailer.Mailer('user', 'pass', sink.host,
+                                          retries=0) as mailer_object:
+                    sink.drop()
+                    self.assertRaises((SMTPServerDisconnected, socket.error),
+                                      mailer_object.send, 'e@example.com',
+                                      'fifth', 'body')
+                    self.assertFalse(mailer_object.is_open())
+
+                    # the next message opens a new session
+                    mailer_object.send('e@example.com', 'fifth', 'body')
+
+                self.assertEqual(len(sink.messages), 5)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+    def test_rotation(self):
+        """
+        check that sessions are replaced after max_messages or max_age
+        """
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            # with max_age 0, even the session opened by with is replaced
+            for options, connections in (({'max_messages': 2}, 3),
+                                         ({'max_age': 0}, 6),
+                                         ({'max_age': 60}, 1)):
+                with SMTPSink() as sink:
+                    with mailer.mailer.Mailer('user', 'pass', sink.host,
+                                              **options) as mailer_object:
+                        for index in range(5):
+                            mailer_object.send('to@example.com',
+                                               'subject %d' % index, 'body')
+
+                self.assertEqual(len(sink.messages), 5)
+                self.assertEqual(sink.connections, connections)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+    def test_keepalive(self):
+        """
+        check that idle sessions are kept alive with NOOP until closed
+        """
+        import time
+
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink() as sink:
+                with mailer.mailer.Mailer('user', 'pass', sink.host,
+                                          keepalive=0.02) as mailer_object:
+                    time.sleep(0.2)
+                    self.assertTrue(sink.noops > 0)
+
+                    mailer_object.send('to@example.com', 'subject', 'body')
+
+                noops = sink.noops
+                time.sleep(0.1)
+
+                self.assertEqual(sink.noops, noops)
+                self.assertEqual(sink.connections, 1)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+    def test_max_recipients(self):
+        """
+        check that long recipient lists are sent in envelopes grouped by
+        domain, with refusals merged
+        """
+        from smtplib import SMTPRecipientsRefused
+
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        recipients = ['user%d@%s.example.com' % (index, 'abc'[index % 3])
+                      for index in range(25)]
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink(max_recipients=10,
+                          refuse=['user0@a.example.com',
+                                  'user1@b.example.com']) as sink:
+                with mailer.mailer.Mailer('user', 'pass', sink.host,
+                                          max_recipients=10) as mailer_object:
+                    refused = mailer_object.send(
+                        recipients[:20], 'subject', 'body',
+                        bcc_recipients=recipients[20:])
+
+                    self.assertEqual(sorted(refused), ['user0@a.example.com',
+                                                       'user1@b.example.com'])
+
+                    results = mailer_object.send_many([
+                        (recipients, 'subject', 'body'),
+                        (['user0@a.example.com'] * 12, 'subject', 'body')])
+
+                    self.assertEqual(len(results[0].accepted), 23)
+                    self.assertEqual(len(results[0].refused), 2)
+                    self.assertFalse(results[1].ok)
+
+                    self.assertRaises(SMTPRecipientsRefused,
+                                      mailer_object.send,
+                                      ['user0@a.example.com'] * 12,
+                                      'subject', 'body')
+
+                # the server's own limit refuses the rest
+                with mailer.mailer.Mailer('user', 'pass',
+                                          sink.host) as mailer_object:
+                    refused = mailer_object.send(recipients, 'subject',
+                                                 'body')
+
+                    self.assertEqual(len(refused), 15)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        envelopes = [envelope for _, envelope, _ in sink.messages]
+
+        # (the sink only records accepted recipients)
+        self.assertEqual([len(envelope) for envelope in envelopes],
+                         [8, 10, 5] * 2 + [10])
+        self.assertEqual(sorted(sum(envelopes[:3], [])),
+                         sorted(recipients[2:]))
+        # each domain's recipients are together
+        domains = [recipient.split('@')[1] for recipient in envelopes[0]]
+        self.assertEqual(domains, sorted(domains))
+
+    def test_tls(self):
+        """
+        check that STARTTLS and implicit TLS verify the server with the
+        given context, and that later sessions (including other Mailers')
+        resume the first one's TLS session where python allows
+        """
+        import ssl
+
+        import mailer.mailer
+        from mailer.metrics import InMemoryMetrics
+        from mailer.pool import MailerPool
+        from mailer.bench.smtp_sink import CERTFILE, SMTPSink
+
+        context = ssl.create_default_context(cafile=CERTFILE)
+        resumable = hasattr(ssl, 'SSLSession')
+
+        for implicit_tls in (False, True):
+            metrics = InMemoryMetrics()
+
+            with SMTPSink(certfile=CERTFILE,
+                          implicit_tls=implicit_tls) as sink:
+                # python 2 can't match certificates to ip addresses
+                host = sink.host.replace('127.0.0.1', 'localhost')
+
+                for _ in range(2):
+                    with mailer.mailer.Mailer(
+                            'user', 'pass', host, metrics=metrics,
+                            ssl_context=context,
+                            implicit_tls=implicit_tls) as mailer_object:
+                        mailer_object.send('to@example.com', 'subject',
+                                           'body')
+
+                with MailerPool('user', 'pass', host, size=1,
+                                metrics=metrics, ssl_context=context,
+                                implicit_tls=implicit_tls) as pool:
+                    pool.send('to@example.com', 'subject', 'body')
+
+                # the default context doesn't check the certificate
+                with mailer.mailer.Mailer(
+                        'user', 'pass', sink.host,
+                        implicit_tls=implicit_tls) as mailer_object:
+                    mailer_object.send('to@example.com', 'subject', 'body')
+
+                self.assertRaises(
+                    (ssl.SSLError, ValueError),
+                    mailer.mailer.Mailer(
+                        'user', 'pass', host,
+                        ssl_context=ssl.create_default_context(),
+                        implicit_tls=implicit_tls).open)
+
+            self.assertEqual(len(sink.messages), 4)
+            self.assertEqual(metrics.counter('tls_resumptions'),
+                             2 if resumable else 0)
+
     def test_smtplib_use(self):
         """
         check that Mailer properly uses smtplib (which means that actual
@@ -206,14 +801,14 @@ class TestMailer(unittest.TestCase):
             """
             A fake smtp class to assure that the library is being used
             """
-            def __init__(self, host):
+            def __init__(self, host, port=0):
                 self.host = host
                 self.tls_counter = 0
                 self.close_counter = 0
                 self.username = self.password = None
                 self.sender = self.recipients = self.message = None
 
-            def starttls(self):
+            def starttls(self, context=None):
                 """
                 Make sure tls is started once
                 """
@@ -236,9 +831,15 @@ class TestMailer(unittest.TestCase):
                 """
                 self.close_counter += 1
 
-            def sendmail(self, sender, recipients, message):
+            def ehlo_or_helo_if_needed(self):
                 """
-                make sure sendmail happens after login
+                greeting is a no-op
+                """
+                pass
+
+            def mail(self, sender):
+                """
+                make sure sending happens after login
                 """
                 if (self.tls_counter != 1 or self.close_counter != 0 and
                         self.username is not None and
@@ -246,8 +847,34 @@ class TestMailer(unittest.TestCase):
                     raise ValueError('not started, or stopped before send')
 
                 self.sender = sender
-                self.recipients = recipients
-                self.message = message
+                self.recipients = []
+                self.message = b''
+                return (250, 'OK')
+
+            def rcpt(self, recipient):
+                """
+                accept every recipient
+                """
+                self.recipients.append(recipient)
+                return (250, 'OK')
+
+            def docmd(self, command):  # pylint: disable-msg=W0613
+                """
+                DATA is the only command sent
+                """
+                return (354, 'go ahead')
+
+            def send(self, data):
+                """
+                take part of the message
+                """
+                self.message += data
+
+            def getreply(self):
+                """
+                accept the message
+                """
+                return (250, 'OK')
         # pylint: enable-msg=R0902
 
         from smtplib import SMTP
@@ -260,6 +887,7 @@ class TestMailer(unittest.TestCase):
         self.assertEqual(SMTP, mailer.mailer.SMTP)
 
         mailer.mailer.SMTP = FakeSMTP
+        self.addCleanup(setattr, mailer.mailer, 'SMTP', SMTP)
 
         mailer_object = mailer.mailer.Mailer('user', 'pass', 'host')
         mailer_object.open()
@@ -291,7 +919,7 @@ class TestMailer(unittest.TestCase):
                          ['r1@example.com', 'r2@example.com',
                           cc_addr, bcc_addr])
 
-        self.assertTrue(isinstance(server.message, str))
+        self.assertTrue(server.message.endswith(b'\r\n.\r\n'))
         self.assertEqual(server.close_counter, 0)
 
         mailer_object.close()
@@ -304,7 +932,7 @@ class TestMailer(unittest.TestCase):
         self.assertEqual(server.recipients,
                          ['r1@example.com', 'r2@example.com',
                           cc_addr, bcc_addr])
-        self.assertTrue(isinstance(server.message, str))
+        self.assertTrue(server.message.endswith(b'\r\n.\r\n'))
         self.assertEqual(server.close_counter, 1)
 
         self.assertEqual(mailer_object._server, None)
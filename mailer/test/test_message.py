@@ -0,0 +1,154 @@
+"""
+A collection of unittests for the mailer module's OutgoingMessage object
+"""
+from __future__ import absolute_import
+import sys
+import unittest
+
+# the most bytes an OutgoingMessage with one recipient, sharing its subject
+# and body with others, may take (including its recipient's address)
+BYTES_PER_MESSAGE = 200
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestOutgoingMessage(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's OutgoingMessage
+    object
+    """
+    def test_fields(self):
+        """
+        addresses are stored compactly and read back as tuples
+        """
+        import pickle
+
+        from mailer.message import OutgoingMessage
+
+        message = OutgoingMessage('to@example.com', 'subject', 'body',
+                                  mail_as=''.join(['from', '@example.com']),
+                                  bcc_recipients=['a@example.com',
+                                                  'b@example.com'])
+        other = OutgoingMessage(['to@example.com'], 'subject', 'body',
+                                mail_as='from@example.com')
+
+        self.assertEqual(message.recipients, ('to@example.com',))
+        self.assertEqual(message.cc_recipients, ())
+        self.assertEqual(message.bcc_recipients,
+                         ('a@example.com', 'b@example.com'))
+        self.assertEqual(message.attachments, ())
+        self.assertTrue(message.mail_as is other.mail_as)
+        self.assertFalse(hasattr(message, '__dict__'))
+
+        copy = pickle.loads(pickle.dumps(message))
+
+        self.assertEqual(copy.arguments(), message.arguments())
+        self.assertEqual(other.arguments('ignored')[3], 'from@example.com')
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'needs tracemalloc')
+    def test_memory(self):
+        """
+        a queued message takes no more than BYTES_PER_MESSAGE
+        """
+        import tracemalloc
+
+        from mailer.message import OutgoingMessage
+
+        count = 10000
+        body = 'x' * 10000
+        addresses = ['user%06d@example.com' % index for index in range(count)]
+
+        tracemalloc.start()
+
+        try:
+            before = tracemalloc.take_snapshot()
+            messages = [OutgoingMessage(address, 'subject', body,
+                                        mail_as='sender@example.com')
+                        for address in addresses]
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        used = sum(stat.size_diff for stat in after.compare_to(before,
+                                                               'filename'))
+        # the addresses were made before, but count against the target
+        used += sum(sys.getsizeof(address) for address in addresses)
+
+        self.assertEqual(len(messages), count)
+        self.assertTrue(used / count < BYTES_PER_MESSAGE, used / count)
+
+    def test_sending(self):
+        """
+        send, send_many and the builders accept OutgoingMessages (and
+        nothing else without a subject and body)
+        """
+        from mailer.mailer import (_message_id, build_message_bytes,
+                                   build_message_string, Mailer)
+        from mailer.message import OutgoingMessage
+        from mailer.transport import MemoryTransport
+
+        message = OutgoingMessage('to@example.com', 'subject', 'body',
+                                  cc_recipients='cc@example.com',
+                                  idempotency_key='key')
+
+        self.assertEqual(build_message_string(message, sender='user'),
+                         build_message_string(
+                             ['to@example.com'], 'subject', 'body', 'user',
+                             ['cc@example.com'],
+                             message_id=_message_id('key', 'user')))
+        self.assertTrue(build_message_bytes(message, sender='user').endswith(
+            b'\r\n.\r\n'))
+
+        transport = MemoryTransport()
+        mailer = Mailer('user', 'pass', transport=transport)
+
+        mailer.send(message)
+        results = mailer.send_many([
+            message, OutgoingMessage(['a@example.com', 'b@example.com'],
+                                     's', 'b', mail_as='from@example.com')])
+
+        self.assertTrue(results[0].duplicate is False)
+        self.assertEqual([(sender, recipients) for sender, recipients, _
+                          in transport.messages],
+                         [('user', ['to@example.com', 'cc@example.com']),
+                          ('user', ['to@example.com', 'cc@example.com']),
+                          ('from@example.com',
+                           ['a@example.com', 'b@example.com'])])
+        self.assertTrue(b'Message-ID: <' in transport.messages[0][2])
+
+        # only an OutgoingMessage can leave out the subject and body
+        self.assertRaises(TypeError, build_message_string, ['a@example.com'])
+        self.assertRaises(TypeError, build_message_bytes, ['a@example.com'],
+                          'subject')
+        self.assertRaises(TypeError, mailer.send, 'a@example.com')
+        self.assertFalse(mailer.send_many([('a@example.com',)])[0].ok)
+        self.assertEqual(len(transport.messages), 3)
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestOutgoingMessage tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,118 @@
+"""
+A collection of unittests for the mailer module's metrics collectors
+"""
+from __future__ import absolute_import
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestMetrics(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's metrics collectors
+    """
+    def test_in_memory(self):
+        """
+        counters add up, and timers keep their count, total, min and max
+        """
+        from mailer.metrics import InMemoryMetrics
+
+        metrics = InMemoryMetrics()
+
+        metrics.incr('a')
+        metrics.incr('a', 4)
+        metrics.observe('t', 2.0)
+        metrics.observe('t', 1.0)
+        metrics.observe('t', 3.0)
+
+        with metrics.timer('block'):
+            pass
+
+        self.assertEqual(metrics.counter('a'), 5)
+        self.assertEqual(metrics.counter('b'), 0)
+        self.assertEqual(metrics.timing('t'), {'count': 3, 'total': 6.0,
+                                               'min': 1.0, 'max': 3.0,
+                                               'mean': 2.0})
+        self.assertEqual(metrics.timing('block')['count'], 1)
+        self.assertEqual(metrics.timing('missing'), None)
+        self.assertEqual(sorted(metrics.snapshot()['timers']),
+                         ['block', 't'])
+
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {'counters': {}, 'timers': {}})
+
+    def test_mailer(self):
+        """
+        a Mailer reports each phase of opening and sending
+        """
+        from os.path import abspath, dirname, join
+
+        import mailer.mailer
+        from mailer.metrics import InMemoryMetrics
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        attachment = join(dirname(abspath(__file__)), 'attachmentA.txt')
+        metrics = InMemoryMetrics()
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink(refuse=['bad@example.com']) as sink:
+                mailer_object = mailer.mailer.Mailer('user', 'pass', sink.host,
+                                                     metrics=metrics)
+
+                with mailer_object:
+                    mailer_object.send(['to@example.com', 'bad@example.com'],
+                                       'subject', 'body')
+                    mailer_object.send('to@example.com', 'subject', 'body',
+                                       attachments=attachment)
+
+                # opening again is a reconnect
+                with mailer_object:
+                    mailer_object.send_many([('bad@example.com', 's', 'b'),
+                                             ('to@example.com', 's', 'b')])
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        for name in ('connect', 'starttls', 'login'):
+            self.assertEqual(metrics.timing(name)['count'], 2)
+
+        self.assertEqual(metrics.timing('build')['count'], 4)
+        self.assertEqual(metrics.timing('sendmail')['count'], 4)
+        self.assertEqual(metrics.counter('messages_sent'), 3)
+        self.assertEqual(metrics.counter('refused_recipients'), 2)
+        self.assertEqual(metrics.counter('reconnects'), 1)
+        # messages are counted as sent, with the terminating '.' the sink
+        # strips
+        self.assertEqual(metrics.counter('bytes_sent'),
+                         sum(len(data) + 3 for _, _, data in sink.messages))
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestMetrics tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
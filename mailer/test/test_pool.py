@@ -0,0 +1,253 @@
+"""
+A collection of unittests for the mailer module's MailerPool object
+"""
+from __future__ import absolute_import
+import threading
+import unittest
+
+
+class FakeSMTP(object):
+    """
+    A fake smtp class that records the sessions a pool opens
+    """
+    instances = []
+
+    def __init__(self, host, port=0):
+        self.host = host
+        self.alive = True
+        self.closed = False
+        self.sent = []
+        self._message = None
+        FakeSMTP.instances.append(self)
+
+    def starttls(self, context=None):
+        """
+        tls is a no-op
+        """
+        pass
+
+    def login(self, username, password):
+        """
+        login is a no-op
+        """
+        pass
+
+    def noop(self):
+        """
+        answer 250 while the fake connection is alive
+        """
+        if not self.alive:
+            from smtplib import SMTPServerDisconnected
+
+            raise SMTPServerDisconnected('connection dropped')
+
+        return (250, 'OK')
+
+    def ehlo_or_helo_if_needed(self):
+        """
+        greeting is a no-op
+        """
+        pass
+
+    def mail(self, sender):
+        """
+        start a message, or fail if the connection was dropped
+        """
+        if not self.alive:
+            from smtplib import SMTPServerDisconnected
+
+            raise SMTPServerDisconnected('connection dropped')
+
+        self._message = [sender, [], b'']
+        return (250, 'OK')
+
+    def rcpt(self, recipient):
+        """
+        accept every recipient
+        """
+        self._message[1].append(recipient)
+        return (250, 'OK')
+
+    def docmd(self, command):  # pylint: disable-msg=W0613
+        """
+        DATA is the only command sent
+        """
+        return (354, 'go ahead')
+
+    def send(self, data):
+        """
+        take part of the message
+        """
+        self._message[2] += data
+
+    def getreply(self):
+        """
+        record the message
+        """
+        self.sent.append(tuple(self._message))
+        return (250, 'OK')
+
+    def rset(self):
+        """
+        reset is a no-op
+        """
+        pass
+
+    def close(self):
+        """
+        mark the session closed
+        """
+        self.closed = True
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904, W0212
+class TestMailerPool(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's MailerPool object
+    """
+    def setUp(self):
+        import mailer.mailer
+
+        self._smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = FakeSMTP
+        FakeSMTP.instances = []
+
+    def tearDown(self):
+        import mailer.mailer
+
+        mailer.mailer.SMTP = self._smtp
+
+    def test_checkout_and_checkin(self):
+        """
+        sessions are opened lazily, up to size, and reused once returned
+        """
+        from mailer.pool import MailerPool, PoolTimeout
+
+        pool = MailerPool('user', 'pass', 'host', size=2)
+
+        first = pool.checkout()
+        second = pool.checkout()
+
+        self.assertTrue(first.is_open())
+        self.assertTrue(second.is_open())
+        self.assertFalse(first is second)
+        self.assertEqual(len(FakeSMTP.instances), 2)
+
+        self.assertRaises(PoolTimeout, pool.checkout, 0.01)
+
+        pool.checkin(first)
+        self.assertTrue(pool.checkout() is first)
+        self.assertEqual(len(FakeSMTP.instances), 2)
+
+        pool.checkin(first)
+        pool.checkin(second)
+        pool.close()
+
+        self.assertTrue(all(server.closed for server in FakeSMTP.instances))
+        self.assertRaises(ValueError, pool.checkout)
+
+    def test_idle_health_check(self):
+        """
+        sessions idle for longer than max_idle are checked with NOOP and
+        reconnected if they were dropped
+        """
+        from mailer.pool import MailerPool
+
+        pool = MailerPool('user', 'pass', 'host', size=1, max_idle=0)
+
+        mailer_object = pool.checkout()
+        server = mailer_object._server
+        pool.checkin(mailer_object)
+
+        # a live session is kept
+        self.assertTrue(pool.checkout()._server is server)
+        pool.checkin(mailer_object)
+
+        # a dropped session is replaced
+        server.alive = False
+        self.assertTrue(pool.checkout() is mailer_object)
+        self.assertFalse(mailer_object._server is server)
+        self.assertTrue(server.closed)
+        self.assertEqual(len(FakeSMTP.instances), 2)
+
+    def test_dropped_connection_discarded(self):
+        """
+        a session that fails with a disconnect isn't returned to the pool
+        """
+        from smtplib import SMTPServerDisconnected
+
+        from mailer.pool import MailerPool
+
+        # without retries, so the Mailer doesn't reconnect by itself
+        pool = MailerPool('user', 'pass', 'host', size=1, retries=0)
+
+        pool.send('to@example.com', 'subject', 'body')
+        server = FakeSMTP.instances[0]
+        server.alive = False
+
+        self.assertRaises(SMTPServerDisconnected, pool.send,
+                          'to@example.com', 'subject', 'body')
+        self.assertTrue(server.closed)
+
+        pool.send('to@example.com', 'subject', 'body')
+        self.assertEqual(len(FakeSMTP.instances), 2)
+        self.assertEqual(len(FakeSMTP.instances[1].sent), 1)
+
+    def test_threads(self):
+        """
+        many threads share at most size sessions
+        """
+        from mailer.pool import MailerPool
+
+        pool = MailerPool('user', 'pass', 'host', size=3)
+
+        def worker():
+            """
+            send a few messages through the pool
+            """
+            for _ in range(20):
+                pool.send('to@example.com', 'subject', 'body')
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        pool.close()
+
+        self.assertTrue(len(FakeSMTP.instances) <= 3)
+        self.assertEqual(sum(len(server.sent)
+                             for server in FakeSMTP.instances), 160)
+# pylint: enable-msg=R0904, W0212
+
+
+def run_tests():
+    """
+    Run all TestMailerPool tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,203 @@
+"""
+A collection of unittests for the mailer module's RelaySet object
+"""
+from __future__ import absolute_import
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestRelaySet(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's RelaySet object
+    """
+    def test_weighted(self):
+        """
+        relays are taken in turn, in proportion to their weights
+        """
+        from mailer.relay import Relay, RelaySet
+
+        relays = RelaySet(['a:25', {'host': 'b:25', 'weight': 2}])
+        a_relay, b_relay = relays.relays
+
+        self.assertTrue(isinstance(b_relay, Relay))
+        self.assertEqual(b_relay.weight, 2)
+
+        chosen = [relays.choose().host for _ in range(6)]
+
+        self.assertEqual(chosen.count('a:25'), 2)
+        self.assertEqual(chosen.count('b:25'), 4)
+        # smooth: b never goes three times running
+        self.assertFalse('b:25,b:25,b:25' in ','.join(chosen * 2))
+
+        self.assertEqual(relays.choose(exclude=[a_relay]), b_relay)
+        self.assertEqual(relays.choose(exclude=[a_relay, b_relay]), None)
+
+        self.assertRaises(ValueError, RelaySet, [])
+        self.assertRaises(ValueError, RelaySet, ['a:25'], strategy='random')
+        self.assertRaises(ValueError, Relay, 'a:25', weight=0)
+
+    def test_least_outstanding(self):
+        """
+        the relay with the fewest messages being sent through it for its
+        weight is taken, and then the one with the fewest open sessions
+        """
+        from mailer.relay import LEAST_OUTSTANDING, RelaySet
+
+        relays = RelaySet(['a:25', {'host': 'b:25', 'weight': 2}],
+                          strategy=LEAST_OUTSTANDING)
+        a_relay, b_relay = relays.relays
+
+        for _ in range(6):
+            relays.opened(relays.choose())
+
+        self.assertEqual(relays.sessions(a_relay), 2)
+        self.assertEqual(relays.sessions(b_relay), 4)
+
+        relays.closed(a_relay)
+        relays.closed(a_relay)
+
+        self.assertEqual(relays.choose(), a_relay)
+
+        # a relay slow to get through its messages gets fewer sessions
+        relays.sending(a_relay)
+
+        self.assertEqual(relays.outstanding(a_relay), 1)
+        self.assertEqual(relays.choose(), b_relay)
+
+        relays.sent(a_relay)
+
+        self.assertEqual(relays.outstanding(a_relay), 0)
+        self.assertEqual(relays.choose(), a_relay)
+
+    def test_failed(self):
+        """
+        failing relays are left out until retry_after has passed, unless
+        they are all failing
+        """
+        import time
+
+        from mailer.relay import RelaySet
+
+        relays = RelaySet(['a:25', 'b:25'], retry_after=0.05)
+        a_relay, b_relay = relays.relays
+
+        relays.failed(a_relay)
+
+        self.assertFalse(relays.is_healthy(a_relay))
+        self.assertEqual([relays.choose() for _ in range(3)], [b_relay] * 3)
+
+        relays.failed(b_relay)
+
+        # a is due to be tried again first
+        self.assertEqual(relays.choose(), a_relay)
+
+        time.sleep(0.06)
+
+        self.assertTrue(relays.is_healthy(a_relay))
+        self.assertEqual(set(relays.choose() for _ in range(2)),
+                         set([a_relay, b_relay]))
+
+        relays.failed(a_relay)
+        relays.opened(a_relay)
+
+        self.assertTrue(relays.is_healthy(a_relay))
+
+    def test_failover(self):
+        """
+        a Mailer connects to the next relay when one is down
+        """
+        import socket
+
+        import mailer.mailer
+        from mailer.metrics import InMemoryMetrics
+        from mailer.bench.smtp_sink import (PlainSMTP, refusing_host,
+                                           SMTPSink)
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        metrics = InMemoryMetrics()
+
+        try:
+            with SMTPSink() as sink:
+                relays = [refusing_host(self),
+                          {'host': sink.host, 'username': 'relay'}]
+                sender = mailer.mailer.Mailer('user', 'pass', relays,
+                                              metrics=metrics)
+
+                with sender:
+                    self.assertEqual(sender.relay.host, sink.host)
+                    sender.send('to@example.com', 'subject', 'body')
+
+                self.assertEqual(sender.relay, None)
+
+                # the failed relay is left out of the next session
+                with sender:
+                    sender.send('to@example.com', 'subject', 'body')
+
+                down = mailer.mailer.Mailer('user', 'pass',
+                                            [refusing_host(self),
+                                             refusing_host(self)])
+
+                self.assertRaises(socket.error, down.open)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        self.assertEqual(len(sink.messages), 2)
+        self.assertEqual(metrics.counter('relay_failures'), 1)
+
+    def test_pool(self):
+        """
+        a pool spreads its sessions across its relays
+        """
+        import mailer.mailer
+        from mailer.pool import MailerPool
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink() as first, SMTPSink() as second:
+                with MailerPool('user', 'pass', [first.host, second.host],
+                                size=4) as pool:
+                    mailers = [pool.checkout() for _ in range(4)]
+
+                    for sender in mailers:
+                        sender.send('to@example.com', 'subject', 'body')
+                        pool.checkin(sender)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        self.assertEqual(first.connections, 2)
+        self.assertEqual(len(second.messages), 2)
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestRelaySet tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
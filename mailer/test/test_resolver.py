@@ -0,0 +1,135 @@
+"""
+A collection of unittests for the mailer module's resolvers
+"""
+from __future__ import absolute_import
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestResolvers(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's resolvers
+    """
+    def test_static(self):
+        """
+        a StaticResolver's hosts are given preferences in order, and
+        unknown domains take no mail
+        """
+        from mailer.resolver import StaticResolver
+
+        resolver = StaticResolver({'A.example.com': 'mx.a.example.com',
+                                   'b.example.com': ['mx1', 'mx2'],
+                                   'c.example.com': [(5, 'mx')]}, ttl=60)
+
+        self.assertEqual(resolver.resolve('a.example.com'),
+                         ([(0, 'mx.a.example.com')], 60))
+        self.assertEqual(resolver.resolve('b.example.com'),
+                         ([(0, 'mx1'), (10, 'mx2')], 60))
+        self.assertEqual(resolver.resolve('C.EXAMPLE.COM'),
+                         ([(5, 'mx')], 60))
+        self.assertEqual(resolver.resolve('d.example.com'), ([], 60))
+        self.assertEqual(resolver.lookups, 4)
+
+    def test_caching(self):
+        """
+        answers are remembered for their ttl, capped at max_ttl
+        """
+        import time
+
+        from mailer.resolver import CachingResolver, StaticResolver
+
+        static = StaticResolver({'example.com': 'mx.example.com'}, ttl=0.2)
+        resolver = CachingResolver(static)
+
+        for _ in range(3):
+            records, ttl = resolver.resolve('Example.com')
+
+            self.assertEqual(records, [(0, 'mx.example.com')])
+            self.assertTrue(0 < ttl <= 0.2)
+
+        self.assertEqual(static.lookups, 1)
+
+        time.sleep(0.25)
+        resolver.resolve('example.com')
+
+        self.assertEqual(static.lookups, 2)
+
+        # never cached
+        static = StaticResolver({}, ttl=300)
+        resolver = CachingResolver(static, max_ttl=0)
+        resolver.resolve('example.com')
+        resolver.resolve('example.com')
+
+        self.assertEqual(static.lookups, 2)
+
+    def test_max_entries(self):
+        """
+        the least recently used domains are forgotten beyond max_entries
+        """
+        from mailer.resolver import CachingResolver, StaticResolver
+
+        static = StaticResolver({})
+        resolver = CachingResolver(static, max_entries=2)
+
+        for domain in ['a', 'b', 'a', 'c', 'a', 'b']:
+            resolver.resolve(domain)
+
+        # a stays, as it keeps being used
+        self.assertEqual(static.lookups, 4)
+
+    def test_failure(self):
+        """
+        failed lookups aren't cached
+        """
+        import socket
+
+        from mailer.resolver import CachingResolver, Resolver
+
+        class Failing(Resolver):
+            """
+            fails the first lookup
+            """
+            calls = 0
+
+            def resolve(self, domain):
+                self.calls += 1
+
+                if self.calls == 1:
+                    raise socket.gaierror('SERVFAIL')
+
+                return [(0, 'mx')], 300
+
+        resolver = CachingResolver(Failing())
+
+        self.assertRaises(socket.error, resolver.resolve, 'example.com')
+        self.assertEqual(resolver.resolve('example.com')[0], [(0, 'mx')])
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestResolvers tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,228 @@
+"""
+A collection of unittests for the mailer module's MailQueue object
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904, W0212
+class TestMailQueue(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's MailQueue object
+    """
+    def setUp(self):
+        import mailer.mailer
+        from mailer.bench.smtp_sink import PlainSMTP
+
+        self._smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'queue.db')
+
+    def tearDown(self):
+        import mailer.mailer
+
+        mailer.mailer.SMTP = self._smtp
+        shutil.rmtree(self._directory)
+
+    def test_persistence(self):
+        """
+        messages survive the queue being closed, including ones that were
+        being sent at the time
+        """
+        from mailer.spool import MailQueue
+
+        queue = MailQueue(self._path)
+        first = queue.enqueue('to@example.com', 'first', 'body')
+        queue.enqueue(['to@example.com'], 'second', 'body',
+                      cc_recipients='cc@example.com')
+
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue._claim()[0], first)
+        queue.close()
+
+        queue = MailQueue(self._path)
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue._claim()[0], first)
+        queue.close()
+
+    def test_delivery(self):
+        """
+        background workers deliver every message
+        """
+        from mailer.pool import MailerPool
+        from mailer.spool import MailQueue
+        from mailer.bench.smtp_sink import SMTPSink
+
+        with SMTPSink() as sink:
+            with MailerPool('user', 'pass', sink.host, size=2) as pool:
+                with MailQueue(self._path, poll_interval=0.01) as queue:
+                    queue.start(pool)
+
+                    for index in range(10):
+                        queue.enqueue('to%d@example.com' % index, 'subject',
+                                      'body')
+
+                    deadline = time.time() + 5
+
+                    while len(queue) and time.time() < deadline:
+                        time.sleep(0.01)
+
+                    self.assertEqual(len(queue), 0)
+
+        self.assertEqual(sorted(recipients for _, recipients, _
+                                in sink.messages),
+                         sorted(['to%d@example.com' % index]
+                                for index in range(10)))
+
+    def test_retries(self):
+        """
+        transient failures are retried with backoff, permanent ones and
+        ones that fail too often become dead letters
+        """
+        from mailer.pool import MailerPool
+        from mailer.spool import MailQueue
+        from mailer.bench.smtp_sink import SMTPSink
+
+        with SMTPSink(refuse=['bad@example.com'],
+                      tempfail=['later@example.com']) as sink:
+            with MailerPool('user', 'pass', sink.host, size=1) as pool:
+                queue = MailQueue(self._path, max_attempts=3, retry_delay=0)
+
+                bad = queue.enqueue('bad@example.com', 'subject', 'body')
+                later = queue.enqueue('later@example.com', 'subject', 'body')
+
+                # bad is buried straight away, later is retried
+                self.assertTrue(queue.process(pool))
+                self.assertTrue(queue.process(pool))
+                self.assertEqual([letter[0] for letter
+                                  in queue.dead_letters()], [bad])
+                self.assertEqual(len(queue), 1)
+
+                while queue.process(pool):
+                    pass
+
+                dead = queue.dead_letters()
+
+                self.assertEqual([letter[0] for letter in dead], [bad, later])
+                self.assertEqual(dead[0][2], 1)
+                self.assertEqual(dead[1][1]['recipients'],
+                                 'later@example.com')
+                self.assertEqual(dead[1][2], 3)
+                self.assertTrue('451' in dead[1][3])
+                self.assertEqual(len(queue), 0)
+
+                # once the problem is fixed, dead letters can be resent
+                sink.tempfail.clear()
+                queue.retry_dead_letters()
+
+                while queue.process(pool):
+                    pass
+
+                self.assertEqual([letter[0] for letter
+                                  in queue.dead_letters()], [bad])
+                self.assertEqual(len(sink.messages), 1)
+                queue.close()
+
+    def test_refused_recipients(self):
+        """
+        recipients refused with a 4xx reply are retried on their own (over
+        the same session), and a missing attachment isn't retried
+        """
+        from mailer.pool import MailerPool
+        from mailer.spool import MailQueue
+        from mailer.bench.smtp_sink import SMTPSink
+
+        with SMTPSink(refuse=['bad@example.com'],
+                      tempfail=['later@example.com']) as sink:
+            with MailerPool('user', 'pass', sink.host, size=1) as pool:
+                queue = MailQueue(self._path, max_attempts=3, retry_delay=0)
+
+                queue.enqueue(['a@example.com', 'later@example.com'],
+                              'subject', 'body',
+                              cc_recipients='bad@example.com')
+
+                self.assertTrue(queue.process(pool))
+                self.assertEqual(len(queue), 1)
+                self.assertEqual(sink.messages[0][1], ['a@example.com'])
+
+                # once later@example.com takes mail, only it is sent to
+                sink.tempfail.clear()
+
+                while queue.process(pool):
+                    pass
+
+                self.assertEqual(len(queue), 0)
+                self.assertEqual([recipients for _, recipients, _
+                                  in sink.messages],
+                                 [['a@example.com'], ['later@example.com']])
+                self.assertEqual(queue.dead_letters(), [])
+                self.assertEqual(sink.connections, 1)
+
+                missing = queue.enqueue('b@example.com', 'subject', 'body',
+                                        attachments='/nonexistent.txt')
+
+                self.assertTrue(queue.process(pool))
+                dead = queue.dead_letters()
+
+                self.assertEqual([letter[0] for letter in dead], [missing])
+                self.assertEqual(dead[0][2], 1)
+                self.assertEqual(sink.connections, 1)
+                queue.close()
+
+    def test_backoff(self):
+        """
+        each retry waits twice as long as the last, up to a limit
+        """
+        from smtplib import SMTPServerDisconnected
+
+        from mailer.spool import MailQueue
+
+        queue = MailQueue(self._path, retry_delay=10, max_retry_delay=35)
+        message_id = queue.enqueue('to@example.com', 'subject', 'body')
+
+        for attempts, delay in [(1, 10), (2, 20), (3, 35)]:
+            before = time.time()
+            queue._retry(message_id, attempts, SMTPServerDisconnected())
+            next_attempt = queue._database.execute(
+                'SELECT next_attempt FROM messages').fetchone()[0]
+
+            self.assertTrue(before + delay <= next_attempt <=
+                            time.time() + delay)
+
+        queue.close()
+# pylint: enable-msg=R0904, W0212
+
+
+def run_tests():
+    """
+    Run all TestMailQueue tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
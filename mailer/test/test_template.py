@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+A collection of unittests for the mailer module's MessageTemplate object
+"""
+from __future__ import absolute_import
+import re
+import unittest
+
+
+def _same_message(first, second):
+    """
+    whether two message strings only differ in their MIME boundaries
+    """
+    boundary = re.compile(r'=+\d+==')
+
+    return boundary.sub('', first) == boundary.sub('', second)
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestMessageTemplate(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's MessageTemplate object
+    """
+    def test_render(self):
+        """
+        rendering a template makes the same message as building it, as
+        text or as sent after DATA
+        """
+        from os.path import abspath, dirname, join
+
+        from mailer.mailer import build_message_bytes, build_message_string
+        from mailer.template import MessageTemplate
+
+        attachment_a = join(dirname(abspath(__file__)), 'attachmentA.txt')
+        attachment_b = join(dirname(abspath(__file__)), 'attachmentB.txt')
+
+        cases = [
+            ({}, {}),
+            ({'cc_recipients': 'cc@example.com',
+              'bcc_recipients': ['bcc@example.com']}, {}),
+            ({'attachments': [attachment_a, attachment_b]},
+             {'name': 'a much longer name, which makes the subject line '
+                      'too long to fit in a single header line'}),
+            ({'attachments': attachment_a}, {'name': u'Zoë'}),
+        ]
+
+        for options, fields in cases:
+            template = MessageTemplate('Hello $name', 'Dear $name,\n$text',
+                                       'from@example.com', **options)
+
+            fields.setdefault('name', 'Ann')
+            fields['text'] = 'the text'
+
+            options.setdefault('attachments', None)
+
+            if options['attachments'] == attachment_a:
+                options['attachments'] = [attachment_a]
+
+            for recipients in (['to@example.com'],
+                               ['to1@example.com', 'to2@example.com']):
+                arguments = (
+                    recipients, 'Hello %s' % fields['name'],
+                    'Dear %s,\nthe text' % fields['name'],
+                    'from@example.com',
+                    [options['cc_recipients']]
+                    if 'cc_recipients' in options else None,
+                    options.get('bcc_recipients'), options['attachments'])
+
+                self.assertTrue(_same_message(
+                    template.render(recipients, **fields),
+                    build_message_string(*arguments)))
+                self.assertTrue(_same_message(
+                    template.render_bytes(recipients,
+                                          **fields).decode('utf-8'),
+                    build_message_bytes(*arguments).decode('utf-8')))
+
+        self.assertRaises(KeyError, template.render, 'to@example.com')
+
+    def test_send_merge(self):
+        """
+        send_merge sends the template to every row
+        """
+        from email import message_from_string
+
+        import mailer.mailer
+        from mailer.template import MessageTemplate
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+
+        template = MessageTemplate('Hello $name', 'Dear $name',
+                                   'from@example.com',
+                                   bcc_recipients='bcc@example.com')
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        try:
+            with SMTPSink(refuse=['bad@example.com']) as sink:
+                with mailer.mailer.Mailer('user', 'pass',
+                                          sink.host) as mailer_object:
+                    results = mailer_object.send_merge(template, [
+                        ('a@example.com', {'name': 'Ann'}),
+                        (['b@example.com', 'bad@example.com'],
+                         {'name': 'Bob'}),
+                    ])
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(list(results[1].refused), ['bad@example.com'])
+
+        self.assertEqual([(sender, recipients) for sender, recipients, _
+                          in sink.messages],
+                         [('from@example.com',
+                           ['a@example.com', 'bcc@example.com']),
+                          ('from@example.com',
+                           ['b@example.com', 'bcc@example.com'])])
+
+        message = message_from_string(sink.messages[1][2].decode('ascii'))
+
+        self.assertEqual(message['Subject'], 'Hello Bob')
+        self.assertEqual(message['To'], 'b@example.com, bad@example.com')
+        self.assertEqual(message.get_payload(decode=True), b'Dear Bob')
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestMessageTemplate tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
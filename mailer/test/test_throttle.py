@@ -0,0 +1,148 @@
+"""
+A collection of unittests for the mailer module's RateLimiter object
+"""
+from __future__ import absolute_import
+import time
+import unittest
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904, W0212
+class TestRateLimiter(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's RateLimiter object
+    """
+    def test_pacing(self):
+        """
+        messages are spaced out at the rate, after a burst
+        """
+        from mailer.throttle import RateLimiter
+
+        self.assertRaises(ValueError, RateLimiter, 0)
+
+        limiter = RateLimiter(50, burst=2)
+        start = time.time()
+
+        for _ in range(7):
+            limiter.acquire()
+
+        # the first two are free, then one every 20ms
+        self.assertTrue(time.time() - start >= 0.09)
+
+        limiter = RateLimiter(3600, per=3600)
+
+        self.assertEqual(limiter.rate, 3600)
+        self.assertEqual(limiter.acquire(), 0)
+        self.assertTrue(0.9 < limiter.acquire() <= 1)
+
+    def test_adaptive(self):
+        """
+        the rate is cut when the server pushes back, and creeps back up as
+        messages are accepted
+        """
+        from mailer.throttle import RateLimiter
+
+        limiter = RateLimiter(100, min_rate=10, increase=10, cooldown=0)
+
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 50)
+
+        limiter.throttled()
+        limiter.throttled()
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 10)
+
+        limiter.success()
+        self.assertEqual(limiter.rate, 20)
+
+        for _ in range(20):
+            limiter.success()
+
+        self.assertEqual(limiter.rate, 100)
+
+        # push back from messages already in flight counts once
+        limiter = RateLimiter(100, cooldown=60)
+        limiter.throttled()
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 50)
+
+        # after backing off, the next message waits
+        self.assertTrue(limiter.acquire() > 0)
+
+    def test_mailer(self):
+        """
+        a Mailer waits for its rate limiter, and backs it off on transient
+        refusals (but not on a missing attachment)
+        """
+        import mailer.mailer
+        from mailer.metrics import InMemoryMetrics
+        from mailer.bench.smtp_sink import PlainSMTP, SMTPSink
+        from mailer.throttle import RateLimiter
+
+        smtp = mailer.mailer.SMTP
+        mailer.mailer.SMTP = PlainSMTP
+
+        limiter = RateLimiter(100, burst=1, increase=1)
+        metrics = InMemoryMetrics()
+
+        try:
+            with SMTPSink(tempfail=['busy@example.com']) as sink:
+                with mailer.mailer.Mailer('user', 'pass', sink.host,
+                                          metrics=metrics,
+                                          rate_limiter=limiter) as sender:
+                    for _ in range(3):
+                        sender.send('to@example.com', 'subject', 'body')
+
+                    self.assertEqual(limiter.rate, 100)
+
+                    self.assertRaises(EnvironmentError, sender.send,
+                                      'to@example.com', 'subject', 'body',
+                                      attachments='/nonexistent.txt')
+                    self.assertEqual(limiter.rate, 100)
+
+                    results = sender.send_many([('busy@example.com', 's',
+                                                 'b')])
+
+                    self.assertFalse(results[0].ok)
+                    self.assertEqual(limiter.rate, 50)
+
+                    sender.send('to@example.com', 'subject', 'body')
+
+                    self.assertEqual(limiter.rate, 51)
+        finally:
+            mailer.mailer.SMTP = smtp
+
+        self.assertEqual(len(sink.messages), 4)
+        self.assertEqual(metrics.counter('throttled'), 1)
+        self.assertEqual(metrics.counter('reconnects'), 0)
+        self.assertEqual(sink.connections, 1)
+        self.assertTrue(metrics.timing('throttle')['count'] >= 3)
+# pylint: enable-msg=R0904, W0212
+
+
+def run_tests():
+    """
+    Run all TestRateLimiter tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,320 @@
+"""
+A collection of unittests for the mailer module's transports
+"""
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+ATTACHMENT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'attachmentA.txt')
+
+
+# unittest.TestCase isn't liked by pylint. Ignore its errors.
+# pylint: disable-msg=R0904
+class TestTransports(unittest.TestCase):
+    """
+    A collection of unittests for the mailer module's transports
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory(self):
+        """
+        a Mailer with a transport hands it the messages send, send_many
+        and send_merge build
+        """
+        from email import message_from_string
+
+        from mailer.mailer import build_message_string, Mailer
+        from mailer.metrics import InMemoryMetrics
+        from mailer.template import MessageTemplate
+        from mailer.transport import MemoryTransport
+
+        transport = MemoryTransport()
+        metrics = InMemoryMetrics()
+
+        with Mailer('user', 'pass', transport=transport,
+                    metrics=metrics) as mailer:
+            self.assertTrue(mailer.is_open())
+
+            mailer.send('to@example.com', 'subject', 'body',
+                        bcc_recipients='bcc@example.com',
+                        attachments=ATTACHMENT)
+            results = mailer.send_many([('a@example.com', 's', 'b'),
+                                        {'recipients': 'b@example.com',
+                                         'subject': 's', 'body': 'b'}])
+            template = MessageTemplate('Hi $name', 'Hello $name',
+                                       'from@example.com')
+            mailer.send_merge(template, [('c@example.com', {'name': 'C'})])
+
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual([recipients for _, recipients, _ in
+                          transport.messages],
+                         [['to@example.com', 'bcc@example.com'],
+                          ['a@example.com'], ['b@example.com'],
+                          ['c@example.com']])
+        self.assertEqual(transport.messages[3][0], 'from@example.com')
+
+        sender, _, message = transport.messages[0]
+        message = message_from_string(message.decode('ascii'))
+
+        self.assertEqual(sender, 'user')
+        self.assertFalse(b'\r\n' in transport.messages[1][2])
+
+        with open(ATTACHMENT, 'rb') as attachment:
+            self.assertEqual(message.get_payload()[1].get_payload(decode=True),
+                             attachment.read())
+
+        self.assertEqual(len(transport.messages[1][2]), len(
+            build_message_string(['a@example.com'], 's', 'b', 'user')))
+        self.assertEqual(metrics.counter('messages_sent'), 4)
+        self.assertEqual(metrics.counter('bytes_sent'),
+                         sum(len(data) for _, _, data in transport.messages))
+        self.assertEqual(metrics.timing('sendmail')['count'], 4)
+
+    def test_maildir(self):
+        """
+        messages are written to tmp/ and moved to new/, with their sender
+        as Return-Path
+        """
+        from email import message_from_string
+
+        from mailer.mailer import Mailer
+        from mailer.transport import MaildirTransport
+
+        path = os.path.join(self.directory, 'Maildir')
+        transport = MaildirTransport(path)
+
+        with Mailer('user', 'pass', transport=transport) as mailer:
+            for index in range(3):
+                mailer.send('to@example.com', 'subject %d' % index, 'body')
+
+        self.assertEqual(sorted(os.listdir(path)), ['cur', 'new', 'tmp'])
+        self.assertEqual(os.listdir(os.path.join(path, 'tmp')), [])
+
+        names = os.listdir(os.path.join(path, 'new'))
+
+        self.assertEqual(len(set(names)), 3)
+
+        with open(os.path.join(path, 'new', names[0])) as delivered:
+            message = message_from_string(delivered.read())
+
+        self.assertEqual(message['Return-Path'], '<user>')
+        self.assertEqual(message['To'], 'to@example.com')
+
+    def test_pickup_directory(self):
+        """
+        messages are dropped as .eml files with CRLF line endings and the
+        envelope in X-Sender and X-Receiver headers
+        """
+        from mailer.mailer import Mailer
+        from mailer.transport import PickupDirectoryTransport
+
+        path = os.path.join(self.directory, 'Pickup')
+        transport = PickupDirectoryTransport(path, fsync=True)
+
+        with Mailer('user', 'pass', transport=transport) as mailer:
+            mailer.send('to@example.com', 'subject', 'body',
+                        bcc_recipients='bcc@example.com')
+
+        names = os.listdir(path)
+
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names[0].endswith('.eml'))
+
+        with open(os.path.join(path, names[0]), 'rb') as dropped:
+            data = dropped.read()
+
+        self.assertTrue(data.startswith(
+            b'X-Sender: <user>\r\nX-Receiver: <to@example.com>\r\n'
+            b'X-Receiver: <bcc@example.com>\r\n'))
+        self.assertEqual(data.count(b'\n'), data.count(b'\r\n'))
+
+    def test_failed_write(self):
+        """
+        a message that fails part way leaves no file behind
+        """
+        from mailer.transport import MaildirTransport
+
+        path = os.path.join(self.directory, 'Maildir')
+        transport = MaildirTransport(path)
+
+        def chunks():
+            """
+            part of a message, then a failure
+            """
+            yield b'Subject: half\n'
+            raise IOError('attachment went missing')
+
+        self.assertRaises(IOError, transport.send, 'from@example.com',
+                          ['to@example.com'], chunks())
+        self.assertEqual(os.listdir(os.path.join(path, 'tmp')), [])
+        self.assertEqual(os.listdir(os.path.join(path, 'new')), [])
+
+    def test_direct(self):
+        """
+        recipients are grouped by domain and delivered to each domain's
+        mail server, over pooled connections, using STARTTLS if offered
+        """
+        from email import message_from_string
+
+        from mailer.mailer import Mailer
+        from mailer.resolver import CachingResolver, StaticResolver
+        from mailer.bench.smtp_sink import CERTFILE, SMTPSink
+        from mailer.transport import DirectTransport
+
+        with SMTPSink(certfile=CERTFILE, refuse=['nobody@a.example.com']) \
+                as sink_a, SMTPSink(pipelining=False) as sink_b:
+            static = StaticResolver({'a.example.com': sink_a.host,
+                                     'b.example.com': [(10, sink_b.host)]})
+            transport = DirectTransport(CachingResolver(static))
+
+            with Mailer('from@example.com', None,
+                        transport=transport) as mailer:
+                refused = mailer.send(
+                    ['one@a.example.com', 'one@b.example.com',
+                     'nobody@a.example.com'], 'subject', 'body',
+                    bcc_recipients=['two@A.example.com',
+                                    'someone@c.example.com'])
+
+                self.assertEqual(sorted(refused), ['nobody@a.example.com',
+                                                   'someone@c.example.com'])
+                self.assertEqual(refused['someone@c.example.com'][0], 550)
+
+                mailer.send('three@a.example.com', 'again', 'body')
+
+        self.assertEqual([recipients for _, recipients, _ in
+                          sink_a.messages],
+                         [['one@a.example.com', 'two@A.example.com'],
+                          ['three@a.example.com']])
+        self.assertEqual([recipients for _, recipients, _ in
+                          sink_b.messages], [['one@b.example.com']])
+        self.assertEqual(sink_a.messages[0][2], sink_b.messages[0][2])
+
+        message = message_from_string(sink_b.messages[0][2].decode('ascii'))
+
+        self.assertEqual(message['Subject'], 'subject')
+        self.assertEqual(message['To'], 'one@a.example.com, '
+                         'one@b.example.com, nobody@a.example.com')
+
+        # one connection for both messages, and one lookup per domain
+        self.assertEqual(sink_a.connections, 1)
+        self.assertEqual(static.lookups, 3)
+
+    def test_direct_fallback(self):
+        """
+        a domain's servers are tried in order of preference until one
+        takes the message, and a server dropping an idle connection is
+        reconnected to
+        """
+        from smtplib import SMTPRecipientsRefused
+
+        from mailer.resolver import StaticResolver
+        from mailer.bench.smtp_sink import refusing_host, SMTPSink
+        from mailer.transport import DirectTransport
+
+        with SMTPSink() as backup, SMTPSink(tempfail=['to@example.com']) \
+                as busy:
+            resolver = StaticResolver({'example.com': [
+                (10, refusing_host(self)), (20, busy.host),
+                (30, backup.host)]})
+            transport = DirectTransport(resolver)
+
+            self.assertEqual(transport.send('from@example.com',
+                                            ['to@example.com'], 'message'),
+                             {})
+
+            backup.drop()
+
+            self.assertEqual(transport.send('from@example.com',
+                                            ['to@example.com'], 'message'),
+                             {})
+            transport.close()
+
+            # every server failing refuses with the last one's reply
+            transport = DirectTransport(StaticResolver(
+                {'example.com': [refusing_host(self), busy.host]}))
+
+            try:
+                transport.send('from@example.com', ['to@example.com'],
+                               'message')
+            except SMTPRecipientsRefused as error:
+                self.assertEqual(error.recipients['to@example.com'][0], 451)
+            else:
+                self.fail('the message was delivered')
+
+        self.assertEqual(len(backup.messages), 2)
+        self.assertEqual(backup.connections, 2)
+        self.assertEqual(busy.messages, [])
+
+    def test_direct_broken_tls(self):
+        """
+        a server whose STARTTLS fails is sent to in the clear, unless the
+        ssl context verifies certificates
+        """
+        from smtplib import SMTPRecipientsRefused
+        import ssl
+
+        from mailer.resolver import StaticResolver
+        from mailer.bench.smtp_sink import CERTFILE, SMTPSink
+        from mailer.transport import DirectTransport
+
+        with SMTPSink(certfile=CERTFILE, broken_tls=True) as sink:
+            resolver = StaticResolver({'example.com': sink.host})
+            transport = DirectTransport(resolver)
+
+            self.assertEqual(transport.send('from@example.com',
+                                            ['to@example.com'], 'message'),
+                             {})
+            transport.close()
+
+            transport = DirectTransport(
+                resolver, ssl_context=ssl.create_default_context())
+
+            try:
+                transport.send('from@example.com', ['to@example.com'],
+                               'message')
+            except SMTPRecipientsRefused as error:
+                self.assertEqual(error.recipients['to@example.com'][0], 451)
+            else:
+                self.fail('the message was sent in the clear')
+
+            transport.close()
+
+        self.assertEqual([recipients for _, recipients, _
+                          in sink.messages], [['to@example.com']])
+        self.assertEqual(sink.connections, 3)
+# pylint: enable-msg=R0904
+
+
+def run_tests():
+    """
+    Run all TestTransports tests.
+    """
+    # This code pushes mailer onto the path if necessary, so testing
+    # can be done without installation. It is duplicated accross all
+    # mailer.test files so they each can be run independantly.
+    # Unfortunately pylint can't locally disble the associated Warning.
+    # Leaving the disable in, for when they fix that bug.
+    # pylint: disable-msg=R0801
+    import imp
+
+    try:
+        imp.find_module('mailer')
+    except ImportError:
+        from os.path import dirname, abspath
+        from sys import path
+
+        path.append(dirname(dirname(dirname(abspath(__file__)))))
+    # pylint: enable-msg=R0801
+
+    unittest.main()
+
+
+if __name__ == '__main__':
+    run_tests()
@@ -0,0 +1,125 @@
+"""
+The RateLimiter class limits how fast a Mailer (or every Mailer in a
+MailerPool) sends, slowing down when the server pushes back and speeding
+up again as messages are accepted.
+"""
+from __future__ import absolute_import, division
+import threading
+import time
+
+from .metrics import _TIMER
+
+
+class RateLimiter(object):
+    """
+    The RateLimiter class is a token bucket: a message may be sent for each
+    token, and tokens are added at the current rate, up to burst of them.
+
+    The current rate adapts (additive increase, multiplicative decrease):
+    each time the server signals it is overloaded (a 4xx reply or a
+    dropped connection) it is cut by backoff, and each accepted message
+    raises it by increase, back up to rate. So sending settles just under
+    what the server accepts, rather than swinging between flooding it and
+    a storm of errors.
+
+    One RateLimiter is safe to share between threads, and so between the
+    Mailers of a MailerPool (pass it as rate_limiter, and the pool hands it
+    to each Mailer). Give each host its own.
+    """
+    # pylint: disable-msg=R0902, R0913
+    def __init__(self, rate, per=1, burst=1, min_rate=None, backoff=0.5,
+                 increase=None, cooldown=1):
+        """
+        rate: the most messages to send per period, which is what sending
+              starts at.
+        per: the length of the period, in seconds (so rate=100, per=3600
+             is 100 messages an hour). Default: 1
+        burst: the most messages that may be sent at once after sending
+               has been idle. Default: 1
+        min_rate: the least messages per period that backing off goes
+                  down to. If None, a hundredth of rate. Default: None
+        backoff: what the current rate is multiplied by when the server
+                 pushes back. Default: 0.5
+        increase: the messages per period the current rate goes up by for
+                  each accepted message. If None, a twentieth of rate.
+                  Default: None
+        cooldown: the seconds after backing off during which further
+                  push back is ignored, as messages that were already
+                  being sent report it too. Default: 1
+        """
+        if rate <= 0 or per <= 0:
+            raise ValueError('rate and per must be positive')
+
+        self._max_rate = rate / per
+        self._min_rate = (rate / 100 if min_rate is None else min_rate) / per
+        self._increase = (rate / 20 if increase is None else increase) / per
+        self._burst = burst
+        self._backoff = backoff
+        self._cooldown = cooldown
+        self._per = per
+
+        self._lock = threading.Lock()
+        self._rate = self._max_rate
+        self._tokens = burst
+        self._updated = _TIMER()
+        self._backed_off = None
+    # pylint: enable-msg=R0913
+
+    @property
+    def rate(self):
+        """
+        The current rate, in messages per period
+        """
+        return self._rate * self._per
+
+    def acquire(self):
+        """
+        Wait until a message may be sent, and take its token. Returns the
+        seconds waited.
+        """
+        with self._lock:
+            self._refill()
+            # the token is taken now, even if it isn't there yet, so
+            # waiting threads are served in turn
+            self._tokens -= 1
+            wait = 0 if self._tokens >= 0 else -self._tokens / self._rate
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+    def throttled(self):
+        """
+        Report that the server pushed back: slow down, and wait a whole
+        interval before the next message
+        """
+        with self._lock:
+            now = _TIMER()
+
+            if (self._backed_off is not None and
+                    now - self._backed_off < self._cooldown):
+                return
+
+            self._refill()
+            self._rate = max(self._rate * self._backoff, self._min_rate)
+            self._tokens = min(self._tokens, 0)
+            self._backed_off = now
+
+    def success(self):
+        """
+        Report that a message was accepted: speed up, up to rate
+        """
+        with self._lock:
+            self._refill()
+            self._rate = min(self._rate + self._increase, self._max_rate)
+
+    def _refill(self):
+        """
+        Add the tokens earned since the last update, at the current rate
+        """
+        now = _TIMER()
+        self._tokens = min(self._tokens + (now - self._updated) * self._rate,
+                           self._burst)
+        self._updated = now
+# pylint: enable-msg=R0902
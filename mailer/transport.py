@@ -0,0 +1,469 @@
+"""
+Transports are where a Mailer puts messages instead of sending them to its
+relay: a maildir, an MTA's pickup directory, straight to each recipient's
+own mail servers, or (for tests) a list in memory. They let messages be
+generated as fast as the disk takes them, for a local MTA to deliver.
+"""
+from __future__ import absolute_import
+from collections import OrderedDict
+import itertools
+import os
+import random
+from smtplib import (SMTP, SMTPException, SMTPRecipientsRefused,
+                     SMTPResponseException)
+import socket
+import ssl
+import threading
+import time
+
+import six
+
+from .mailer import (_any_transient, _default_ssl_context, _is_dropped,
+                     _pipelined_sendmail, _quote_data, _split_host, _starttls,
+                     _streaming_sendmail, _to_bytes)
+from .resolver import CachingResolver, DNSResolver
+
+# files are written through a buffer this big, so a message goes to disk in
+# a few large writes however small its chunks are
+_BUFFER_SIZE = 256 * 1024
+
+
+class Transport(object):
+    """
+    The Transport class is the interface a Mailer's transport has.
+    Subclass it and override send (and open and close, if the transport
+    has anything to set up or tear down).
+    """
+    def open(self):
+        """
+        Get ready to take messages. Called by Mailer.open.
+        """
+        pass
+
+    def close(self):
+        """
+        Finish taking messages. Called by Mailer.close.
+        """
+        pass
+
+    def send(self, sender, recipients, message):
+        """
+        Take a message.
+
+        sender: the envelope sender
+        recipients: the list of envelope recipients
+        message: the message, as made by build_message_string, either as
+                 a string or an iterable of strings (as
+                 build_message_chunks yields them). Strings may be text
+                 or bytes; text is sent encoded as UTF-8.
+
+        Returns a dict of the recipients that were refused, as smtplib's
+        sendmail does.
+        """
+        raise NotImplementedError
+
+
+class MemoryTransport(Transport):
+    """
+    The MemoryTransport class keeps messages in a list, for tests.
+
+    messages: a list of (sender, recipients, message) tuples, with each
+              message as a byte string
+    """
+    def __init__(self):
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def send(self, sender, recipients, message):
+        message = _join(message)
+
+        with self._lock:
+            self.messages.append((sender, list(recipients), message))
+
+        return {}
+
+
+class _FileTransport(Transport):
+    """
+    Writes each message to a new file, atomically: it is written under a
+    temporary name and renamed once complete, so whatever picks files up
+    never sees half a message.
+    """
+    def __init__(self, fsync=False):
+        self._fsync = fsync
+        self._hostname = socket.gethostname().replace('/', '_').replace(
+            ':', '_')
+        self._counter = itertools.count()
+
+    def send(self, sender, recipients, message):
+        temporary, final = self._paths(self._unique_name())
+
+        try:
+            with open(temporary, 'wb', _BUFFER_SIZE) as output:
+                for chunk in self._contents(sender, recipients, message):
+                    output.write(chunk)
+
+                if self._fsync:
+                    output.flush()
+                    os.fsync(output.fileno())
+
+            os.rename(temporary, final)
+        except:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+            raise
+
+        return {}
+
+    def _unique_name(self):
+        """
+        A file name no other message (from any process) has
+        """
+        now = time.time()
+
+        return '%d.M%dP%dQ%d.%s' % (now, (now % 1) * 1000000, os.getpid(),
+                                    next(self._counter), self._hostname)
+
+    def _paths(self, name):
+        """
+        The temporary and final paths to write a message to
+        """
+        raise NotImplementedError
+
+    def _contents(self, sender, recipients, message):
+        """
+        The bytes to write for a message
+        """
+        raise NotImplementedError
+
+
+class MaildirTransport(_FileTransport):
+    """
+    The MaildirTransport class delivers messages into a maildir: each is
+    written to tmp/ and moved into new/, with the sender as its
+    Return-Path.
+    """
+    def __init__(self, path, create=True, fsync=False):
+        """
+        path: the maildir's directory
+        create: whether to create the maildir (and its tmp, new and cur
+                directories) if it doesn't exist. Default: True
+        fsync: whether to flush each message to disk before it is moved
+               into new/, so it survives a crash. Slower. Default: False
+        """
+        _FileTransport.__init__(self, fsync)
+        self.path = path
+
+        if create:
+            for directory in ('tmp', 'new', 'cur'):
+                _make_directory(os.path.join(path, directory))
+
+    def _paths(self, name):
+        return (os.path.join(self.path, 'tmp', name),
+                os.path.join(self.path, 'new', name))
+
+    def _contents(self, sender, recipients, message):
+        yield b'Return-Path: <' + _to_bytes(sender) + b'>\n'
+
+        for chunk in _chunks(message):
+            yield chunk
+
+
+class PickupDirectoryTransport(_FileTransport):
+    """
+    The PickupDirectoryTransport class drops messages into an MTA's pickup
+    directory (as IIS and Exchange have), as .eml files with CRLF line
+    endings. The envelope goes in X-Sender and X-Receiver headers, so
+    blind copies are delivered too.
+    """
+    def __init__(self, path, create=True, fsync=False):
+        """
+        path: the pickup directory
+        create: whether to create the directory if it doesn't exist.
+                Default: True
+        fsync: whether to flush each message to disk before it is renamed
+               to .eml, so it survives a crash. Slower. Default: False
+        """
+        _FileTransport.__init__(self, fsync)
+        self.path = path
+
+        if create:
+            _make_directory(path)
+
+    def _paths(self, name):
+        path = os.path.join(self.path, name)
+
+        return path + '.tmp', path + '.eml'
+
+    def _contents(self, sender, recipients, message):
+        yield b'X-Sender: <' + _to_bytes(sender) + b'>\r\n'
+
+        for recipient in recipients:
+            yield b'X-Receiver: <' + _to_bytes(recipient) + b'>\r\n'
+
+        # the builder only uses LF line endings
+        for chunk in _chunks(message):
+            yield chunk.replace(b'\n', b'\r\n')
+
+
+class DirectTransport(Transport):
+    """
+    The DirectTransport class delivers messages straight to the mail
+    servers of each recipient's domain (their MX records), instead of
+    through a relay. Recipients are grouped by domain, and each domain's
+    servers are tried in order of preference until one takes the message.
+    A server refusing it with a 5xx reply is final; a 4xx reply or failing
+    to connect moves on to the next. Each message is quoted for the wire
+    once, and the same bytes sent to every domain.
+
+    Connections are pooled per server (up to max_idle are kept open
+    between messages) and STARTTLS is used whenever a server offers it.
+    Unless ssl_context verifies certificates, TLS is opportunistic: if the
+    handshake fails, the message is sent in the clear instead.
+    Connections are taken from the pool for one message at a time, so a
+    DirectTransport is safe to share between threads (and so between the
+    Mailers of a MailerPool).
+    """
+    # pylint: disable-msg=R0913
+    def __init__(self, resolver=None, local_hostname=None, ssl_context=None,
+                 starttls=True, max_idle=2, timeout=60):
+        """
+        resolver: the Resolver to look up mail servers with. If None, a
+                  CachingResolver over a DNSResolver (which needs
+                  dnspython). Default: None
+        local_hostname: the name to greet servers with (many check that it
+                        resolves to the address mail comes from). If None,
+                        the machine's fully qualified name. Default: None
+        ssl_context: the ssl.SSLContext to secure connections with. If
+                     None, one that (like smtplib's) doesn't verify
+                     certificates, as most mail servers' couldn't be.
+                     With a context that does verify them, a server
+                     whose TLS fails isn't sent to. Default: None
+        starttls: whether to use STARTTLS when a server offers it.
+                  Default: True
+        max_idle: the most connections to keep open to each server between
+                  messages. Default: 2
+        timeout: the seconds to wait for a server. Default: 60
+        """
+        self._resolver = CachingResolver(DNSResolver()) if resolver is None \
+            else resolver
+        self._local_hostname = local_hostname
+        self._ssl_context = ssl_context
+        self._starttls = starttls
+        self._max_idle = max_idle
+        self._timeout = timeout
+
+        # host: its idle connections
+        self._idle = {}
+        self._lock = threading.Lock()
+    # pylint: enable-msg=R0913
+
+    def close(self):
+        """
+        Close the idle connections
+        """
+        with self._lock:
+            idle = [server for servers in self._idle.values()
+                    for server in servers]
+            self._idle = {}
+
+        for server in idle:
+            try:
+                server.quit()
+            except (SMTPException, socket.error):
+                server.close()
+
+    def send(self, sender, recipients, message):
+        """
+        Deliver a message to each recipient's mail servers. Returns a dict
+        of the refused recipients; SMTPRecipientsRefused is raised if every
+        recipient was refused.
+        """
+        message = _quote_data(_join(message))
+
+        domains = OrderedDict()
+
+        for recipient in recipients:
+            domain = recipient.rpartition('@')[2].lower()
+            domains.setdefault(domain, OrderedDict())[recipient] = None
+
+        refused = {}
+
+        for domain, envelope in domains.items():
+            refused.update(self._deliver(domain, sender, list(envelope),
+                                         message))
+
+        if len(refused) == sum(len(envelope)
+                               for envelope in domains.values()):
+            raise SMTPRecipientsRefused(refused)
+
+        return refused
+
+    def _deliver(self, domain, sender, recipients, message):
+        """
+        Send a message to one domain's recipients, trying its servers in
+        order of preference. Returns the refused recipients.
+        """
+        try:
+            records, _ = self._resolver.resolve(domain)
+        except socket.error as error:
+            return _refuse(recipients, 451, 'looking up %s failed: %s'
+                           % (domain, error))
+
+        if not records:
+            return _refuse(recipients, 550, '%s takes no mail' % domain)
+
+        # servers with the same preference are shared out at random
+        records = sorted(records,
+                         key=lambda record: (record[0], random.random()))
+        refused = None
+
+        for _, host in records:
+            try:
+                return self._sendmail(host, sender, recipients, message)
+            except SMTPRecipientsRefused as error:
+                refused = error.recipients
+
+                if not _any_transient(refused):
+                    return refused
+            except SMTPResponseException as error:
+                refused = _refuse(recipients, error.smtp_code,
+                                  error.smtp_error)
+
+                if error.smtp_code >= 500:
+                    return refused
+            except (SMTPException, socket.error) as error:
+                refused = _refuse(recipients, 451, 'delivering to %s '
+                                  'failed: %s' % (host, error))
+
+        return refused
+
+    def _sendmail(self, host, sender, recipients, message):
+        """
+        Send a message over a pooled connection to host, and put the
+        connection back. An idle connection the server has since dropped
+        is replaced with a new one.
+        """
+        while True:
+            server, reused = self._checkout(host)
+
+            try:
+                if server.has_extn('pipelining'):
+                    refused = _pipelined_sendmail(server, sender, recipients,
+                                                  message)
+                else:
+                    refused = _streaming_sendmail(server, sender, recipients,
+                                                  [message])
+            except (SMTPException, socket.error) as error:
+                if not _is_dropped(error):
+                    self._checkin(host, server)
+                    raise
+
+                server.close()
+
+                if not reused:
+                    raise
+
+                continue
+
+            self._checkin(host, server)
+
+            return refused
+
+    def _checkout(self, host):
+        """
+        A connection to host: an idle one, or a new one. Returns it, and
+        whether it was idle.
+        """
+        with self._lock:
+            idle = self._idle.get(host)
+
+            if idle:
+                return idle.pop(), True
+
+        hostname, port = _split_host(host)
+        server = SMTP(hostname, port, self._local_hostname, self._timeout)
+
+        try:
+            server.ehlo()
+
+            if self._starttls and server.has_extn('starttls'):
+                context = self._ssl_context
+
+                if context is None:
+                    context = _default_ssl_context()
+
+                try:
+                    _starttls(server, context, hostname, None)
+                    server.ehlo()
+                except (ssl.SSLError, SMTPResponseException):
+                    if context.verify_mode != ssl.CERT_NONE:
+                        raise
+
+                    # the failed handshake leaves the session unusable,
+                    # so the message goes over a new one, in the clear
+                    server.close()
+                    server = SMTP(hostname, port, self._local_hostname,
+                                  self._timeout)
+                    server.ehlo()
+        except:
+            server.close()
+            raise
+
+        return server, False
+
+    def _checkin(self, host, server):
+        """
+        Put a connection to host back in the pool, or close it if the pool
+        is full
+        """
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+
+            if len(idle) < self._max_idle:
+                idle.append(server)
+                return
+
+        try:
+            server.quit()
+        except (SMTPException, socket.error):
+            server.close()
+
+
+def _refuse(recipients, code, reply):
+    """
+    Refuse every recipient with a reply
+    """
+    if isinstance(reply, six.text_type):
+        reply = reply.encode('utf-8')
+
+    return dict((recipient, (code, reply)) for recipient in recipients)
+
+
+def _chunks(message):
+    """
+    A message as an iterable of byte strings
+    """
+    if isinstance(message, (six.binary_type, six.text_type)):
+        return [_to_bytes(message)]
+
+    return (_to_bytes(chunk) for chunk in message)
+
+
+def _join(message):
+    """
+    A message as one byte string
+    """
+    return b''.join(_chunks(message))
+
+
+def _make_directory(path):
+    """
+    Create a directory (and its parents) if it doesn't exist
+    """
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
@@ -6,7 +6,8 @@ setup(
     version='0.2.0',
     author='Brendan Curran-Johnson',
     author_email='brendan.curran.johnson@invenia.ca',
-    packages=['mailer', 'mailer.test'],
+    packages=['mailer', 'mailer.bench', 'mailer.test'],
+    package_data={'mailer.bench': ['*.pem']},
     scripts=[],  # don't forget to add a script
     url='https://pip.invenia.ca/sample/mailer',
     license='LICENSE.txt',